@@ -0,0 +1,87 @@
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+# Compares read latency and disk footprint of ExternalApiBase cache storage formats
+# (raw, zlib, lzma, with and without deduplication) on synthetic PvGis TMY frames and Google DSM rasters.
+#
+# usage: python scripts/benchmark_cache_codecs.py [entries] [repeats]
+
+ENTRIES = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+# cache files are written to runtimedata in the current working directory
+work_directory = tempfile.mkdtemp(prefix="aiecommon_benchmark_")
+os.chdir(work_directory)
+
+from aiecommon.SolarUtils.PvGis import PvGis
+from aiecommon.SolarUtils.GoogleSolarApi import GoogleSolarApi
+
+FORMATS = [
+    ("raw", None, None, False),
+    ("zlib-1", "zlib", 1, False),
+    ("lzma-0", "lzma", 0, False),
+    ("zlib-1-dedup", "zlib", 1, True),
+]
+
+def make_tmy(seed):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2018-01-01 00:10", periods=8760, freq="h", tz="Europe/Copenhagen")
+    hours = np.arange(8760)
+    daylight = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None)
+    return pd.DataFrame({
+        "temp_air": 8 + 10 * np.sin(hours / 8760 * 2 * np.pi) + rng.normal(0, 2, 8760),
+        "relative_humidity": rng.uniform(40, 100, 8760),
+        "ghi": 600 * daylight * rng.uniform(0.2, 1, 8760),
+        "dni": 700 * daylight * rng.uniform(0, 1, 8760),
+        "dhi": 200 * daylight * rng.uniform(0.3, 1, 8760),
+        "IR(h)": rng.uniform(250, 350, 8760),
+        "wind_speed": rng.uniform(0, 12, 8760),
+        "wind_direction": rng.uniform(0, 360, 8760),
+        "pressure": rng.uniform(98000, 103000, 8760),
+    }, index=index)
+
+def make_dsm(seed):
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.linspace(0, 8, 1000), np.linspace(0, 8, 1000))
+    surface = (20 + 3 * np.sin(x) * np.cos(y) + (rng.random((1000, 1000)) > 0.97) * 6).astype("float32")
+    image_stream = io.BytesIO()
+    Image.fromarray(surface).save(image_stream, format="TIFF")
+    return image_stream.getvalue()
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names if not name.endswith((".lock", ".manifest")))
+
+def benchmark(api_class, make_params, payloads):
+    print(f"\n{api_class.API_IDENTIFIER}: {ENTRIES} entries ({len(payloads)} distinct payloads), {REPEATS} reads each")
+    print(f"{'format':<16}{'disk MB':>10}{'write ms':>10}{'read ms':>10}")
+    for name, codec, level, deduplicate in FORMATS:
+        api_class.CACHE_CODEC, api_class.CACHE_CODEC_LEVEL, api_class.CACHE_DEDUPLICATE = codec, level, deduplicate
+        folder = os.path.dirname(api_class._get_cache_file_path(make_params(0)))
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+
+        start = time.perf_counter()
+        for entry in range(ENTRIES):
+            api_class._write_cache(api_class._get_cache_file_path(make_params(entry)), payloads[entry % len(payloads)], make_params(entry))
+        write_ms = (time.perf_counter() - start) / ENTRIES * 1000
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            for entry in range(ENTRIES):
+                api_class._read_cache(api_class._get_cache_file_path(make_params(entry)), make_params(entry))
+        read_ms = (time.perf_counter() - start) / ENTRIES / REPEATS * 1000
+
+        print(f"{name:<16}{folder_size(folder) / 1024**2:>10.2f}{write_ms:>10.2f}{read_ms:>10.2f}")
+
+# overlapping Google requests often return identical rasters, so half of the DSM payloads are duplicates
+benchmark(PvGis, lambda entry: {"latitude": 55 + entry / 100, "longitude": 12.0, "country_code": "DK"}, [make_tmy(seed) for seed in range(ENTRIES)])
+benchmark(GoogleSolarApi, lambda entry: {"latitude": 55 + entry / 100, "longitude": 12.0, "radius_meters": 50, "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM}, [make_dsm(seed) for seed in range(max(1, ENTRIES // 2))])
+
+shutil.rmtree(work_directory, ignore_errors=True)
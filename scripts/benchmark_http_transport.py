@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import statistics
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Compares per-request latency of module-level requests.get (new connection per call, as GoogleSolarApi did)
+# with the pooled HttpTransport, against a local keep-alive HTTP server standing in for the Google endpoints.
+# A local server has no TLS and no network round trip, real savings per request are larger (TCP + TLS handshake).
+#
+# usage: python scripts/benchmark_http_transport.py [requests] [payload_kb] [concurrency]
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+PAYLOAD_KB = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+PAYLOAD = b"x" * PAYLOAD_KB * 1024
+
+# logs are written to the current working directory
+work_directory = tempfile.mkdtemp(prefix="aiecommon_benchmark_")
+os.chdir(work_directory)
+
+from aiecommon.SolarUtils.HttpTransport import HttpTransport
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, with Nagle's algorithm kept-alive connections stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, *args):
+        pass
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+server.daemon_threads = True
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = f"http://127.0.0.1:{server.server_port}/tiff"
+
+def timed(get):
+    start = time.perf_counter()
+    response = get(url, params={"key": "benchmark"}, timeout=(10, 60))
+    assert response.status_code == 200 and len(response.content) == len(PAYLOAD)
+    return time.perf_counter() - start
+
+def benchmark(name, get):
+    # warm up (and open pooled connections)
+    for _ in range(CONCURRENCY):
+        timed(get)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        latencies = sorted(executor.map(lambda _: timed(get), range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{name:<24}{statistics.mean(latencies) * 1000:>10.3f}{latencies[len(latencies) // 2] * 1000:>10.3f}{latencies[int(len(latencies) * 0.95)] * 1000:>10.3f}{REQUESTS / elapsed:>12.0f}")
+
+print(f"{REQUESTS} GET requests of {PAYLOAD_KB} KB, {CONCURRENCY} concurrent (like the parallel DSM/MASK downloads)")
+print(f"{'transport':<24}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>12}")
+benchmark("requests.get", requests.get)
+benchmark("HttpTransport", HttpTransport(pool_maxsize=CONCURRENCY).get)
+
+server.shutdown()
+shutil.rmtree(work_directory, ignore_errors=True)
@@ -0,0 +1,81 @@
+import gc
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# Compares the pickle and the columnar (memory-mapped) PvGis cache formats on synthetic TMY frames:
+# time to load a cached frame, to load it and use one column / all columns, and heap memory held by the loaded frames.
+# Memory-mapped values live in the page cache (shared between processes), not in the heap.
+#
+# usage: python scripts/benchmark_pvgis_cache_format.py [entries] [repeats]
+
+ENTRIES = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+# cache files are written to runtimedata in the current working directory
+work_directory = tempfile.mkdtemp(prefix="aiecommon_benchmark_")
+os.chdir(work_directory)
+
+from aiecommon.SolarUtils.PvGis import PvGis
+
+def make_tmy(seed):
+    rng = np.random.default_rng(seed)
+    # hourly TMY in local time, shifted by the 10 minute PVGIS offset (as PvGis._fetch returns it)
+    index = pd.date_range("2018-01-01 00:00", "2018-12-31 23:00", freq="h", tz="Europe/Copenhagen") + pd.to_timedelta(10, unit="min")
+    hours = np.arange(len(index))
+    daylight = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None)
+    return pd.DataFrame({
+        "temp_air": 8 + 10 * np.sin(hours / 8760 * 2 * np.pi) + rng.normal(0, 2, len(index)),
+        "relative_humidity": rng.uniform(40, 100, len(index)),
+        "ghi": 600 * daylight * rng.uniform(0.2, 1, len(index)),
+        "dni": 700 * daylight * rng.uniform(0, 1, len(index)),
+        "dhi": 200 * daylight * rng.uniform(0.3, 1, len(index)),
+        "IR(h)": rng.uniform(250, 350, len(index)),
+        "wind_speed": rng.uniform(0, 12, len(index)),
+        "wind_direction": rng.uniform(0, 360, len(index)),
+        "pressure": rng.uniform(98000, 103000, len(index)),
+    }, index=index)
+
+def make_params(entry):
+    return {"latitude": 55 + entry / 100, "longitude": 12.0, "country_code": "DK"}
+
+def timed_ms(function):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for entry in range(ENTRIES):
+            function(PvGis._read_cache(PvGis._get_cache_file_path(make_params(entry)), make_params(entry)))
+    return (time.perf_counter() - start) / ENTRIES / REPEATS * 1000
+
+def held_heap_mb():
+    gc.collect()
+    tracemalloc.start()
+    frames = [PvGis._read_cache(PvGis._get_cache_file_path(make_params(entry)), make_params(entry)) for entry in range(ENTRIES)]
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del frames
+    return held / ENTRIES / 1024**2
+
+frames = [make_tmy(seed) for seed in range(ENTRIES)]
+
+print(f"{ENTRIES} TMY frames ({frames[0].shape[0]} rows x {frames[0].shape[1]} columns), {REPEATS} reads each")
+print(f"{'format':<12}{'file KB':>10}{'load ms':>10}{'1 col ms':>10}{'all ms':>10}{'heap MB':>10}")
+for cache_format in (PvGis.CACHE_FORMAT_PICKLE, PvGis.CACHE_FORMAT_COLUMNAR):
+    PvGis.CACHE_FORMAT = cache_format
+    folder = os.path.dirname(PvGis._get_cache_file_path(make_params(0)))
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    for entry in range(ENTRIES):
+        PvGis._write_cache(PvGis._get_cache_file_path(make_params(entry)), frames[entry], make_params(entry))
+
+    file_kb = os.path.getsize(PvGis._get_cache_file_path(make_params(0))) / 1024
+    load_ms = timed_ms(lambda frame: None)
+    one_column_ms = timed_ms(lambda frame: frame["ghi"].sum())
+    all_columns_ms = timed_ms(lambda frame: frame.sum())
+    print(f"{cache_format:<12}{file_kb:>10.0f}{load_ms:>10.3f}{one_column_ms:>10.3f}{all_columns_ms:>10.3f}{held_heap_mb():>10.3f}")
+
+shutil.rmtree(work_directory, ignore_errors=True)
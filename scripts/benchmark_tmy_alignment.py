@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# Compares the speed and peak memory of PvGis.align_tmy and the pandas pipeline it replaced in PvGis._fetch
+# (reindex, shift, bfill().ffill().interpolate(method='nearest'), duplicate removal), on synthetic raw PVGIS TMY data
+# (UTC timestamps, as returned by pvlib) in several timezones. That both give the same frames is checked by tests/test_align_tmy.py.
+#
+# usage: python scripts/benchmark_tmy_alignment.py [repeats]
+
+REPEATS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+work_directory = tempfile.mkdtemp(prefix="aiecommon_benchmark_")
+os.chdir(work_directory)
+
+from aiecommon.SolarUtils.PvGis import PvGis
+from tests.test_align_tmy import TIMEZONES, make_raw_tmy, align_tmy_pandas, align_tmy
+
+def timed_ms(function, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        function(*args)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+def peak_kb(function, *args):
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+cases = []
+for tz in TIMEZONES:
+    delays = PvGis.get_tmy_minute_offsets(0, 0, {})
+    cases.append((f"{tz}", make_raw_tmy(1), tz, delays))
+    cases.append((f"{tz} gaps", make_raw_tmy(2, missing_rows=50, nan_values=200), tz, delays))
+    # offsets that map two hours to the same timestamp
+    uneven_delays = np.where(np.arange(len(delays)) % 500 == 0, 70, delays)
+    cases.append((f"{tz} duplicates", make_raw_tmy(3), tz, uneven_delays))
+cases.append(("CET unsorted", make_raw_tmy(4).sample(frac=1, random_state=0), "CET", PvGis.get_tmy_minute_offsets(0, 0, {})))
+cases.append(("CET all NaN column", make_raw_tmy(5).assign(dhi=np.nan), "CET", PvGis.get_tmy_minute_offsets(0, 0, {})))
+
+print(f"pandas {pd.__version__}, numpy {np.__version__}, {REPEATS} repeats")
+print(f"{'case':<28} {'pandas ms':>10} {'align ms':>9} {'pandas peak KB':>15} {'align peak KB':>14}")
+for name, raw_tmy, tz, delays in cases:
+    print(
+        f"{name:<28} {timed_ms(align_tmy_pandas, raw_tmy, tz, delays):>10.2f} {timed_ms(align_tmy, raw_tmy, tz, delays):>9.2f}"
+        f" {peak_kb(align_tmy_pandas, raw_tmy, tz, delays):>15.0f} {peak_kb(align_tmy, raw_tmy, tz, delays):>14.0f}"
+    )
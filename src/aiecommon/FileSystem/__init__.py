@@ -1,3 +1,5 @@
 from .google_drive import GoogleDrive
 from .local_runtime_files import LocalRuntimeFiles
 from .local_data_files import LocalDataFiles
+from .file_lock import FileLock
+from .cache_janitor import CacheJanitor, CacheQuota
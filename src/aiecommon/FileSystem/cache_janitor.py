@@ -0,0 +1,422 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from aiecommon import custom_logger
+logger = custom_logger.get_logger()
+from .file_system_base import FileSystemBase
+from .file_lock import FileLock
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+
+class CacheQuota:
+    """
+    Limits for one folder of runtime files (including its subfolders).
+
+    directory - folder to manage
+    max_bytes - files are evicted in LRU order (by access time) until the folder is smaller, no limit if None
+    ttl_seconds - files not accessed for longer than this are evicted, no limit if None
+    """
+
+    _SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    _TIME_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+    def __init__(self, directory: str, max_bytes: int | None = None, ttl_seconds: float | None = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+    def __repr__(self):
+        return f"CacheQuota(directory={self.directory}, max_bytes={self.max_bytes}, ttl_seconds={self.ttl_seconds})"
+
+    @staticmethod
+    def parse(spec: str, base_directory: str | None = None):
+        """
+        Parse "FOLDER=MAX_BYTES[:TTL]", e.g. "storage/local_runtime_files/pvgis=2G:30d" or "cache/google_drive=:12h".
+        Relative folders are resolved against base_directory (runtimedata folder by default).
+        """
+        directory, _, limits = spec.partition("=")
+        max_bytes_spec, _, ttl_spec = limits.partition(":")
+
+        if base_directory is None:
+            base_directory = FileSystemBase._get_data_directory()
+        directory = os.path.join(base_directory, directory.strip())
+
+        return CacheQuota(
+            directory,
+            max_bytes=CacheQuota._parse_with_unit(max_bytes_spec, CacheQuota._SIZE_UNITS, spec),
+            ttl_seconds=CacheQuota._parse_with_unit(ttl_spec, CacheQuota._TIME_UNITS, spec),
+        )
+
+    @staticmethod
+    def parse_list(specs: str, base_directory: str | None = None):
+        """
+        Parse comma separated quota specifications, see parse()
+        """
+        return [CacheQuota.parse(spec, base_directory) for spec in specs.split(",") if spec.strip()]
+
+    @staticmethod
+    def _parse_with_unit(value: str, units: dict, spec: str):
+        value = value.strip()
+        if not value:
+            return None
+        match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([a-zA-Z]?)", value)
+        unit = match.group(2) if match else None
+        if unit not in units:
+            unit = unit.upper() if unit else unit
+        if not match or unit not in units:
+            raise ValueError(f"CacheQuota: invalid value {value} in quota specification {spec}")
+        return int(float(match.group(1)) * units[unit])
+
+
+class CacheJanitor:
+    """
+    Evicts runtime files by TTL and by per-folder byte quotas, in LRU order of access time.
+    Can run once (run_once) or periodically in a background thread (start/stop).
+
+    A file is evicted together with its sidecars (files named after it, see SIDECAR_SUFFIXES), they count
+    towards the quota and a use of any of them counts as a use of the file. A file is evicted while holding
+    its FileLock, files locked by a writer are skipped and the lock file is removed with them.
+
+    Blobs of deduplicated cache files (BLOB_FOLDER, see CacheStorage) are counted once and evicted when the
+    last cache file referring to them is evicted. Temporary files of writes in progress (TEMP_FILE_SUFFIX)
+    and blobs not referred to yet are only evicted when they are older than TEMP_FILE_GRACE_SECONDS.
+    """
+
+    # files named after a file plus one of these suffixes are evicted with it, the longest suffix wins
+    SIDECAR_SUFFIXES = [
+        # FileLock files
+        FileLock.LOCK_FILE_SUFFIX,
+        # ExternalApiBase cache manifests
+        ".manifest",
+        # GoogleSolarApi decoded rasters
+        ".npy",
+        ".npy.json",
+    ]
+    TEMP_FILE_SUFFIX = ".tmp"
+    TEMP_FILE_GRACE_SECONDS = 3600
+    # layout of deduplicated cache files, see CacheStorage: a reference file holds BLOB_REFERENCE_MAGIC and the
+    # sha256 of the payload, the blob is BLOB_FOLDER/<first 2 characters of the hash>/<hash> next to it
+    BLOB_FOLDER = CacheStorage.BLOB_FOLDER
+    BLOB_REFERENCE_MAGIC = CacheStorage.REFERENCE_MAGIC
+    BLOB_REFERENCE_SIZE = len(BLOB_REFERENCE_MAGIC) + 64
+
+    def __init__(self, quotas: list, interval_seconds: float = 600):
+        self.quotas = quotas
+        self.interval_seconds = interval_seconds
+        self.total_stats = CacheJanitor._empty_stats()
+        self.runs = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            "scanned_files": 0,
+            "scanned_bytes": 0,
+            "expired_files": 0,
+            "evicted_entries": 0,
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "skipped_files": 0,
+            "remaining_bytes": 0,
+            "errors": 0,
+        }
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-janitor", daemon=True)
+        self._thread.start()
+        logger.info(f"CacheJanitor: started, interval_seconds={self.interval_seconds}, quotas={self.quotas}")
+
+    def stop(self, timeout: float | None = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        logger.info(f"CacheJanitor: stopped, runs={self.runs}, total_stats={self.total_stats}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f"CacheJanitor: eviction run failed, exception={e}")
+            self._stop.wait(self.interval_seconds)
+
+    def run_once(self, dry_run: bool = False) -> dict:
+        """
+        Apply all quotas once, returns statistics per folder and totals
+        """
+        stats = {"folders": {}, "total": CacheJanitor._empty_stats(), "dry_run": dry_run}
+
+        for quota in self.quotas:
+            folder_stats = self._apply_quota(quota, dry_run)
+            stats["folders"][quota.directory] = folder_stats
+            for name, value in folder_stats.items():
+                stats["total"][name] += value
+
+        if not dry_run:
+            self.runs += 1
+            for name, value in stats["total"].items():
+                if name != "remaining_bytes":
+                    self.total_stats[name] += value
+            self.total_stats["remaining_bytes"] = stats["total"]["remaining_bytes"]
+
+        logger.info(f"CacheJanitor: eviction run finished, dry_run={dry_run}, total={stats['total']}")
+        return stats
+
+    def get_stats(self) -> dict:
+        return {"runs": self.runs, **self.total_stats}
+
+    def _apply_quota(self, quota: CacheQuota, dry_run: bool) -> dict:
+        stats = CacheJanitor._empty_stats()
+        now = time.time()
+
+        entries, stale_lock_paths = self._collect_entries(quota.directory, now, stats)
+
+        remaining_bytes = stats["scanned_bytes"]
+        # blobs still referred to are evicted with their last reference
+        candidates = [entry for entry in entries if entry["references"] == 0]
+        # least recently used first
+        candidates.sort(key=lambda entry: entry["last_access"])
+
+        for entry in candidates:
+            expired = quota.ttl_seconds is not None and now - entry["last_access"] > quota.ttl_seconds
+            over_quota = quota.max_bytes is not None and remaining_bytes > quota.max_bytes
+            if not expired and not over_quota:
+                continue
+            if entry["is_blob"] and now - entry["mtime"] < self.TEMP_FILE_GRACE_SECONDS:
+                # the reference may still be written
+                stats["skipped_files"] += len(entry["files"])
+                continue
+            if not self._evict(entry, dry_run, stats):
+                continue
+            remaining_bytes -= entry["size"]
+            if expired:
+                stats["expired_files"] += len(entry["files"])
+
+            blob = entry["blob"]
+            if blob is not None:
+                blob["references"] -= 1
+                if blob["references"] == 0 and self._evict(blob, dry_run, stats):
+                    remaining_bytes -= blob["size"]
+
+        if not dry_run:
+            for lock_path in stale_lock_paths:
+                self._remove_stale_lock(lock_path, stats)
+
+        stats["remaining_bytes"] = remaining_bytes
+        logger.info(f"CacheJanitor: applied quota, quota={quota}, stats={stats}")
+        return stats
+
+    def _collect_entries(self, directory: str, now: float, stats: dict):
+        """
+        Entries (a file with its sidecars) under directory, with the blobs they refer to resolved,
+        and the lock files of files that don't exist (left by processes that were killed)
+        """
+        entries = []
+        blobs = {}
+        stale_lock_paths = []
+
+        for directory_path, file_stats in self._scan(directory, stats):
+            is_blob_folder = os.path.basename(os.path.dirname(directory_path)) == self.BLOB_FOLDER
+            directory_entries = {}
+            sidecars = []
+
+            for file_name, file_stat in file_stats.items():
+                stats["scanned_files"] += 1
+                stats["scanned_bytes"] += file_stat.st_size
+
+                owner = self._get_owner(file_name, file_stats)
+                if owner is not None:
+                    sidecars.append((owner, file_name))
+                elif file_name.endswith(self.TEMP_FILE_SUFFIX) and now - file_stat.st_mtime < self.TEMP_FILE_GRACE_SECONDS:
+                    stats["skipped_files"] += 1
+                elif file_name.endswith(FileLock.LOCK_FILE_SUFFIX):
+                    stale_lock_paths.append(os.path.join(directory_path, file_name))
+                else:
+                    entry = CacheJanitor._new_entry(os.path.join(directory_path, file_name), is_blob_folder and not file_name.endswith(self.TEMP_FILE_SUFFIX))
+                    CacheJanitor._add_file(entry, entry["path"], file_stat)
+                    entry["mtime"] = file_stat.st_mtime
+                    directory_entries[file_name] = entry
+                    if entry["is_blob"]:
+                        blobs[entry["path"]] = entry
+
+            for owner, file_name in sidecars:
+                CacheJanitor._add_file(directory_entries[owner], os.path.join(directory_path, file_name), file_stats[file_name])
+
+            entries.extend(directory_entries.values())
+
+        for entry in entries:
+            if entry["is_blob"] or entry["files"][0][1].st_size != self.BLOB_REFERENCE_SIZE:
+                continue
+            blob = blobs.get(self._get_referenced_blob_path(entry["path"], stats))
+            if blob is not None:
+                entry["blob"] = blob
+                blob["references"] += 1
+
+        return entries, stale_lock_paths
+
+    @staticmethod
+    def _new_entry(path: str, is_blob: bool) -> dict:
+        return {"path": path, "files": [], "size": 0, "last_access": 0, "mtime": 0, "is_blob": is_blob, "blob": None, "references": 0}
+
+    @staticmethod
+    def _add_file(entry: dict, file_path: str, file_stat: os.stat_result):
+        entry["files"].append((file_path, file_stat))
+        entry["size"] += file_stat.st_size
+        entry["last_access"] = max(entry["last_access"], file_stat.st_atime, file_stat.st_mtime)
+
+    def _get_owner(self, file_name: str, file_stats: dict) -> str | None:
+        """
+        Name of the file file_name is a sidecar of, None if it's not a sidecar of an existing file
+        """
+        for suffix in sorted(self.SIDECAR_SUFFIXES, key=len, reverse=True):
+            if file_name.endswith(suffix) and len(file_name) > len(suffix):
+                owner = file_name[:-len(suffix)]
+                if owner in file_stats:
+                    # e.g. the lock file of a raster
+                    return self._get_owner(owner, file_stats) or owner
+        return None
+
+    def _get_referenced_blob_path(self, file_path: str, stats: dict) -> str | None:
+        try:
+            with open(file_path, "rb") as file:
+                header = file.read(self.BLOB_REFERENCE_SIZE)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"CacheJanitor: cannot read file, file_path={file_path}, exception={e}")
+            stats["errors"] += 1
+            return None
+        if not header.startswith(self.BLOB_REFERENCE_MAGIC):
+            return None
+        content_hash = header[len(self.BLOB_REFERENCE_MAGIC):].decode(errors="replace")
+        return os.path.join(os.path.dirname(file_path), self.BLOB_FOLDER, content_hash[:2], content_hash)
+
+    def _scan(self, directory: str, stats: dict):
+        """
+        (directory path, file name -> stat) of directory and its subfolders
+        """
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"CacheJanitor: cannot scan directory, directory={directory}, exception={e}")
+            stats["errors"] += 1
+            return
+
+        file_stats = {}
+        subdirectories = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    file_stats[entry.name] = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                # removed while scanning
+                continue
+
+        yield directory, file_stats
+        for subdirectory in subdirectories:
+            yield from self._scan(subdirectory, stats)
+
+    def _evict(self, entry: dict, dry_run: bool, stats: dict) -> bool:
+        """
+        Remove the files of entry while holding its lock, False if it's locked (e.g. being written) or can't be removed
+        """
+        if not dry_run:
+            lock = FileLock.for_file(entry["path"])
+            if not lock.acquire(timeout=0):
+                logger.info(f"CacheJanitor: file is locked, not evicting it, file_path={entry['path']}")
+                stats["skipped_files"] += len(entry["files"])
+                return False
+            try:
+                if not self._remove_files(entry, stats):
+                    return False
+            finally:
+                # removes the lock file
+                lock.release()
+
+        stats["evicted_entries"] += 1
+        stats["evicted_files"] += len(entry["files"])
+        stats["evicted_bytes"] += entry["size"]
+        return True
+
+    def _remove_files(self, entry: dict, stats: dict) -> bool:
+        file_path, file_stat = entry["files"][0]
+        try:
+            if entry["is_blob"] and os.stat(file_path).st_mtime_ns != file_stat.st_mtime_ns:
+                # CacheStorage touches a blob when a cache file starts referring to it
+                logger.info(f"CacheJanitor: blob was used again, not evicting it, file_path={file_path}")
+                stats["skipped_files"] += len(entry["files"])
+                return False
+            os.remove(file_path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"CacheJanitor: cannot evict file, file_path={file_path}, exception={e}")
+            stats["errors"] += 1
+            return False
+
+        lock_file_path = file_path + FileLock.LOCK_FILE_SUFFIX
+        for sidecar_path, _ in entry["files"][1:]:
+            if sidecar_path == lock_file_path:
+                continue
+            try:
+                os.remove(sidecar_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"CacheJanitor: cannot evict file, file_path={sidecar_path}, exception={e}")
+                stats["errors"] += 1
+        return True
+
+    def _remove_stale_lock(self, lock_path: str, stats: dict):
+        """
+        Remove a lock file left behind, unless it's locked
+        """
+        lock = FileLock(lock_path)
+        if not lock.acquire(timeout=0):
+            return
+        # removes the lock file
+        lock.release()
+        stats["evicted_files"] += 1
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m aiecommon.FileSystem.cache_janitor",
+        description="Evict runtime files by TTL and per-folder byte quotas (LRU by access time).",
+    )
+    parser.add_argument("quotas", nargs="*", help="FOLDER=MAX_BYTES[:TTL], FOLDER relative to the runtimedata folder, e.g. storage/local_runtime_files/pvgis=2G:30d")
+    parser.add_argument("--base-directory", default=None, help="folder the quota folders are relative to (default: runtimedata in current working directory)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be evicted")
+    parser.add_argument("--interval", type=float, default=None, help="keep running, evicting every INTERVAL seconds")
+    args = parser.parse_args(argv)
+
+    quota_specs = ",".join(args.quotas) or os.getenv("AIENERGY_CACHE_QUOTAS", "")
+    quotas = CacheQuota.parse_list(quota_specs, args.base_directory)
+    if not quotas:
+        parser.error("no quotas given (pass them as arguments or set AIENERGY_CACHE_QUOTAS)")
+
+    janitor = CacheJanitor(quotas, args.interval or 0)
+
+    while True:
+        stats = janitor.run_once(dry_run=args.dry_run)
+        print(json.dumps(stats, indent=2))
+        if not args.interval:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+import weakref
+from aiecommon import custom_logger
+logger = custom_logger.get_logger()
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the lock is then only effective between threads of one process
+    fcntl = None
+
+class FileLock:
+    """
+    Exclusive lock on a lock file, effective between threads of one process and,
+    where fcntl is available, between processes on the same host.
+
+    Usage:
+        with FileLock(cache_file_path + ".lock"):
+            ...
+
+    The lock file is removed on release, while it's still locked. A process that was waiting on the removed
+    file (or that opened it before it was removed) sees that the path no longer refers to the file it locked,
+    and locks the new file instead, so removing lock files doesn't break the lock.
+    """
+
+    LOCK_FILE_SUFFIX = ".lock"
+    _POLL_INTERVAL = 0.05
+
+    # lock file path -> thread lock, kept while a FileLock of the path exists
+    __thread_locks = weakref.WeakValueDictionary()
+    __thread_locks_guard = threading.Lock()
+
+    def __init__(self, lock_file_path: str):
+        self.lock_file_path = lock_file_path
+        self._thread_lock = FileLock.__get_thread_lock(lock_file_path)
+        self._file_descriptor = None
+
+    @classmethod
+    def for_file(cls, file_path: str):
+        """
+        Lock guarding file_path, stored next to it as file_path + LOCK_FILE_SUFFIX
+        """
+        return cls(file_path + cls.LOCK_FILE_SUFFIX)
+
+    @staticmethod
+    def __get_thread_lock(lock_file_path: str):
+        with FileLock.__thread_locks_guard:
+            lock_file_path = os.path.abspath(lock_file_path)
+            thread_lock = FileLock.__thread_locks.get(lock_file_path)
+            if thread_lock is None:
+                thread_lock = threading.Lock()
+                FileLock.__thread_locks[lock_file_path] = thread_lock
+            return thread_lock
+
+    @staticmethod
+    def _reset_after_fork():
+        # locks held by threads of the parent would never be released in the child
+        FileLock.__thread_locks = weakref.WeakValueDictionary()
+        FileLock.__thread_locks_guard = threading.Lock()
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """
+        Acquire the lock, waiting at most timeout seconds (forever if None).
+        Returns True if the lock was acquired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        if not self._thread_lock.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+
+        if fcntl is None:
+            return True
+
+        try:
+            lock_file_dir = os.path.dirname(self.lock_file_path)
+            if lock_file_dir:
+                os.makedirs(lock_file_dir, exist_ok=True)
+
+            while True:
+                self._file_descriptor = os.open(self.lock_file_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+                if deadline is None:
+                    fcntl.flock(self._file_descriptor, fcntl.LOCK_EX)
+                else:
+                    while True:
+                        try:
+                            fcntl.flock(self._file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                            break
+                        except BlockingIOError:
+                            if time.monotonic() >= deadline:
+                                self._close()
+                                self._thread_lock.release()
+                                return False
+                            time.sleep(FileLock._POLL_INTERVAL)
+
+                if self._is_lock_file_current():
+                    return True
+                # the file was removed by its previous holder while we were waiting, lock the new one
+                self._close()
+        except BaseException:
+            self._close()
+            self._thread_lock.release()
+            raise
+
+    def _is_lock_file_current(self) -> bool:
+        """
+        Whether the locked file is still the one at lock_file_path
+        """
+        try:
+            path_stat = os.stat(self.lock_file_path)
+        except FileNotFoundError:
+            return False
+        file_stat = os.fstat(self._file_descriptor)
+        return (path_stat.st_dev, path_stat.st_ino) == (file_stat.st_dev, file_stat.st_ino)
+
+    def release(self):
+        if self._file_descriptor is not None:
+            try:
+                # removed while it's locked, see _is_lock_file_current
+                os.remove(self.lock_file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"FileLock: cannot remove lock file, lock_file_path={self.lock_file_path}, exception={e}")
+            try:
+                fcntl.flock(self._file_descriptor, fcntl.LOCK_UN)
+            finally:
+                self._close()
+        self._thread_lock.release()
+
+    def _close(self):
+        if self._file_descriptor is not None:
+            try:
+                os.close(self._file_descriptor)
+            except OSError as e:
+                logger.warning(f"FileLock: cannot close lock file, lock_file_path={self.lock_file_path}, exception={e}")
+            self._file_descriptor = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=FileLock._reset_after_fork)
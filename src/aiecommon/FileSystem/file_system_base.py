@@ -1,5 +1,6 @@
 import os
 import json
+import time
 
 class FileSystemBase:
 
@@ -11,6 +12,13 @@ class FileSystemBase:
     __STORAGE_DIRECTORY = os.path.join(__DATA_DIRECTORY, "storage")
     __CACHE_DIRECTORY = os.path.join(__DATA_DIRECTORY, "cache")
 
+    # access time is only updated if it is older than this, to avoid a write on every cache hit
+    _ACCESS_TIME_RESOLUTION_SECONDS = 3600
+
+    @classmethod
+    def _get_data_directory(cls):
+        return cls.__DATA_DIRECTORY
+
     @classmethod
     def _get_cache_directory(cls):
         return os.path.join(cls.__CACHE_DIRECTORY, cls._FILESYSTEM_IDENTIFIER)
@@ -20,6 +28,48 @@ class FileSystemBase:
         return os.path.join(cls.__STORAGE_DIRECTORY, cls._FILESYSTEM_IDENTIFIER)
         
 
+    @classmethod
+    def get_directory(cls, usePermanentStorage = False):
+        """
+        Directory where the files of this file system are stored, e.g. for setting a CacheQuota
+        """
+        if usePermanentStorage:
+            return cls._get_storage_directory()
+        else:
+            return cls._get_cache_directory()
+
+    @staticmethod
+    def touch_access_time(filePath, fileStat = None):
+        """
+        Mark the file as recently used (for LRU eviction by CacheJanitor), without changing its mtime
+        """
+        try:
+            if fileStat is None:
+                fileStat = os.stat(filePath)
+            now_ns = time.time_ns()
+            if now_ns - fileStat.st_atime_ns > FileSystemBase._ACCESS_TIME_RESOLUTION_SECONDS * 1_000_000_000:
+                os.utime(filePath, ns=(now_ns, fileStat.st_mtime_ns))
+        except OSError:
+            pass
+
+    @classmethod
+    def evict_cache(cls, quotas: list, dry_run = False):
+        """
+        Evict files exceeding the given CacheQuota list, returns eviction statistics
+        """
+        from .cache_janitor import CacheJanitor
+        return CacheJanitor(quotas).run_once(dry_run = dry_run)
+
+    @classmethod
+    def start_cache_janitor(cls, quotas: list, interval_seconds: float = 600):
+        """
+        Start a background thread evicting files exceeding the given CacheQuota list every interval_seconds
+        """
+        from .cache_janitor import CacheJanitor
+        janitor = CacheJanitor(quotas, interval_seconds)
+        janitor.start()
+        return janitor
+
     @classmethod
     def download_file(cls, filePath, mode = "r", *args, **kwargs):
         if cls in FileSystemBase.__object_list:
@@ -81,6 +81,7 @@ class GoogleDrive(FileSystemBase):
                 logger.info(f"GoogleDrive file is valid, but forceDownload is true, not getting from local path: localFilePath={localFilePath}, size={os.path.getsize(localFilePath)}")
             else:
                 logger.info(f"GoogleDrive get from local cache (disk): {localFilePath}, size={os.path.getsize(localFilePath)}")
+                GoogleDrive.touch_access_time(localFilePath)
                 return localFilePath
         
         self.download_google_drive_file(localFilePath, fileId)
@@ -0,0 +1,199 @@
+import bisect
+import threading
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+
+class LatencyHistogram:
+    """
+    Histogram of durations in seconds with fixed, roughly logarithmic buckets.
+    Percentiles are interpolated within the bucket, so they are estimates.
+    """
+
+    BUCKET_BOUNDS_SECONDS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120]
+
+    def __init__(self):
+        # the last bucket holds everything above the last bound
+        self.bucket_counts = [0] * (len(LatencyHistogram.BUCKET_BOUNDS_SECONDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.bucket_counts[bisect.bisect_left(LatencyHistogram.BUCKET_BOUNDS_SECONDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percentile: float) -> float | None:
+        """
+        Estimated percentile (0-100), None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = percentile / 100 * self.count
+        cumulative = 0
+        for bucket, bucket_count in enumerate(self.bucket_counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = LatencyHistogram.BUCKET_BOUNDS_SECONDS[bucket - 1] if bucket > 0 else 0.0
+                upper = LatencyHistogram.BUCKET_BOUNDS_SECONDS[bucket] if bucket < len(LatencyHistogram.BUCKET_BOUNDS_SECONDS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - cumulative) / bucket_count)
+            cumulative += bucket_count
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {
+                **{str(bound): count for bound, count in zip(LatencyHistogram.BUCKET_BOUNDS_SECONDS, self.bucket_counts)},
+                "inf": self.bucket_counts[-1],
+            },
+        }
+
+
+class ApiMetrics:
+    """
+    In-process counters and latency histograms of one external API endpoint (ExternalApiBase.API_IDENTIFIER + endpoint)
+
+    Counters used by ExternalApiBase:
+    - hits, misses - cache lookups, memory_hits - hits served from the memory tier, bytes_read - read from cache files
+    - coalesced - results of a concurrent identical call, stale_hits - cached results served while the circuit is open
+    - fetches, fetch_errors - api call attempts that succeeded or raised, retries, failures - calls that failed for good
+    - rate_limited - attempts not made because the rate limiter would have waited longer than its max_wait_seconds
+    Histograms: fetch_seconds - duration of every api call attempt
+
+    histograms are cumulative, period_histograms hold the observations since the last emit
+    """
+
+    DEFAULT_ENDPOINT = "default"
+
+    __metrics = {}
+    __metrics_lock = threading.Lock()
+
+    # (api_identifier, endpoint, counter name) -> value at the last emit
+    __emitted_counters = {}
+    __metric_emitters = {}
+
+    def __init__(self, api_identifier: str, endpoint: str = DEFAULT_ENDPOINT):
+        self.api_identifier = api_identifier
+        self.endpoint = endpoint
+        self.counters = {}
+        self.histograms = {}
+        self.period_histograms = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, api_identifier: str, endpoint: str | None = None):
+        """
+        Metrics of the given api and endpoint, shared by all users in the process
+        """
+        key = (api_identifier, endpoint or ApiMetrics.DEFAULT_ENDPOINT)
+        metrics = ApiMetrics.__metrics.get(key)
+        if metrics is None:
+            with ApiMetrics.__metrics_lock:
+                metrics = ApiMetrics.__metrics.setdefault(key, cls(*key))
+        return metrics
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            for histograms in (self.histograms, self.period_histograms):
+                histogram = histograms.get(name)
+                if histogram is None:
+                    histogram = histograms[name] = LatencyHistogram()
+                histogram.observe(seconds)
+
+    def take_period_histograms(self) -> dict:
+        """
+        Histograms of the observations since the last call, the next period starts empty
+        """
+        with self._lock:
+            period_histograms, self.period_histograms = self.period_histograms, {}
+        return period_histograms
+
+    def get_count(self, name: str) -> int:
+        """
+        Value of a counter or number of observations of a histogram
+        """
+        with self._lock:
+            if name in self.histograms:
+                return self.histograms[name].count
+            return self.counters.get(name, 0)
+
+    def percentile(self, name: str, percentile: float) -> float | None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            return histogram.percentile(percentile) if histogram is not None else None
+
+    def get_snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                **{name: histogram.snapshot() for name, histogram in self.histograms.items()},
+            }
+
+    @staticmethod
+    def snapshot(api_identifier: str | None = None) -> dict:
+        """
+        Metrics of all apis (or of api_identifier), as {api_identifier: {endpoint: {counter: value, histogram: {...}}}}
+        """
+        with ApiMetrics.__metrics_lock:
+            all_metrics = list(ApiMetrics.__metrics.values())
+
+        snapshot = {}
+        for metrics in all_metrics:
+            if api_identifier is None or metrics.api_identifier == api_identifier:
+                snapshot.setdefault(metrics.api_identifier, {})[metrics.endpoint] = metrics.get_snapshot()
+        return snapshot
+
+    @staticmethod
+    def reset():
+        with ApiMetrics.__metrics_lock:
+            ApiMetrics.__metrics.clear()
+            ApiMetrics.__emitted_counters.clear()
+
+    @staticmethod
+    def emit(namespace: str, period: int = 60, histogram_percentiles: tuple = (50, 95, 99)):
+        """
+        Send the metrics to CloudWatch through MetricEmitter (no-op outside ECS):
+        counter increments since the last emit as "<api>.<endpoint>.<counter>" and percentiles of the latencies
+        observed since the last emit, in Milliseconds, as "<api>.<endpoint>.<histogram>.p<percentile>_ms".
+        Meant to be called every period seconds.
+        """
+        from aiecommon.metric_emmiter import MetricEmitter
+
+        with ApiMetrics.__metrics_lock:
+            all_metrics = list(ApiMetrics.__metrics.values())
+
+        for metrics in all_metrics:
+            metric_prefix = f"{metrics.api_identifier}.{metrics.endpoint}"
+            with metrics._lock:
+                counters = dict(metrics.counters)
+
+            # (name, value, CloudWatch unit)
+            emitted = []
+            for name, value in counters.items():
+                emitted_key = (metrics.api_identifier, metrics.endpoint, name)
+                emitted.append((f"{metric_prefix}.{name}", value - ApiMetrics.__emitted_counters.get(emitted_key, 0), "Count"))
+                ApiMetrics.__emitted_counters[emitted_key] = value
+            for name, histogram in metrics.take_period_histograms().items():
+                for percentile in histogram_percentiles:
+                    seconds = histogram.percentile(percentile)
+                    if seconds is not None:
+                        emitted.append((f"{metric_prefix}.{name}.p{percentile}_ms", seconds * 1000, "Milliseconds"))
+
+            for emitted_name, emitted_value, unit in emitted:
+                metric_emitter = ApiMetrics.__metric_emitters.get((namespace, emitted_name))
+                if metric_emitter is None:
+                    metric_emitter = ApiMetrics.__metric_emitters[(namespace, emitted_name)] = MetricEmitter(namespace, emitted_name, period, unit=unit)
+                # outside ECS the emitter has no metric_name and can't emit
+                if metric_emitter.metric_name:
+                    metric_emitter.emit_metric(emitted_value)
@@ -0,0 +1,210 @@
+import atexit
+import os
+import queue
+import shutil
+import threading
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+
+class CacheBackend:
+    """
+    Shared second tier behind the local cache files of ExternalApiBase, e.g. an S3 bucket used by all ECS tasks.
+
+    - read-through: a cache file missing locally is downloaded from the backend (get) before the api is called
+    - write-behind: a saved cache file is uploaded by a background thread (put_async), the caller doesn't wait
+
+    Keys are relative paths ("<STORAGE_FOLDER>/<cache key>"), implemented by subclasses with _download/_upload.
+    """
+
+    WRITE_QUEUE_MAX_SIZE = 10000
+
+    __from_environment = None
+    __from_environment_lock = threading.Lock()
+
+    def __init__(self):
+        self.stats = {"get_hits": 0, "get_misses": 0, "get_errors": 0, "put_count": 0, "put_errors": 0, "put_dropped": 0}
+        self._stats_lock = threading.Lock()
+        self._write_queue = queue.Queue(maxsize=CacheBackend.WRITE_QUEUE_MAX_SIZE)
+        self._writer_thread = None
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+
+    @staticmethod
+    def from_environment():
+        """
+        Backend configured by environment variables, None if there is none:
+        - AIENERGY_CACHE_S3_BUCKET, AIENERGY_CACHE_S3_PREFIX, AIENERGY_CACHE_S3_ENDPOINT_URL (e.g. a local S3 stand-in)
+        - AIENERGY_CACHE_SHARED_DIRECTORY (e.g. a mounted shared file system)
+        """
+        with CacheBackend.__from_environment_lock:
+            if CacheBackend.__from_environment is None:
+                if os.getenv("AIENERGY_CACHE_S3_BUCKET"):
+                    CacheBackend.__from_environment = S3CacheBackend(
+                        os.getenv("AIENERGY_CACHE_S3_BUCKET"),
+                        prefix=os.getenv("AIENERGY_CACHE_S3_PREFIX", ""),
+                        endpoint_url=os.getenv("AIENERGY_CACHE_S3_ENDPOINT_URL") or None,
+                    )
+                elif os.getenv("AIENERGY_CACHE_SHARED_DIRECTORY"):
+                    CacheBackend.__from_environment = LocalCacheBackend(os.getenv("AIENERGY_CACHE_SHARED_DIRECTORY"))
+                else:
+                    CacheBackend.__from_environment = False
+            return CacheBackend.__from_environment or None
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {**self.stats, "put_queued": self._write_queue.qsize()}
+
+    def get(self, key: str, file_path: str) -> bool:
+        """
+        Download key to file_path (atomically), returns False if the backend doesn't have it
+        """
+        temp_file_path = CacheStorage.get_temp_file_path(file_path)
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if not self._download(key, temp_file_path):
+                self._count("get_misses")
+                return False
+            os.replace(temp_file_path, file_path)
+        except Exception as e:
+            logger.warning(f"CacheBackend: cannot get cache file, key={key}, exception={e}")
+            self._count("get_errors")
+            return False
+        finally:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+        logger.info(f"CacheBackend: got cache file from backend, key={key}, file_path={file_path}")
+        self._count("get_hits")
+        return True
+
+    def put(self, key: str, file_path: str) -> bool:
+        try:
+            self._upload(key, file_path)
+        except Exception as e:
+            logger.warning(f"CacheBackend: cannot put cache file, key={key}, exception={e}")
+            self._count("put_errors")
+            return False
+        self._count("put_count")
+        return True
+
+    def put_async(self, key: str, file_path: str):
+        """
+        Upload file_path in the background (write-behind), dropped if the write queue is full
+        """
+        self._ensure_writer()
+        try:
+            self._write_queue.put_nowait((key, file_path))
+        except queue.Full:
+            logger.warning(f"CacheBackend: write queue is full, not uploading, key={key}")
+            self._count("put_dropped")
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait until all queued uploads are done, returns False on timeout
+        """
+        done = threading.Event()
+        threading.Thread(target=lambda: (self._write_queue.join(), done.set()), daemon=True).start()
+        return done.wait(timeout)
+
+    def _ensure_writer(self):
+        with self._writer_lock:
+            # the writer thread doesn't survive fork, a child process starts its own
+            if self._writer_thread is not None and self._writer_pid == os.getpid() and self._writer_thread.is_alive():
+                return
+            if self._writer_pid != os.getpid():
+                self._write_queue = queue.Queue(maxsize=CacheBackend.WRITE_QUEUE_MAX_SIZE)
+                atexit.register(self.flush, 10)
+            self._writer_pid = os.getpid()
+            self._writer_thread = threading.Thread(target=self._write, name="cache-backend-writer", daemon=True)
+            self._writer_thread.start()
+
+    def _write(self):
+        write_queue = self._write_queue
+        while True:
+            key, file_path = write_queue.get()
+            try:
+                self.put(key, file_path)
+            finally:
+                write_queue.task_done()
+
+    def _download(self, key: str, file_path: str) -> bool:
+        raise NotImplementedError()
+
+    def _upload(self, key: str, file_path: str):
+        raise NotImplementedError()
+
+
+class LocalCacheBackend(CacheBackend):
+    """
+    Backend in a directory, e.g. a shared file system mounted by all tasks
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+
+    def _get_path(self, key: str):
+        return os.path.join(self.directory, key)
+
+    def _download(self, key: str, file_path: str) -> bool:
+        try:
+            shutil.copyfile(self._get_path(key), file_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _upload(self, key: str, file_path: str):
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = CacheStorage.get_temp_file_path(path)
+        try:
+            shutil.copyfile(file_path, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+class S3CacheBackend(CacheBackend):
+    """
+    Backend in an S3 bucket, objects are stored under prefix + key.
+    endpoint_url points to another S3 compatible store, e.g. a local stand-in (moto server, MinIO).
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str | None = None, client = None):
+        super().__init__()
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        # boto3 clients are thread safe, but are created lazily so importing doesn't need AWS configuration
+        with self._client_lock:
+            if self._client is None:
+                import boto3
+                self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+            return self._client
+
+    def _get_object_key(self, key: str):
+        return f"{self.prefix.rstrip('/')}/{key}" if self.prefix else key
+
+    def _download(self, key: str, file_path: str) -> bool:
+        client = self._get_client()
+        try:
+            response = client.get_object(Bucket=self.bucket, Key=self._get_object_key(key))
+        except client.exceptions.NoSuchKey:
+            return False
+        with open(file_path, "wb") as file:
+            for chunk in response["Body"].iter_chunks(1024 * 1024):
+                file.write(chunk)
+        return True
+
+    def _upload(self, key: str, file_path: str):
+        self._get_client().upload_file(file_path, self.bucket, self._get_object_key(key))
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import time
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.SolarUtils.MemoryCache import MemoryCache
+
+class CacheManifest:
+    """
+    Sidecar manifest of a cache file (cache file path + MANIFEST_SUFFIX), recording
+    size, mtime, checksum, write time and whether the content passed full validation.
+
+    is_validated() lets a cache hit skip full validation (e.g. decoding a TIFF) with a stat:
+    - size differs from the manifest - not validated
+    - size and mtime match the manifest - validated
+    - only mtime differs (file touched or rewritten) - checksum decides
+    """
+
+    MANIFEST_SUFFIX = ".manifest"
+    _CHUNK_SIZE = 1024 * 1024
+
+    # (mtime_ns, size) of cache files known to be validated, so most hits don't read the manifest
+    __validated_signatures = MemoryCache(max_entries=65536)
+
+    @staticmethod
+    def get_manifest_path(cache_file_path: str):
+        return cache_file_path + CacheManifest.MANIFEST_SUFFIX
+
+    @staticmethod
+    def get_checksum(file_path: str):
+        checksum = hashlib.blake2b(digest_size=16)
+        with open(file_path, "rb") as file:
+            while chunk := file.read(CacheManifest._CHUNK_SIZE):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+
+    @staticmethod
+    def write(cache_file_path: str, validated: bool, checksum: str | None = None):
+        """
+        Write the manifest for the current content of cache_file_path
+        """
+        try:
+            cache_file_stat = os.stat(cache_file_path)
+            manifest = {
+                "size": cache_file_stat.st_size,
+                "mtime_ns": cache_file_stat.st_mtime_ns,
+                "checksum": checksum if checksum is not None else CacheManifest.get_checksum(cache_file_path),
+                "written_at": time.time(),
+                "validated": validated,
+            }
+
+            manifest_path = CacheManifest.get_manifest_path(cache_file_path)
+            temp_manifest_path = f"{manifest_path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+            with open(temp_manifest_path, "w") as file:
+                json.dump(manifest, file)
+            os.replace(temp_manifest_path, manifest_path)
+        except OSError as e:
+            logger.warning(f"CacheManifest: cannot write manifest, cache_file_path={cache_file_path}, exception={e}")
+            return
+
+        CacheManifest.__validated_signatures.invalidate(cache_file_path)
+        if validated:
+            CacheManifest.__validated_signatures.put(cache_file_path, (manifest["mtime_ns"], manifest["size"]), True, 0)
+
+    @staticmethod
+    def read(cache_file_path: str) -> dict | None:
+        try:
+            with open(CacheManifest.get_manifest_path(cache_file_path)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def is_validated(cache_file_path: str, cache_file_stat: os.stat_result | None = None) -> bool:
+        try:
+            if cache_file_stat is None:
+                cache_file_stat = os.stat(cache_file_path)
+        except OSError:
+            return False
+
+        signature = (cache_file_stat.st_mtime_ns, cache_file_stat.st_size)
+        if CacheManifest.__validated_signatures.get(cache_file_path, signature):
+            return True
+
+        manifest = CacheManifest.read(cache_file_path)
+        if not manifest or not manifest.get("validated") or manifest.get("size") != cache_file_stat.st_size:
+            return False
+
+        if manifest.get("mtime_ns") != cache_file_stat.st_mtime_ns:
+            try:
+                checksum = CacheManifest.get_checksum(cache_file_path)
+            except OSError:
+                return False
+            if checksum != manifest.get("checksum"):
+                logger.warning(f"CacheManifest: checksum mismatch, cache file needs validation, cache_file_path={cache_file_path}")
+                return False
+            CacheManifest.write(cache_file_path, True, checksum)
+
+        CacheManifest.__validated_signatures.put(cache_file_path, signature, True, 0)
+        return True
+
+    @staticmethod
+    def invalidate(cache_file_path: str):
+        CacheManifest.__validated_signatures.invalidate(cache_file_path)
@@ -0,0 +1,150 @@
+import hashlib
+import lzma
+import os
+import time
+import zlib
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.FileSystem import FileLock
+
+class CacheStorage:
+    """
+    Storage format of cache files, with pluggable compression codecs and content-addressed deduplication.
+
+    A cache file is one of:
+    - raw payload (no codec, also the format of cache files written before codecs were added)
+    - ENCODED_MAGIC + codec name length (1 byte) + codec name + encoded payload
+    - REFERENCE_MAGIC + sha256 of the payload, pointing to a blob in BLOB_FOLDER next to the cache file,
+      blobs are stored raw or encoded and shared by all cache files with the same payload
+
+    All files are written to a temporary file first and renamed into place.
+    """
+
+    ENCODED_MAGIC = b"AIECACHE"
+    REFERENCE_MAGIC = b"AIECAREF"
+    BLOB_FOLDER = ".blobs"
+
+    # name -> (encode(payload, level), decode(payload))
+    __codecs = {
+        "zlib": (
+            lambda payload, level: zlib.compress(payload, level if level is not None else 1),
+            zlib.decompress,
+        ),
+        "lzma": (
+            lambda payload, level: lzma.compress(payload, preset=level if level is not None else 0),
+            lzma.decompress,
+        ),
+    }
+
+    @staticmethod
+    def register_codec(name: str, encode, decode):
+        """
+        Register a codec, encode(payload: bytes, level: int | None) -> bytes, decode(encoded: bytes) -> bytes
+        """
+        if len(name.encode()) > 255:
+            raise ValueError(f"CacheStorage: codec name too long, name={name}")
+        CacheStorage.__codecs[name] = (encode, decode)
+
+    @staticmethod
+    def get_codec_names():
+        return list(CacheStorage.__codecs.keys())
+
+    @staticmethod
+    def encode(payload: bytes, codec: str | None, level: int | None = None) -> bytes:
+        if codec is None:
+            return payload
+        encode, _ = CacheStorage.__get_codec(codec)
+        codec_name = codec.encode()
+        return CacheStorage.ENCODED_MAGIC + bytes([len(codec_name)]) + codec_name + encode(payload, level)
+
+    @staticmethod
+    def decode(data: bytes) -> bytes:
+        if not data.startswith(CacheStorage.ENCODED_MAGIC):
+            return data
+        codec_name_start = len(CacheStorage.ENCODED_MAGIC) + 1
+        codec_name_end = codec_name_start + data[len(CacheStorage.ENCODED_MAGIC)]
+        _, decode = CacheStorage.__get_codec(data[codec_name_start:codec_name_end].decode())
+        return decode(data[codec_name_end:])
+
+    @staticmethod
+    def __get_codec(codec: str):
+        if codec not in CacheStorage.__codecs:
+            raise ValueError(f"CacheStorage: unknown codec, codec={codec}, known codecs={CacheStorage.get_codec_names()}")
+        return CacheStorage.__codecs[codec]
+
+    @staticmethod
+    def get_blob_path(file_path: str, content_hash: str):
+        return os.path.join(os.path.dirname(file_path), CacheStorage.BLOB_FOLDER, content_hash[:2], content_hash)
+
+    @staticmethod
+    def get_referenced_blob_path(file_path: str) -> str | None:
+        """
+        Path of the blob file_path points to, None if file_path is not a reference
+        """
+        with open(file_path, "rb") as file:
+            header = file.read(len(CacheStorage.REFERENCE_MAGIC) + 64)
+        if not header.startswith(CacheStorage.REFERENCE_MAGIC):
+            return None
+        return CacheStorage.get_blob_path(file_path, header[len(CacheStorage.REFERENCE_MAGIC):].decode())
+
+    @staticmethod
+    def is_raw(file_path: str) -> bool:
+        """
+        True if the file holds the raw payload (can be used directly, e.g. memory-mapped)
+        """
+        with open(file_path, "rb") as file:
+            header = file.read(len(CacheStorage.ENCODED_MAGIC))
+        return header not in (CacheStorage.ENCODED_MAGIC, CacheStorage.REFERENCE_MAGIC)
+
+    @staticmethod
+    def read(file_path: str) -> bytes:
+        with open(file_path, "rb") as file:
+            data = file.read()
+
+        if data.startswith(CacheStorage.REFERENCE_MAGIC):
+            blob_path = CacheStorage.get_blob_path(file_path, data[len(CacheStorage.REFERENCE_MAGIC):].decode())
+            with open(blob_path, "rb") as file:
+                data = file.read()
+
+        return CacheStorage.decode(data)
+
+    @staticmethod
+    def write(file_path: str, payload: bytes, codec: str | None = None, level: int | None = None, deduplicate: bool = False):
+        if not deduplicate:
+            CacheStorage.write_atomic(file_path, CacheStorage.encode(payload, codec, level))
+            return
+
+        content_hash = hashlib.sha256(payload).hexdigest()
+        blob_path = CacheStorage.get_blob_path(file_path, content_hash)
+
+        # CacheJanitor evicts a blob under this lock, only if it wasn't touched since it found no references to it
+        with FileLock.for_file(blob_path):
+            if os.path.exists(blob_path):
+                logger.info(f"CacheStorage: identical payload already stored, blob_path={blob_path}")
+                os.utime(blob_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                CacheStorage.write_atomic(blob_path, CacheStorage.encode(payload, codec, level))
+
+            CacheStorage.write_atomic(file_path, CacheStorage.REFERENCE_MAGIC + content_hash.encode())
+
+    @staticmethod
+    def write_atomic(file_path: str, data: bytes):
+        temp_file_path = CacheStorage.get_temp_file_path(file_path)
+        try:
+            with open(temp_file_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_file_path, file_path)
+        except BaseException:
+            try:
+                os.remove(temp_file_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def get_temp_file_path(file_path: str):
+        """
+        Unique temporary file in the same folder as file_path, so it can be renamed into place atomically
+        """
+        return os.path.join(os.path.dirname(file_path), f".{os.path.basename(file_path)}.{os.getpid()}.{time.monotonic_ns()}.tmp")
@@ -0,0 +1,112 @@
+import threading
+import time
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+
+class CircuitBreaker:
+    """
+    Process-wide circuit breaker, one per name (e.g. ExternalApiBase.API_IDENTIFIER)
+
+    - CLOSED: requests are allowed, after failure_threshold consecutive failures the circuit opens
+    - OPEN: requests are not allowed, after recovery_timeout seconds the circuit becomes half-open
+    - HALF_OPEN: at most half_open_max_calls probe requests are allowed,
+      a success closes the circuit, a failure opens it again.
+      A probe that doesn't report back (or call release_probe) within recovery_timeout is given up,
+      so another request can probe the api
+    """
+
+    STATE_CLOSED = "CLOSED"
+    STATE_OPEN = "OPEN"
+    STATE_HALF_OPEN = "HALF_OPEN"
+
+    __circuit_breakers = {}
+    __circuit_breakers_lock = threading.Lock()
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CircuitBreaker.STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_count = 0
+        self.rejected_count = 0
+
+        self._opened_at = None
+        self._half_open_calls = 0
+        self._probe_allowed_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str, failure_threshold: int = 5, recovery_timeout: float = 30, half_open_max_calls: int = 1):
+        """
+        Circuit breaker for the given name, created with the given settings on first use
+        """
+        with CircuitBreaker.__circuit_breakers_lock:
+            if name not in CircuitBreaker.__circuit_breakers:
+                CircuitBreaker.__circuit_breakers[name] = cls(name, failure_threshold, recovery_timeout, half_open_max_calls)
+            return CircuitBreaker.__circuit_breakers[name]
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CircuitBreaker.STATE_OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    self.rejected_count += 1
+                    return False
+                logger.info(f"CircuitBreaker/{self.name}: recovery timeout passed, circuit is half-open")
+                self.state = CircuitBreaker.STATE_HALF_OPEN
+                self._half_open_calls = 0
+
+            if self.state == CircuitBreaker.STATE_HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    if time.monotonic() - self._probe_allowed_at < self.recovery_timeout:
+                        self.rejected_count += 1
+                        return False
+                    logger.warning(f"CircuitBreaker/{self.name}: half-open probes didn't report back within recovery timeout, allowing a new probe")
+                    self._half_open_calls = 0
+                self._half_open_calls += 1
+                self._probe_allowed_at = time.monotonic()
+
+            return True
+
+    def release_probe(self):
+        """
+        Give back a half-open probe allowed by allow_request that was not made (e.g. turned down by the rate limiter),
+        so another request can probe the api
+        """
+        with self._lock:
+            if self.state == CircuitBreaker.STATE_HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def is_open(self) -> bool:
+        """
+        True if requests are currently rejected (without using up a half-open probe)
+        """
+        with self._lock:
+            return self.state == CircuitBreaker.STATE_OPEN and time.monotonic() - self._opened_at < self.recovery_timeout
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CircuitBreaker.STATE_CLOSED:
+                logger.info(f"CircuitBreaker/{self.name}: request succeeded, circuit is closed, previous state={self.state}")
+            self.state = CircuitBreaker.STATE_CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == CircuitBreaker.STATE_HALF_OPEN or (self.state == CircuitBreaker.STATE_CLOSED and self.consecutive_failures >= self.failure_threshold):
+                logger.warning(f"CircuitBreaker/{self.name}: circuit is open, previous state={self.state}, consecutive_failures={self.consecutive_failures}, recovery_timeout={self.recovery_timeout}")
+                self.state = CircuitBreaker.STATE_OPEN
+                self.opened_count += 1
+                self._opened_at = time.monotonic()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "opened_count": self.opened_count,
+                "rejected_count": self.rejected_count,
+            }
@@ -0,0 +1,130 @@
+import json
+import mmap
+import struct
+import numpy as np
+import pandas as pd
+
+class ColumnarFrame:
+    """
+    Fixed-layout binary format of a DataFrame with numeric columns and a DatetimeIndex, which can be memory-mapped.
+
+    Layout:
+    - MAGIC, then the length of the JSON header (uint32, little-endian) and the JSON header
+    - values as one float32 array of shape (columns, rows), column after column, at data_offset (DATA_ALIGNMENT aligned)
+    - the index as int64 timestamps since epoch (UTC, in the unit of the index) at index_offset, only if it's not a regular range
+
+    The header describes the columns and the time axis: a regular index is stored as start, step and timezone
+    (e.g. the hourly TMY index) instead of one timestamp per row.
+
+    read() maps the file, the values of a column are only read from disk when the column is used.
+    """
+
+    MAGIC = b"AIECOLF1"
+    DATA_ALIGNMENT = 64
+    DTYPE = np.dtype("<f4")
+    INDEX_DTYPE = np.dtype("<i8")
+
+    INDEX_KIND_RANGE = "range"
+    INDEX_KIND_ARRAY = "array"
+
+    @staticmethod
+    def can_serialize(data) -> bool:
+        return (
+            isinstance(data, pd.DataFrame)
+            and isinstance(data.index, pd.DatetimeIndex)
+            and all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_complex_dtype(dtype) for dtype in data.dtypes)
+            and all(isinstance(column, str) for column in data.columns)
+        )
+
+    @staticmethod
+    def serialize(data: pd.DataFrame) -> bytes:
+        index = data.index
+        index_values = index.asi8
+        header = {
+            "columns": list(data.columns),
+            "source_dtypes": [str(dtype) for dtype in data.dtypes],
+            "dtype": ColumnarFrame.DTYPE.str,
+            "rows": len(data),
+            "index": {
+                "name": index.name,
+                "tz": str(index.tz) if index.tz is not None else None,
+                # resolution of the stored timestamps (ns, us, ...)
+                "unit": index.unit,
+            },
+        }
+
+        steps = np.diff(index_values)
+        regular = len(index_values) > 0 and (len(steps) == 0 or (steps[0] > 0 and (steps == steps[0]).all()))
+        if regular:
+            header["index"].update(kind=ColumnarFrame.INDEX_KIND_RANGE, start=int(index_values[0]), step=int(steps[0]) if len(steps) else 0)
+        else:
+            header["index"]["kind"] = ColumnarFrame.INDEX_KIND_ARRAY
+
+        values = np.ascontiguousarray(data.to_numpy(dtype=ColumnarFrame.DTYPE).T)
+
+        # the offsets depend on the header length, which depends on the offsets
+        header["data_offset"] = header["index_offset"] = 0
+        while True:
+            header_bytes = json.dumps(header).encode()
+            data_offset = ColumnarFrame._align(len(ColumnarFrame.MAGIC) + 4 + len(header_bytes))
+            index_offset = ColumnarFrame._align(data_offset + values.nbytes) if not regular else None
+            if (header["data_offset"], header["index_offset"]) == (data_offset, index_offset):
+                break
+            header["data_offset"], header["index_offset"] = data_offset, index_offset
+
+        parts = [ColumnarFrame.MAGIC, struct.pack("<I", len(header_bytes)), header_bytes]
+        parts.append(b"\0" * (data_offset - sum(len(part) for part in parts)))
+        parts.append(values.tobytes())
+        if not regular:
+            parts.append(b"\0" * (index_offset - data_offset - values.nbytes))
+            parts.append(index_values.astype(ColumnarFrame.INDEX_DTYPE).tobytes())
+        return b"".join(parts)
+
+    @staticmethod
+    def is_columnar(payload: bytes) -> bool:
+        return payload[:len(ColumnarFrame.MAGIC)] == ColumnarFrame.MAGIC
+
+    @staticmethod
+    def is_columnar_file(file_path: str) -> bool:
+        with open(file_path, "rb") as file:
+            return ColumnarFrame.is_columnar(file.read(len(ColumnarFrame.MAGIC)))
+
+    @staticmethod
+    def deserialize(payload) -> pd.DataFrame:
+        """
+        DataFrame over payload (bytes, mmap), the values are not copied and are read-only
+        """
+        if not ColumnarFrame.is_columnar(payload):
+            raise ValueError("ColumnarFrame: not a columnar frame")
+        header_length, = struct.unpack_from("<I", payload, len(ColumnarFrame.MAGIC))
+        header_start = len(ColumnarFrame.MAGIC) + 4
+        header = json.loads(bytes(payload[header_start:header_start + header_length]))
+
+        rows = header["rows"]
+        columns = header["columns"]
+        values = np.frombuffer(payload, dtype=np.dtype(header["dtype"]), count=len(columns) * rows, offset=header["data_offset"]).reshape(len(columns), rows)
+
+        index_header = header["index"]
+        if index_header["kind"] == ColumnarFrame.INDEX_KIND_RANGE:
+            index_values = index_header["start"] + index_header["step"] * np.arange(rows, dtype=ColumnarFrame.INDEX_DTYPE)
+        else:
+            index_values = np.frombuffer(payload, dtype=ColumnarFrame.INDEX_DTYPE, count=rows, offset=header["index_offset"])
+        index = pd.DatetimeIndex(index_values.view(f"M8[{index_header['unit']}]"), name=index_header["name"])
+        if index_header["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(index_header["tz"])
+
+        # values.T is (rows, columns) with the memory layout of a pandas block, the frame is built without copying
+        return pd.DataFrame(values.T, index=index, columns=columns, copy=False)
+
+    @staticmethod
+    def read(file_path: str) -> pd.DataFrame:
+        """
+        DataFrame over the memory-mapped file, pages of a column are only read when the column is used
+        """
+        with open(file_path, "rb") as file:
+            mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return ColumnarFrame.deserialize(mapped_file)
+
+    @staticmethod
+    def _align(offset: int) -> int:
+        return -(-offset // ColumnarFrame.DATA_ALIGNMENT) * ColumnarFrame.DATA_ALIGNMENT
@@ -1,5 +1,10 @@
+import asyncio
+import copy
+import inspect
+import json
 import os
 import random
+import sys
 import pandas as pd
 from  typing import Callable
 import time
@@ -9,13 +14,71 @@ import aiecommon.custom_logger as custom_logger
 logger = custom_logger.get_logger()
 
 from aiecommon.Exceptions import AieException
-from aiecommon.FileSystem import LocalRuntimeFiles
+from aiecommon.FileSystem import LocalRuntimeFiles, FileLock
+from aiecommon.SolarUtils.MemoryCache import MemoryCache
+from aiecommon.SolarUtils.CacheManifest import CacheManifest
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+from aiecommon.SolarUtils.CircuitBreaker import CircuitBreaker
+from aiecommon.SolarUtils.RetryBudget import RetryBudget
+from aiecommon.SolarUtils.RateLimiter import RateLimiter
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+from aiecommon.SolarUtils.CacheBackend import CacheBackend
+from aiecommon.SolarUtils.HttpTransport import HttpTransport
+from aiecommon.SolarUtils.StreamedCacheFile import StreamedCacheFile
 
 class ExternalApiBase():
     
     STORAGE_FOLDER = 'ExternalApiBase'
     API_IDENTIFIER = 'NONE'
     USE_PERMANENT_STORAGE = False
+    # coalesce concurrent identical calls (same cache key) into a single api call
+    SINGLE_FLIGHT = True
+    # keep a CacheManifest next to every cache file, cache hits of validated files skip _check_cache
+    USE_CACHE_MANIFEST = True
+    # storage format of the cache files, see CacheStorage
+    # CACHE_CODEC - None (raw), "zlib", "lzma" or a codec registered with CacheStorage.register_codec
+    CACHE_CODEC = None
+    CACHE_CODEC_LEVEL = None
+    # store identical payloads only once, cache files then point to a content-addressed blob
+    CACHE_DEDUPLICATE = False
+    # shared cache behind the local cache files (read-through, write-behind), see CacheBackend
+    # None - configured by environment variables (CacheBackend.from_environment), disabled if USE_CACHE_BACKEND is False
+    USE_CACHE_BACKEND = True
+    CACHE_BACKEND = None
+    # AieException with one of NEGATIVE_CACHE_ERROR_CODES is cached (cache file path + NEGATIVE_CACHE_SUFFIX)
+    # and raised again without calling the api for NEGATIVE_CACHE_TTL_SECONDS, disabled if 0
+    NEGATIVE_CACHE_TTL_SECONDS = 0
+    NEGATIVE_CACHE_ERROR_CODES = ()
+    NEGATIVE_CACHE_SUFFIX = ".negative"
+    # in-process LRU cache in front of the cache files, disabled if MEMORY_CACHE_MAX_ENTRIES is 0
+    MEMORY_CACHE_MAX_ENTRIES = 0
+    MEMORY_CACHE_MAX_BYTES = 0
+    # the memory tier keeps one read-only result (see _freeze_cached_result)
+    # True - every caller gets its own writable copy of the cached result, unless it asks for copy=False
+    # False - callers share the read-only cached result, unless they ask for copy=True
+    MEMORY_CACHE_COPY_ON_RETURN = True
+    # circuit breaker per API_IDENTIFIER, disabled if CIRCUIT_BREAKER_FAILURE_THRESHOLD is 0
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+    CIRCUIT_BREAKER_RECOVERY_TIMEOUT = 30
+    # when the circuit is open, return the cached result (even if ignore_cache) instead of failing
+    SERVE_STALE_CACHE_WHEN_OPEN = True
+    # retry budget per API_IDENTIFIER, see RetryBudget, disabled if RETRY_BUDGET_RATIO is None
+    RETRY_BUDGET_RATIO = 0.2
+    RETRY_BUDGET_MIN_RETRIES = 3
+    RETRY_BUDGET_WINDOW_SECONDS = 10
+    # rate limit per API_IDENTIFIER shared by all processes, see RateLimiter, disabled if RATE_LIMIT_PER_SECOND is None
+    # overridden by environment variable AIENERGY_RATE_LIMIT_<API_IDENTIFIER> = "RATE[:BURST]" ("0" disables)
+    RATE_LIMIT_PER_SECOND = None
+    RATE_LIMIT_BURST = None
+    # a call that would wait longer than this for the rate limit is retried later instead (RateLimiter.MAX_WAIT_SECONDS if None)
+    RATE_LIMIT_MAX_WAIT_SECONDS = None
+    # pooled keep-alive connections of _http_get, see HttpTransport
+    HTTP_POOL_MAXSIZE = 16
+    # (connect, read) timeouts in seconds
+    HTTP_TIMEOUT_SECONDS = (10, 60)
+
+    __memory_caches = {}
+    __in_flight_async_calls = {}
 
     def __init__(self,
         max_retries: int = 3,
@@ -43,44 +106,349 @@ class ExternalApiBase():
         cache_key = cls._get_cache_key(params)
         return LocalRuntimeFiles.get_file(os.path.join(cls.STORAGE_FOLDER, cache_key), usePermanentStorage=cls.USE_PERMANENT_STORAGE)
 
+    @classmethod
+    def _get_cache_lock(cls, params: dict):
+        return FileLock.for_file(cls._get_cache_file_path(params))
+
+    @classmethod
+    def _get_cache_mtime(cls, params: dict):
+        try:
+            return os.stat(cls._get_cache_file_path(params)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     @classmethod
     def _save_cache(cls, params: dict, data):
         cache_file_path = cls._get_cache_file_path(params)
         logger.info(f"ExternalApiBase/{cls.API_IDENTIFIER}: Saving {cls.API_IDENTIFIER} data to cache, cache_file_path={cache_file_path}")
-        return cls._write_cache(cache_file_path, data, params)
+        memory_cache = cls._get_memory_cache()
+        if memory_cache is not None:
+            memory_cache.invalidate(cache_file_path)
+        if cls.USE_CACHE_MANIFEST:
+            CacheManifest.invalidate(cache_file_path)
+
+        result = cls._write_cache(cache_file_path, data, params)
+        cls._write_behind_cache_backend(cache_file_path)
+        cls._remove_negative_cache(params)
+
+        if cls.USE_CACHE_MANIFEST:
+            # full validation is done once, when the cache file is written
+            CacheManifest.write(cache_file_path, validated=bool(cls._check_cache(data, params)))
+
+        return result
+
+    @classmethod
+    def _get_negative_cache_file_path(cls, params: dict):
+        return cls._get_cache_file_path(params) + cls.NEGATIVE_CACHE_SUFFIX
+
+    @classmethod
+    def _is_negative_cacheable(cls, params: dict, exception: AieException) -> bool:
+        """
+        Whether the exception means the api has no data for params (and won't have it for a while)
+        """
+        return bool(cls.NEGATIVE_CACHE_TTL_SECONDS) and exception.code in cls.NEGATIVE_CACHE_ERROR_CODES
+
+    @classmethod
+    def _save_negative_cache(cls, params: dict, exception: AieException):
+        negative_cache_file_path = cls._get_negative_cache_file_path(params)
+        logger.info(f"ExternalApiBase/{cls.API_IDENTIFIER}: Saving negative cache, code={exception.code}, negative_cache_file_path={negative_cache_file_path}")
+        try:
+            CacheStorage.write_atomic(negative_cache_file_path, json.dumps({
+                "code": exception.code,
+                "data": exception.data,
+                "written_at": time.time(),
+            }, default=str).encode())
+        except OSError as e:
+            logger.warning(f"ExternalApiBase/{cls.API_IDENTIFIER}: cannot save negative cache, negative_cache_file_path={negative_cache_file_path}, exception={e}")
+
+    @classmethod
+    def _remove_negative_cache(cls, params: dict):
+        try:
+            os.remove(cls._get_negative_cache_file_path(params))
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def _raise_if_negative_cached(cls, params: dict):
+        """
+        Raise the cached AieException if the api is known to have no data for params
+        """
+        if not cls.NEGATIVE_CACHE_TTL_SECONDS:
+            return
+
+        negative_cache_file_path = cls._get_negative_cache_file_path(params)
+        try:
+            with open(negative_cache_file_path) as file:
+                negative_cache = json.load(file)
+            expires_at = negative_cache["written_at"] + cls.NEGATIVE_CACHE_TTL_SECONDS
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"ExternalApiBase/{cls.API_IDENTIFIER}: invalid negative cache, negative_cache_file_path={negative_cache_file_path}, exception={e}")
+            return
+
+        if time.time() >= expires_at:
+            cls._remove_negative_cache(params)
+            return
+
+        cls._get_metrics(params).increment("negative_hits")
+        raise AieException(
+            negative_cache["code"],
+            f"ExternalApiBase/{cls.API_IDENTIFIER}: no data according to negative cache, params={params}",
+            {**(negative_cache.get("data") or {}), "negative_cache": True, "negative_cache_expires_at": expires_at},
+        )
+
+    @classmethod
+    def _get_cache_backend(cls) -> CacheBackend | None:
+        if not cls.USE_CACHE_BACKEND:
+            return None
+        return cls.CACHE_BACKEND if cls.CACHE_BACKEND is not None else CacheBackend.from_environment()
 
     @classmethod
-    def _get_cache(cls, params: dict):
+    def _get_cache_backend_key(cls, file_path: str):
+        """
+        Key of a file in the storage folder (cache file or deduplicated blob), the same in all tasks
+        """
+        storage_directory = LocalRuntimeFiles.get_file(cls.STORAGE_FOLDER, usePermanentStorage=cls.USE_PERMANENT_STORAGE)
+        return "/".join([cls.STORAGE_FOLDER] + os.path.relpath(file_path, storage_directory).split(os.sep))
+
+    @classmethod
+    def _read_through_cache_backend(cls, cache_file_path: str, params: dict) -> bool:
+        """
+        Download a cache file missing locally from the cache backend (and the blob it points to), returns True if it was found
+        """
+        cache_backend = cls._get_cache_backend()
+        if cache_backend is None:
+            return False
+
+        metrics = cls._get_metrics(params)
+        if not cache_backend.get(cls._get_cache_backend_key(cache_file_path), cache_file_path):
+            metrics.increment("backend_misses")
+            return False
+
+        blob_path = CacheStorage.get_referenced_blob_path(cache_file_path)
+        if blob_path is not None and not os.path.exists(blob_path) and not cache_backend.get(cls._get_cache_backend_key(blob_path), blob_path):
+            logger.warning(f"ExternalApiBase/{cls.API_IDENTIFIER}: cache backend has no blob for the cache file, cache_file_path={cache_file_path}, blob_path={blob_path}")
+            os.remove(cache_file_path)
+            metrics.increment("backend_misses")
+            return False
+
+        metrics.increment("backend_hits")
+        return True
+
+    @classmethod
+    def _write_behind_cache_backend(cls, cache_file_path: str):
+        cache_backend = cls._get_cache_backend()
+        if cache_backend is None:
+            return
+
+        # the blob is queued first, so a cache file in the backend always has its blob
+        blob_path = CacheStorage.get_referenced_blob_path(cache_file_path)
+        if blob_path is not None:
+            cache_backend.put_async(cls._get_cache_backend_key(blob_path), blob_path)
+        cache_backend.put_async(cls._get_cache_backend_key(cache_file_path), cache_file_path)
+
+    @classmethod
+    def _read_cache(cls, cache_file_path: str, params: dict):
+        return cls._deserialize_cache(CacheStorage.read(cache_file_path), params)
+
+    @classmethod
+    def _write_cache(cls, cache_file_path: str, data, params: dict):
+        if isinstance(data, StreamedCacheFile):
+            # the streamed file holds the serialized payload, it's used as is if it's stored raw
+            if cls.CACHE_CODEC is None and not cls.CACHE_DEDUPLICATE:
+                return data.commit()
+            payload = data.read_bytes()
+            data.discard()
+            return CacheStorage.write(cache_file_path, payload, cls.CACHE_CODEC, cls.CACHE_CODEC_LEVEL, cls.CACHE_DEDUPLICATE)
+        return CacheStorage.write(cache_file_path, cls._serialize_cache(data, params), cls.CACHE_CODEC, cls.CACHE_CODEC_LEVEL, cls.CACHE_DEDUPLICATE)
+
+    @staticmethod
+    def _serialize_cache(data, params: dict) -> bytes:
+        """
+        Convert the api call result to bytes stored in the cache file, implemented by subclasses
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def _deserialize_cache(payload: bytes, params: dict):
+        """
+        Convert bytes stored in the cache file back to the api call result, implemented by subclasses
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def _get_cache(cls, params: dict, copy: bool | None = None):
+        """
+        copy - return a writable copy of the cached result (False - the shared read-only one), MEMORY_CACHE_COPY_ON_RETURN by default
+        """
+        copy = copy if copy is not None else cls.MEMORY_CACHE_COPY_ON_RETURN
         full_cache_file_path = cls._get_cache_file_path(params)
 
-        if not os.path.exists(full_cache_file_path):
+        try:
+            cache_file_stat = os.stat(full_cache_file_path)
+        except FileNotFoundError:
             logger.info(f"ExternalApiBase/{cls.API_IDENTIFIER}: Get {cls.API_IDENTIFIER} cache file doesn't exist, full_cache_file_path={full_cache_file_path}")
-            return None
-        
+            if not cls._read_through_cache_backend(full_cache_file_path, params):
+                return None
+            cache_file_stat = os.stat(full_cache_file_path)
+
+        LocalRuntimeFiles.touch_access_time(full_cache_file_path, cache_file_stat)
+
+        memory_cache = cls._get_memory_cache() if cls._is_memory_cacheable(params) else None
+        cache_file_signature = (cache_file_stat.st_mtime_ns, cache_file_stat.st_size)
+
+        if memory_cache is not None:
+            cached_result = memory_cache.get(full_cache_file_path, cache_file_signature)
+            if cached_result is not None:
+                logger.info(f"ExternalApiBase/{cls.API_IDENTIFIER}: Get {cls.API_IDENTIFIER} cache from memory, full_cache_file_path={full_cache_file_path}")
+                cls._get_metrics(params).increment("memory_hits")
+                return cls._return_memory_cached_result(cached_result, copy)
+
         try:
             logger.info(f"ExternalApiBase/{cls.API_IDENTIFIER}: Get {cls.API_IDENTIFIER} cache file, full_cache_file_path={full_cache_file_path}")
-            return cls._read_cache(full_cache_file_path, params)
+            cached_result = cls._read_cache(full_cache_file_path, params)
         except Exception as e:
             logger.error(f"ExternalApiBase/{cls.API_IDENTIFIER}: Cannot read {cls.API_IDENTIFIER} cache file, full_cache_file_path={full_cache_file_path}, exception={e}")
             return None
+        cls._get_metrics(params).increment("bytes_read", cache_file_stat.st_size)
+
+        if memory_cache is None or cached_result is None:
+            # e.g. memory-mapped results are read-only
+            if copy and cls._is_read_only(cached_result):
+                return cls._copy_cached_result(cached_result)
+            return cached_result
+
+        frozen_result = cls._freeze_cached_result(cached_result)
+        memory_cache.put(full_cache_file_path, cache_file_signature, frozen_result, cls._get_cached_result_size(frozen_result))
+
+        if copy and frozen_result is not cached_result:
+            # the memory tier keeps a frozen copy, the result that was read is not shared
+            return cached_result
+        return cls._return_memory_cached_result(frozen_result, copy)
+
+    @classmethod
+    def _get_memory_cache(cls) -> MemoryCache | None:
+        if not cls.MEMORY_CACHE_MAX_ENTRIES:
+            return None
+        memory_cache = ExternalApiBase.__memory_caches.get(cls)
+        if memory_cache is None:
+            memory_cache = ExternalApiBase.__memory_caches.setdefault(cls, MemoryCache(cls.MEMORY_CACHE_MAX_ENTRIES, cls.MEMORY_CACHE_MAX_BYTES))
+        return memory_cache
+
+    @staticmethod
+    def _is_memory_cacheable(params: dict) -> bool:
+        """
+        Whether results for params are kept in the memory tier (e.g. not results referring to the cache file)
+        """
+        return True
+
+    @classmethod
+    def _return_memory_cached_result(cls, cached_result, copy: bool):
+        if copy:
+            return cls._copy_cached_result(cached_result)
+        else:
+            return cls._share_cached_result(cached_result)
+
+    @staticmethod
+    def _copy_cached_result(cached_result):
+        """
+        Writable deep copy of the cached result, returned to callers asking for a copy
+        """
+        if isinstance(cached_result, (bytes, str)):
+            return cached_result
+        if isinstance(cached_result, pd.DataFrame):
+            return cached_result.copy(deep=True)
+        return copy.deepcopy(cached_result)
+
+    @staticmethod
+    def _freeze_cached_result(cached_result):
+        """
+        Make the cached result read-only before it is kept in memory and shared between callers
+        """
+        if isinstance(cached_result, pd.DataFrame):
+            if ExternalApiBase._is_read_only(cached_result):
+                # already read-only, e.g. memory-mapped
+                return cached_result
+            columns = {}
+            for column in cached_result.columns:
+                values = cached_result[column].to_numpy(copy=True)
+                values.flags.writeable = False
+                columns[column] = values
+            return pd.DataFrame(columns, index=cached_result.index, copy=False)
+        return cached_result
+
+    @staticmethod
+    def _is_read_only(cached_result) -> bool:
+        return isinstance(cached_result, pd.DataFrame) and all(not cached_result[column].to_numpy(copy=False).flags.writeable for column in cached_result.columns)
+
+    @staticmethod
+    def _share_cached_result(cached_result):
+        """
+        Object handed to callers asking for the shared (copy=False) frozen cached result
+        """
+        if isinstance(cached_result, (bytes, str)):
+            return cached_result
+        if isinstance(cached_result, pd.DataFrame):
+            # shallow copy: the caller can add or drop columns, but the shared values stay read-only
+            return cached_result.copy(deep=False)
+        return copy.deepcopy(cached_result)
+
+    @staticmethod
+    def _get_cached_result_size(cached_result) -> int:
+        if isinstance(cached_result, pd.DataFrame):
+            return int(cached_result.memory_usage(index=True, deep=True).sum())
+        if isinstance(cached_result, (bytes, bytearray, str)):
+            return len(cached_result)
+        try:
+            return len(json.dumps(cached_result))
+        except (TypeError, ValueError):
+            return sys.getsizeof(cached_result)
+
+    def _get_result_from_cache(self, ignore_cache: bool, api_call_params: dict, record_metrics: bool = True, copy: bool | None = None):
+        """
+        record_metrics - count the lookup as a cache hit or miss, False for lookups the caller counts itself
+        copy - see _get_cache
+        """
+        metrics = self._get_metrics(api_call_params) if record_metrics else None
 
-    def _get_result_from_cache(self, ignore_cache: bool, api_call_params: dict):
         if not ignore_cache:
             logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: Try to get result from cache, api_call_params={api_call_params}")
-            cached_result = self._get_cache(api_call_params)
+            cached_result = self._get_cache(api_call_params, copy)
             if cached_result is not None:
                 logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: Got result from cache, api_call_params={api_call_params}")
-                if self._check_cache(cached_result, api_call_params):
+                if self._is_cache_validated(api_call_params) or self._validate_cache(cached_result, api_call_params):
+                    if metrics is not None:
+                        metrics.increment("hits")
                     return cached_result
                 else:
                     logger.warning(f"ExternalApiBase/{self.API_IDENTIFIER}: cached data exsist but it didn't pass cache check, api_call_params={api_call_params}")
             else:
                 logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: no cached data, api_call_params={api_call_params}")
+            if metrics is not None:
+                metrics.increment("misses")
         else:
             logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: ignoring cache, ignore_cache={ignore_cache}, api_call_params={api_call_params}")
+            if metrics is not None:
+                metrics.increment("cache_ignored")
         
         return None
 
+    @classmethod
+    def _is_cache_validated(cls, params: dict) -> bool:
+        return cls.USE_CACHE_MANIFEST and CacheManifest.is_validated(cls._get_cache_file_path(params))
+
+    @classmethod
+    def _validate_cache(cls, cached_result, params: dict) -> bool:
+        """
+        Full validation of a cached result (_check_cache), recorded in the manifest if it passes
+        """
+        if not cls._check_cache(cached_result, params):
+            return False
+        if cls.USE_CACHE_MANIFEST:
+            CacheManifest.write(cls._get_cache_file_path(params), validated=True)
+        return True
+
     def call_api(
         self,
         api_call_function: Callable,
@@ -90,40 +458,99 @@ class ExternalApiBase():
         min_retry_delay: int | None = None,
         min_result_size: int | None = None,
         ignore_cache: bool | None = None,
+        copy: bool | None = None,
     ) -> pd.DataFrame | None:
         """
         Call external api with caching and retry
-        """
 
-        max_retries = max_retries if max_retries is not None else self.max_retries
-        min_retry_delay = min_retry_delay if min_retry_delay is not None else self.min_retry_delay
-        min_result_size = min_result_size if min_result_size is not None else self.min_result_size
-        ignore_cache = ignore_cache if ignore_cache is not None else self.ignore_cache
+        copy - whether a cached result is returned as a writable copy (False - shared and read-only), see _get_cache
+        """
 
-        retry_count = 0
+        max_retries, min_retry_delay, min_result_size, ignore_cache = self._resolve_call_options(max_retries, min_retry_delay, min_result_size, ignore_cache)
 
-        cached_result = self._get_result_from_cache(ignore_cache, api_call_params)
+        cached_result = self._get_result_from_cache(ignore_cache, api_call_params, copy=copy)
 
         if cached_result is not None:
             return cached_result
-        
+
+        if not ignore_cache:
+            self._raise_if_negative_cached(api_call_params)
+
+        if not self.SINGLE_FLIGHT:
+            return self._call_api_with_retry(api_call_function, api_call_params, get_result_size_function, max_retries, min_retry_delay, min_result_size, ignore_cache)
+
+        cache_mtime = self._get_cache_mtime(api_call_params)
+
+        with self._get_cache_lock(api_call_params):
+            # while waiting for the lock another thread or process could have done the same call
+            if not ignore_cache or self._get_cache_mtime(api_call_params) != cache_mtime:
+                cached_result = self._get_result_from_cache(False, api_call_params, record_metrics=False, copy=copy)
+                if cached_result is not None:
+                    logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: Got result of a concurrent identical call, api_call_params={api_call_params}")
+                    self._get_metrics(api_call_params).increment("coalesced")
+                    return cached_result
+            if not ignore_cache:
+                self._raise_if_negative_cached(api_call_params)
+
+            return self._call_api_with_retry(api_call_function, api_call_params, get_result_size_function, max_retries, min_retry_delay, min_result_size, ignore_cache)
+
+    def _call_api_with_retry(
+        self,
+        api_call_function: Callable,
+        api_call_params: dict,
+        get_result_size_function: Callable,
+        max_retries: int,
+        min_retry_delay: int,
+        min_result_size: int,
+        ignore_cache: bool,
+    ):
+        retry_count = 0
+
         logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: Proceeding with api request, ignore_cache={ignore_cache}, api_call_params={api_call_params}")
     
+        circuit_breaker = self._get_circuit_breaker()
+        retry_budget = self._get_retry_budget()
+        rate_limiter = self._get_rate_limiter()
+        metrics = self._get_metrics(api_call_params)
+
         while retry_count <= max_retries:
+            if circuit_breaker is not None and not circuit_breaker.allow_request():
+                return self._get_result_when_circuit_open(api_call_params)
+
+            if retry_count == 0 and retry_budget is not None:
+                retry_budget.record_attempt()
+
+            if rate_limiter is not None and not rate_limiter.acquire():
+                self._release_circuit_breaker_probe(circuit_breaker)
+                retry_count += 1
+                sleep_interval = self._get_rate_limited_retry_sleep_interval(retry_budget, retry_count, max_retries, metrics)
+                if sleep_interval is None:
+                    break
+                time.sleep(sleep_interval)
+                continue
+
+            fetch_start = time.perf_counter()
+            result_data = None
             try:
                 result_data = api_call_function(max_retries, retry_count, **api_call_params)
-                result_size = get_result_size_function(result_data, api_call_params)
-
-                if  result_size < min_result_size:
-                    logger.info(result_data)
-                    raise Exception(f"The result size is smaller than limit, result_size={result_size}, min_result_size={min_result_size}")
+                metrics.observe("fetch_seconds", time.perf_counter() - fetch_start)
+                self._check_result_size(result_data, get_result_size_function(result_data, api_call_params), min_result_size)
+                self._record_api_call_success(circuit_breaker)
+                metrics.increment("fetches")
 
                 logger.info(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: Saving result to cache, api_call_params={api_call_params}")
                 self._save_cache(api_call_params, result_data)
 
-                return result_data
+                return self._get_saved_result(result_data, api_call_params)
 
             except AieException as e:
+                # the api answered (e.g. HOUSE_NOT_LOCATED), it's not a failure of the api
+                self._discard_result(result_data)
+                self._record_api_call_success(circuit_breaker)
+                metrics.observe("fetch_seconds", time.perf_counter() - fetch_start)
+                metrics.increment("api_exceptions")
+                if self._is_negative_cacheable(api_call_params, e):
+                    self._save_negative_cache(api_call_params, e)
                 raise e
 
             # except HTTPError as e:
@@ -139,12 +566,346 @@ class ExternalApiBase():
             except (Exception) as e:
                 logger.warning(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: Caught exception {type(e).__name__} while getting data:")
                 logger.warning(traceback.format_exc())
+                metrics.increment("fetch_errors")
+                self._discard_result(result_data)
 
                 retry_count += 1
 
+                if not self._can_retry(circuit_breaker, retry_budget, retry_count, max_retries):
+                    break
+
                 if retry_count <= max_retries:
-                    sleep_interval = self.min_retry_delay + 2**(retry_count - 1) + random.random()
-                    logger.info(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: Sleeping for {sleep_interval} seconds before retry")
+                    metrics.increment("retries")
+                    sleep_interval = self._get_retry_sleep_interval(retry_count, max_retries)
                     time.sleep(sleep_interval)
 
+            except BaseException:
+                # e.g. KeyboardInterrupt, the attempt never reports back
+                self._discard_result(result_data)
+                self._release_circuit_breaker_probe(circuit_breaker)
+                raise
+
+        if circuit_breaker is not None and circuit_breaker.is_open():
+            return self._get_result_when_circuit_open(api_call_params)
+
+        metrics.increment("failures")
+        raise AieException(AieException.EXTERNAL_API_FAILED, f"ExternalApiBase/{self.API_IDENTIFIER}: API call failed after {retry_count} retries", {"api": self.API_IDENTIFIER})
+
+    def _resolve_call_options(self, max_retries, min_retry_delay, min_result_size, ignore_cache):
+        max_retries = max_retries if max_retries is not None else self.max_retries
+        min_retry_delay = min_retry_delay if min_retry_delay is not None else self.min_retry_delay
+        min_result_size = min_result_size if min_result_size is not None else self.min_result_size
+        ignore_cache = ignore_cache if ignore_cache is not None else self.ignore_cache
+
+        return max_retries, min_retry_delay, min_result_size, ignore_cache
+
+    def _get_saved_result(self, result_data, params: dict):
+        """
+        Result returned to the caller after result_data was saved to the cache
+        """
+        if isinstance(result_data, StreamedCacheFile):
+            return self._read_cache(self._get_cache_file_path(params), params)
+        return result_data
+
+    @staticmethod
+    def _discard_result(result_data):
+        """
+        Clean up a result that is not saved to the cache
+        """
+        if isinstance(result_data, StreamedCacheFile):
+            result_data.discard()
+
+    @staticmethod
+    def _check_result_size(result_data, result_size, min_result_size):
+        if  result_size < min_result_size:
+            logger.info(result_data)
+            raise Exception(f"The result size is smaller than limit, result_size={result_size}, min_result_size={min_result_size}")
+
+    def _get_retry_sleep_interval(self, retry_count, max_retries):
+        sleep_interval = self.min_retry_delay + 2**(retry_count - 1) + random.random()
+        logger.info(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: Sleeping for {sleep_interval} seconds before retry")
+        return sleep_interval
+
+    @classmethod
+    def _get_circuit_breaker(cls) -> CircuitBreaker | None:
+        if not cls.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+            return None
+        return CircuitBreaker.get(cls.API_IDENTIFIER, cls.CIRCUIT_BREAKER_FAILURE_THRESHOLD, cls.CIRCUIT_BREAKER_RECOVERY_TIMEOUT)
+
+    @classmethod
+    def _get_retry_budget(cls) -> RetryBudget | None:
+        if cls.RETRY_BUDGET_RATIO is None:
+            return None
+        return RetryBudget.get(cls.API_IDENTIFIER, cls.RETRY_BUDGET_RATIO, cls.RETRY_BUDGET_MIN_RETRIES, cls.RETRY_BUDGET_WINDOW_SECONDS)
+
+    @classmethod
+    def _get_http_transport(cls) -> HttpTransport:
+        return HttpTransport.get_shared(cls.HTTP_POOL_MAXSIZE, cls.HTTP_TIMEOUT_SECONDS)
+
+    @classmethod
+    def _http_get(cls, url: str, **kwargs):
+        """
+        GET through the shared pooled transport, use instead of requests.get in api call functions
+        """
+        return cls._get_http_transport().get(url, **kwargs)
+
+    @classmethod
+    def _get_metrics(cls, params: dict) -> ApiMetrics:
+        return ApiMetrics.get(cls.API_IDENTIFIER, cls._get_metrics_endpoint(params))
+
+    @staticmethod
+    def _get_metrics_endpoint(params: dict) -> str:
+        """
+        Endpoint the metrics of a call are recorded under
+        """
+        return params.get("endpoint_identifier", ApiMetrics.DEFAULT_ENDPOINT)
+
+    @staticmethod
+    def get_metrics(api_identifier: str | None = None) -> dict:
+        """
+        Snapshot of cache and api call metrics of all apis (or of api_identifier), see ApiMetrics
+        """
+        return ApiMetrics.snapshot(api_identifier)
+
+    @classmethod
+    def _get_rate_limiter(cls) -> RateLimiter | None:
+        rate_per_second, burst = cls.RATE_LIMIT_PER_SECOND, cls.RATE_LIMIT_BURST
+        rate_limit_spec = os.getenv(f"AIENERGY_RATE_LIMIT_{cls.API_IDENTIFIER.upper()}")
+        if rate_limit_spec:
+            rate_per_second, burst = RateLimiter.parse(rate_limit_spec)
+        if not rate_per_second:
+            return None
+        return RateLimiter.get(cls.API_IDENTIFIER, rate_per_second, burst, cls.RATE_LIMIT_MAX_WAIT_SECONDS)
+
+    @staticmethod
+    def _record_api_call_success(circuit_breaker: CircuitBreaker | None):
+        if circuit_breaker is not None:
+            circuit_breaker.record_success()
+
+    @staticmethod
+    def _release_circuit_breaker_probe(circuit_breaker: CircuitBreaker | None):
+        if circuit_breaker is not None:
+            circuit_breaker.release_probe()
+
+    def _get_rate_limited_retry_sleep_interval(self, retry_budget: RetryBudget | None, retry_count: int, max_retries: int, metrics: ApiMetrics) -> float | None:
+        """
+        Backoff before retrying an attempt the rate limiter turned down (it would have waited too long), None if it's not retried.
+        It's not a failure of the api, so the circuit breaker doesn't record it (a half-open probe is given back).
+        """
+        metrics.increment("rate_limited")
+        if retry_count > max_retries:
+            return None
+        if retry_budget is not None and not retry_budget.try_acquire_retry():
+            logger.warning(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: retry budget exhausted, not retrying, retry_budget={retry_budget.get_stats()}")
+            return None
+        metrics.increment("retries")
+        return self._get_retry_sleep_interval(retry_count, max_retries)
+
+    def _can_retry(self, circuit_breaker: CircuitBreaker | None, retry_budget: RetryBudget | None, retry_count: int, max_retries: int) -> bool:
+        """
+        Record the failed attempt and decide whether to retry it, without sleeping if the retry can't succeed
+        """
+        if circuit_breaker is not None:
+            circuit_breaker.record_failure()
+            if circuit_breaker.is_open():
+                logger.warning(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: circuit is open, not retrying")
+                return False
+
+        if retry_count <= max_retries and retry_budget is not None and not retry_budget.try_acquire_retry():
+            logger.warning(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: retry budget exhausted, not retrying, retry_budget={retry_budget.get_stats()}")
+            return False
+
+        return True
+
+    def _get_result_when_circuit_open(self, api_call_params: dict):
+        """
+        Fail fast when the circuit is open, returning the cached result if there is one
+        """
+        if self.SERVE_STALE_CACHE_WHEN_OPEN:
+            cached_result = self._get_result_from_cache(False, api_call_params, record_metrics=False)
+            if cached_result is not None:
+                logger.warning(f"ExternalApiBase/{self.API_IDENTIFIER}: circuit is open, returning stale cached result, api_call_params={api_call_params}")
+                self._get_metrics(api_call_params).increment("stale_hits")
+                return cached_result
+
+        self._get_metrics(api_call_params).increment("failures")
+        raise AieException(AieException.EXTERNAL_API_FAILED, f"ExternalApiBase/{self.API_IDENTIFIER}: circuit is open, failing fast, api_call_params={api_call_params}", {"api": self.API_IDENTIFIER, "circuit_breaker": CircuitBreaker.STATE_OPEN})
+
+    async def call_api_async(
+        self,
+        api_call_function: Callable,
+        api_call_params: dict,
+        get_result_size_function: Callable,
+        max_retries: int | None = None,
+        min_retry_delay: int | None = None,
+        min_result_size: int | None = None,
+        ignore_cache: bool | None = None,
+        copy: bool | None = None,
+    ) -> pd.DataFrame | None:
+        """
+        Async version of call_api, uses the same cache files (format and keys) as call_api
+
+        - api_call_function can be a coroutine function, a regular function is run in a worker thread
+        - cache files are read and written in worker threads, retry backoff doesn't block the event loop
+        - identical concurrent calls on one event loop share a single call (and the same result object),
+          identical calls from other threads and processes are coalesced by the cache lock as in call_api
+        """
+
+        max_retries, min_retry_delay, min_result_size, ignore_cache = self._resolve_call_options(max_retries, min_retry_delay, min_result_size, ignore_cache)
+
+        cached_result = await asyncio.to_thread(self._get_result_from_cache, ignore_cache, api_call_params, True, copy)
+
+        if cached_result is not None:
+            return cached_result
+
+        if not ignore_cache:
+            await asyncio.to_thread(self._raise_if_negative_cached, api_call_params)
+
+        if not self.SINGLE_FLIGHT:
+            return await self._call_api_with_retry_async(api_call_function, api_call_params, get_result_size_function, max_retries, min_retry_delay, min_result_size, ignore_cache)
+
+        in_flight_calls = ExternalApiBase.__in_flight_async_calls
+        # callers asking for another result format of the same cache file (e.g. bytes or path) don't share the result
+        in_flight_key = (asyncio.get_running_loop(), self._get_cache_file_path(api_call_params), api_call_params.get("result_format"))
+
+        in_flight_call = in_flight_calls.get(in_flight_key)
+        if in_flight_call is None:
+            in_flight_call = asyncio.ensure_future(self._call_api_single_flight_async(api_call_function, api_call_params, get_result_size_function, max_retries, min_retry_delay, min_result_size, ignore_cache))
+            in_flight_calls[in_flight_key] = in_flight_call
+            in_flight_call.add_done_callback(lambda _: in_flight_calls.pop(in_flight_key, None))
+        else:
+            logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: Waiting for a concurrent identical call, api_call_params={api_call_params}")
+
+        # cancelling one of the waiting callers must not cancel the call the others are waiting for
+        return await asyncio.shield(in_flight_call)
+
+    async def _call_api_single_flight_async(
+        self,
+        api_call_function: Callable,
+        api_call_params: dict,
+        get_result_size_function: Callable,
+        max_retries: int,
+        min_retry_delay: int,
+        min_result_size: int,
+        ignore_cache: bool,
+    ):
+        cache_mtime = await asyncio.to_thread(self._get_cache_mtime, api_call_params)
+
+        cache_lock = self._get_cache_lock(api_call_params)
+        acquire_future = asyncio.ensure_future(asyncio.to_thread(cache_lock.acquire))
+        try:
+            await asyncio.shield(acquire_future)
+        except asyncio.CancelledError:
+            # the worker thread will still get the lock, release it as soon as it does
+            acquire_future.add_done_callback(lambda future: cache_lock.release() if not future.cancelled() and future.exception() is None else None)
+            raise
+
+        try:
+            # while waiting for the lock another thread or process could have done the same call
+            if not ignore_cache or await asyncio.to_thread(self._get_cache_mtime, api_call_params) != cache_mtime:
+                cached_result = await asyncio.to_thread(self._get_result_from_cache, False, api_call_params, False)
+                if cached_result is not None:
+                    logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: Got result of a concurrent identical call, api_call_params={api_call_params}")
+                    self._get_metrics(api_call_params).increment("coalesced")
+                    return cached_result
+            if not ignore_cache:
+                await asyncio.to_thread(self._raise_if_negative_cached, api_call_params)
+
+            return await self._call_api_with_retry_async(api_call_function, api_call_params, get_result_size_function, max_retries, min_retry_delay, min_result_size, ignore_cache)
+        finally:
+            cache_lock.release()
+
+    async def _call_api_with_retry_async(
+        self,
+        api_call_function: Callable,
+        api_call_params: dict,
+        get_result_size_function: Callable,
+        max_retries: int,
+        min_retry_delay: int,
+        min_result_size: int,
+        ignore_cache: bool,
+    ):
+        retry_count = 0
+
+        logger.info(f"ExternalApiBase/{self.API_IDENTIFIER}: Proceeding with async api request, ignore_cache={ignore_cache}, api_call_params={api_call_params}")
+
+        circuit_breaker = self._get_circuit_breaker()
+        retry_budget = self._get_retry_budget()
+        rate_limiter = self._get_rate_limiter()
+        metrics = self._get_metrics(api_call_params)
+
+        while retry_count <= max_retries:
+            if circuit_breaker is not None and not circuit_breaker.allow_request():
+                return await asyncio.to_thread(self._get_result_when_circuit_open, api_call_params)
+
+            if retry_count == 0 and retry_budget is not None:
+                retry_budget.record_attempt()
+
+            if rate_limiter is not None:
+                # the state file lock may be held by another process, so it's taken in a worker thread
+                wait_seconds = await asyncio.to_thread(rate_limiter.reserve)
+                if wait_seconds is None:
+                    self._release_circuit_breaker_probe(circuit_breaker)
+                    retry_count += 1
+                    sleep_interval = self._get_rate_limited_retry_sleep_interval(retry_budget, retry_count, max_retries, metrics)
+                    if sleep_interval is None:
+                        break
+                    await asyncio.sleep(sleep_interval)
+                    continue
+                if wait_seconds > 0:
+                    await asyncio.sleep(wait_seconds)
+
+            fetch_start = time.perf_counter()
+            result_data = None
+            try:
+                if inspect.iscoroutinefunction(api_call_function):
+                    result_data = await api_call_function(max_retries, retry_count, **api_call_params)
+                else:
+                    result_data = await asyncio.to_thread(api_call_function, max_retries, retry_count, **api_call_params)
+                metrics.observe("fetch_seconds", time.perf_counter() - fetch_start)
+                self._check_result_size(result_data, get_result_size_function(result_data, api_call_params), min_result_size)
+                self._record_api_call_success(circuit_breaker)
+                metrics.increment("fetches")
+
+                logger.info(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: Saving result to cache, api_call_params={api_call_params}")
+                await asyncio.to_thread(self._save_cache, api_call_params, result_data)
+
+                return await asyncio.to_thread(self._get_saved_result, result_data, api_call_params)
+
+            except AieException as e:
+                # the api answered (e.g. HOUSE_NOT_LOCATED), it's not a failure of the api
+                self._discard_result(result_data)
+                self._record_api_call_success(circuit_breaker)
+                metrics.observe("fetch_seconds", time.perf_counter() - fetch_start)
+                metrics.increment("api_exceptions")
+                if self._is_negative_cacheable(api_call_params, e):
+                    await asyncio.to_thread(self._save_negative_cache, api_call_params, e)
+                raise e
+
+            except (Exception) as e:
+                logger.warning(f"ExternalApiBase/{self.API_IDENTIFIER} {retry_count}/{max_retries}: Caught exception {type(e).__name__} while getting data:")
+                logger.warning(traceback.format_exc())
+                metrics.increment("fetch_errors")
+                self._discard_result(result_data)
+
+                retry_count += 1
+
+                if not self._can_retry(circuit_breaker, retry_budget, retry_count, max_retries):
+                    break
+
+                if retry_count <= max_retries:
+                    metrics.increment("retries")
+                    sleep_interval = self._get_retry_sleep_interval(retry_count, max_retries)
+                    await asyncio.sleep(sleep_interval)
+
+            except BaseException:
+                # e.g. the caller was cancelled, the attempt never reports back
+                self._discard_result(result_data)
+                self._release_circuit_breaker_probe(circuit_breaker)
+                raise
+
+        if circuit_breaker is not None and circuit_breaker.is_open():
+            return await asyncio.to_thread(self._get_result_when_circuit_open, api_call_params)
+
+        metrics.increment("failures")
         raise AieException(AieException.EXTERNAL_API_FAILED, f"ExternalApiBase/{self.API_IDENTIFIER}: API call failed after {retry_count} retries", {"api": self.API_IDENTIFIER})
@@ -0,0 +1,170 @@
+import io
+import math
+import numpy as np
+from PIL import Image, TiffImagePlugin, TiffTags
+
+class GeoTiffRaster:
+    """
+    Helpers for north-up GeoTIFF rasters in a WGS 84 / UTM projection (EPSG 326xx north, 327xx south),
+    like the DSM and mask rasters of the Google Solar API.
+
+    georeference is the dict kept by GoogleSolarApi.get_rasters: model_pixel_scale (sx, sy, sz),
+    model_tiepoint (i, j, k, x, y, z), geo_key_directory and the other GeoTIFF and GDAL tags in TAGS
+    the TIFF has (e.g. geo_ascii_params, gdal_nodata).
+    """
+
+    PROJECTED_CRS_GEO_KEY = 3072
+
+    # GeoTIFF and GDAL tag: (name in georeference, TIFF field type), all of them are kept when a raster is cropped
+    TAGS = {
+        33550: ("model_pixel_scale", TiffTags.DOUBLE),
+        33922: ("model_tiepoint", TiffTags.DOUBLE),
+        34264: ("model_transformation", TiffTags.DOUBLE),
+        34735: ("geo_key_directory", TiffTags.SHORT),
+        34736: ("geo_double_params", TiffTags.DOUBLE),
+        34737: ("geo_ascii_params", TiffTags.ASCII),
+        42112: ("gdal_metadata", TiffTags.ASCII),
+        42113: ("gdal_nodata", TiffTags.ASCII),
+    }
+
+    # WGS 84 ellipsoid and UTM scale factor
+    SEMI_MAJOR_AXIS = 6378137.0
+    FLATTENING = 1 / 298.257223563
+    UTM_SCALE_FACTOR = 0.9996
+    UTM_FALSE_EASTING = 500000.0
+    UTM_FALSE_NORTHING_SOUTH = 10000000.0
+
+    @staticmethod
+    def read_georeference(img: Image.Image) -> dict:
+        """
+        georeference of an opened TIFF, the TAGS it has
+        """
+        return {
+            name: list(img.tag_v2[tag]) if isinstance(img.tag_v2[tag], tuple) else img.tag_v2[tag]
+            for tag, (name, _) in GeoTiffRaster.TAGS.items() if tag in img.tag_v2
+        }
+
+    @staticmethod
+    def get_epsg(georeference: dict) -> int | None:
+        """
+        EPSG code of the projected CRS (ProjectedCSTypeGeoKey), None if there is none
+        """
+        geo_key_directory = georeference.get("geo_key_directory") or []
+        # header of 4 values, then (key id, tag location, count, value) per key, tag location 0 means the value is inline
+        for offset in range(4, len(geo_key_directory) - 3, 4):
+            key_id, tag_location, _, value = geo_key_directory[offset:offset + 4]
+            if key_id == GeoTiffRaster.PROJECTED_CRS_GEO_KEY and tag_location == 0:
+                return value
+        return None
+
+    @staticmethod
+    def is_utm(epsg: int | None) -> bool:
+        return epsg is not None and (32601 <= epsg <= 32660 or 32701 <= epsg <= 32760)
+
+    @staticmethod
+    def project_utm(latitude: float, longitude: float, epsg: int) -> tuple:
+        """
+        (easting, northing) in meters of the WGS 84 / UTM zone given by epsg (transverse Mercator series, mm accuracy within the zone)
+        """
+        zone = epsg % 100
+        south = epsg > 32700
+
+        a = GeoTiffRaster.SEMI_MAJOR_AXIS
+        e2 = GeoTiffRaster.FLATTENING * (2 - GeoTiffRaster.FLATTENING)
+        ep2 = e2 / (1 - e2)
+        k0 = GeoTiffRaster.UTM_SCALE_FACTOR
+
+        phi = math.radians(latitude)
+        central_meridian = math.radians((zone - 1) * 6 - 180 + 3)
+
+        n = a / math.sqrt(1 - e2 * math.sin(phi)**2)
+        t = math.tan(phi)**2
+        c = ep2 * math.cos(phi)**2
+        big_a = math.cos(phi) * (math.radians(longitude) - central_meridian)
+        m = a * (
+            (1 - e2 / 4 - 3 * e2**2 / 64 - 5 * e2**3 / 256) * phi
+            - (3 * e2 / 8 + 3 * e2**2 / 32 + 45 * e2**3 / 1024) * math.sin(2 * phi)
+            + (15 * e2**2 / 256 + 45 * e2**3 / 1024) * math.sin(4 * phi)
+            - (35 * e2**3 / 3072) * math.sin(6 * phi)
+        )
+
+        easting = GeoTiffRaster.UTM_FALSE_EASTING + k0 * n * (
+            big_a
+            + (1 - t + c) * big_a**3 / 6
+            + (5 - 18 * t + t**2 + 72 * c - 58 * ep2) * big_a**5 / 120
+        )
+        northing = k0 * (m + n * math.tan(phi) * (
+            big_a**2 / 2
+            + (5 - t + 9 * c + 4 * c**2) * big_a**4 / 24
+            + (61 - 58 * t + t**2 + 600 * c - 330 * ep2) * big_a**6 / 720
+        ))
+        if south:
+            northing += GeoTiffRaster.UTM_FALSE_NORTHING_SOUTH
+
+        return easting, northing
+
+    @staticmethod
+    def get_window(georeference: dict, shape: tuple, easting: float, northing: float, half_size_meters: float) -> tuple | None:
+        """
+        Pixel window (row_start, row_stop, column_start, column_stop) of the square of half_size_meters around
+        (easting, northing), None if the raster doesn't cover all of it (or isn't georeferenced by a tiepoint and scale)
+        """
+        if "model_pixel_scale" not in georeference or "model_tiepoint" not in georeference:
+            return None
+        scale_x, scale_y = georeference["model_pixel_scale"][:2]
+        tiepoint_i, tiepoint_j, _, tiepoint_x, tiepoint_y = georeference["model_tiepoint"][:5]
+        # model coordinates of the top left corner of the raster
+        origin_x = tiepoint_x - tiepoint_i * scale_x
+        origin_y = tiepoint_y + tiepoint_j * scale_y
+
+        column_start = math.floor((easting - half_size_meters - origin_x) / scale_x)
+        column_stop = math.ceil((easting + half_size_meters - origin_x) / scale_x)
+        row_start = math.floor((origin_y - (northing + half_size_meters)) / scale_y)
+        row_stop = math.ceil((origin_y - (northing - half_size_meters)) / scale_y)
+
+        if row_start < 0 or column_start < 0 or row_stop > shape[0] or column_stop > shape[1]:
+            return None
+        return row_start, row_stop, column_start, column_stop
+
+    @staticmethod
+    def crop(raster: np.ndarray, georeference: dict, window: tuple) -> tuple:
+        """
+        (cropped raster, georeference of the cropped raster)
+        """
+        row_start, row_stop, column_start, column_stop = window
+        scale_x, scale_y = georeference["model_pixel_scale"][:2]
+        tiepoint_i, tiepoint_j, _, tiepoint_x, tiepoint_y, tiepoint_z = georeference["model_tiepoint"][:6]
+
+        cropped_georeference = {
+            **georeference,
+            "model_tiepoint": [
+                0.0, 0.0, 0.0,
+                tiepoint_x + (column_start - tiepoint_i) * scale_x,
+                tiepoint_y - (row_start - tiepoint_j) * scale_y,
+                tiepoint_z,
+            ],
+        }
+        if "model_transformation" in georeference:
+            # row-major 4x4 matrix from (column, row) to model coordinates, the translation moves to the new origin
+            transformation = list(georeference["model_transformation"])
+            for row in range(3):
+                transformation[row * 4 + 3] += transformation[row * 4] * column_start + transformation[row * 4 + 1] * row_start
+            cropped_georeference["model_transformation"] = transformation
+        return np.ascontiguousarray(raster[row_start:row_stop, column_start:column_stop]), cropped_georeference
+
+    @staticmethod
+    def to_tiff(raster: np.ndarray, georeference: dict) -> bytes:
+        tiff_info = TiffImagePlugin.ImageFileDirectory_v2()
+        for tag, (name, field_type) in GeoTiffRaster.TAGS.items():
+            if name in georeference:
+                value = georeference[name]
+                if field_type == TiffTags.ASCII:
+                    tiff_info[tag] = str(value)
+                else:
+                    # single values are read as scalars
+                    tiff_info[tag] = tuple(value) if isinstance(value, (list, tuple)) else (value,)
+                tiff_info.tagtype[tag] = field_type
+
+        tiff_stream = io.BytesIO()
+        Image.fromarray(raster).save(tiff_stream, format="TIFF", tiffinfo=tiff_info)
+        return tiff_stream.getvalue()
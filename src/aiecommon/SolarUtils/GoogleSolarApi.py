@@ -1,20 +1,29 @@
+import asyncio
 import io
 import json
+import mmap
 import os
+import re
 from urllib.error import HTTPError
 import pandas as pd
 import time
 import numpy as np
-import requests
-from requests import Request
 from PIL import Image
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import threading
 import aiecommon.custom_logger as custom_logger
 logger = custom_logger.get_logger()
 from aiecommon import SolarUtils
 from aiecommon.SolarUtils.ExternalApiBase import ExternalApiBase
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+from aiecommon.SolarUtils.HttpTransport import HttpTransport, AbortHandle
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+from aiecommon.SolarUtils.StreamedCacheFile import StreamedCacheFile
+from aiecommon.SolarUtils.SpatialCacheIndex import SpatialCacheIndex
+from aiecommon.SolarUtils.GeoTiffRaster import GeoTiffRaster
+from aiecommon.SolarUtils.PrefetchScheduler import PrefetchScheduler
 from aiecommon.Exceptions import AieException
+from aiecommon.FileSystem import LocalRuntimeFiles
 
 
 class GoogleSolarApi(ExternalApiBase):
@@ -22,6 +31,30 @@ class GoogleSolarApi(ExternalApiBase):
     STORAGE_FOLDER = 'googlesolarapi'
     API_IDENTIFIER = 'GoogleSolarApi'
     USE_PERMANENT_STORAGE = 'True'
+    # DSM/MASK are immutable bytes and are returned without copying, data layers JSON is copied
+    MEMORY_CACHE_MAX_ENTRIES = 32
+    MEMORY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    MEMORY_CACHE_COPY_ON_RETURN = True
+    # default Solar API quota is 600 queries per minute
+    RATE_LIMIT_PER_SECOND = 10
+    # locations without coverage (data layers 404) are not requested again for a day
+    NEGATIVE_CACHE_TTL_SECONDS = 24 * 3600
+    NEGATIVE_CACHE_ERROR_CODES = (AieException.HOUSE_NOT_LOCATED,)
+
+    # deadline of one TIFF download attempt, including hedged requests
+    TIFF_DEADLINE_SECONDS = 90
+    # if a TIFF request hasn't answered within the HEDGE_PERCENTILE latency of previous requests
+    # (at least HEDGE_MIN_DELAY_SECONDS, HEDGE_DEFAULT_DELAY_SECONDS until there are HEDGE_MIN_SAMPLES),
+    # a second request is started and the first to succeed wins, disabled if HEDGE_PERCENTILE is None
+    HEDGE_PERCENTILE = 95
+    HEDGE_MIN_DELAY_SECONDS = 2
+    HEDGE_DEFAULT_DELAY_SECONDS = 10
+    HEDGE_MIN_SAMPLES = 20
+    # hedged requests running at the same time in the process, first requests run in the calling thread
+    HEDGE_MAX_WORKERS = 16
+
+    __hedge_executor = None
+    __hedge_executor_lock = threading.Lock()
 
     COORDINATES_DECIMAL_PLACES = 4
 
@@ -31,6 +64,32 @@ class GoogleSolarApi(ExternalApiBase):
     ENDPOINT_IDENTIFIER_DSM = "ENDPOINT_IDENTIFIER_DSM"
     ENDPOINT_IDENTIFIER_MASK = "ENDPOINT_IDENTIFIER_MASK"
 
+    # DSM/MASK results: bytes, path of the cache file or read-only memoryview over the memory-mapped cache file
+    # (path and mmap downloads are streamed to the cache file, not held in memory)
+    RESULT_FORMAT_BYTES = "bytes"
+    RESULT_FORMAT_PATH = "path"
+    RESULT_FORMAT_MMAP = "mmap"
+    RESULT_FORMATS = [RESULT_FORMAT_BYTES, RESULT_FORMAT_PATH, RESULT_FORMAT_MMAP]
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+    # decoded DSM/MASK rasters (get_rasters) are stored next to the TIFF cache file (cache file path + suffix),
+    # the TIFF is the source of truth and the raster is rebuilt when the TIFF changes
+    RASTER_SUFFIX = ".npy"
+    RASTER_METADATA_SUFFIX = ".npy.json"
+
+    # a DSM/MASK that is not cached is cropped from a cached raster of a larger radius covering it (same or nearby
+    # location within CROP_SEARCH_RADIUS_METERS, e.g. the 250 m shading prefetch), disabled if CROP_FROM_CACHE is False
+    CROP_FROM_CACHE = True
+    CROP_SEARCH_RADIUS_METERS = 500
+    SPATIAL_INDEX_FILE_NAME = '_spatial_index.jsonl'
+    # shading prefetches (prefetch_shading_data_async) run on a bounded pool of PREFETCH_MAX_WORKERS threads,
+    # queued ones older than PREFETCH_MAX_AGE_SECONDS are dropped
+    SHADING_PREFETCH_RADIUS_METERS = 250
+    PREFETCH_MAX_WORKERS = 4
+    PREFETCH_MAX_QUEUE_SIZE = 1000
+    PREFETCH_MAX_AGE_SECONDS = 300
+    _TIFF_CACHE_FILE_NAME_PATTERN = re.compile(r"(ENDPOINT_IDENTIFIER_DSM|ENDPOINT_IDENTIFIER_MASK)_(\d+(?:\.\d+)?)_(-?\d+\.\d+)_(-?\d+\.\d+)")
+
     def __init__(self,
         max_retries : int = 3,
         min_retry_delay : int = 2,
@@ -55,30 +114,185 @@ class GoogleSolarApi(ExternalApiBase):
         return f"{params['endpoint_identifier']}_{params['radius_meters']}_{np.round(params['latitude'], GoogleSolarApi.COORDINATES_DECIMAL_PLACES):.3f}_{np.round(params['longitude'], GoogleSolarApi.COORDINATES_DECIMAL_PLACES):.3f}"
 
     @staticmethod
-    def _read_cache(cache_file_path: str, params) -> pd.DataFrame:
+    def _deserialize_cache(payload: bytes, params):
         match params["endpoint_identifier"]:
             case GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS:
-                with open(cache_file_path) as file:
-                    return json.load(file)
+                return json.loads(payload)
             case (GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM |
             GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK):
-                with open(cache_file_path, "rb") as file:
-                    return file.read()
+                return payload
             case _:
-                logger.error(f"GoogleSolarApi._read_cache: invalid endpoint_identifier, endpoint_identifier={params['endpoint_identifier']}")
+                logger.error(f"GoogleSolarApi._deserialize_cache: invalid endpoint_identifier, endpoint_identifier={params['endpoint_identifier']}")
 
     @staticmethod
-    def _write_cache(cache_file_path: str, data, params):
+    def _serialize_cache(data, params) -> bytes:
         match params["endpoint_identifier"]:
             case GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS:
-                with open(cache_file_path, "w") as file:
-                    return json.dump(data, file)
+                return json.dumps(data).encode()
             case (GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM | 
             GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK):
-                with open(cache_file_path, "bw") as file:
-                    return file.write(data)
+                return data
             case _:
-                logger.error(f"GoogleSolarApi._write_cache: invalid endpoint_identifier, endpoint_identifier={params['endpoint_identifier']}")
+                logger.error(f"GoogleSolarApi._serialize_cache: invalid endpoint_identifier, endpoint_identifier={params['endpoint_identifier']}")
+
+    @classmethod
+    def _save_cache(cls, params: dict, data):
+        result = super()._save_cache(params, data)
+        if params["endpoint_identifier"] in (GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM, GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK):
+            try:
+                cls._get_spatial_index().add(
+                    np.round(params['latitude'], GoogleSolarApi.COORDINATES_DECIMAL_PLACES),
+                    np.round(params['longitude'], GoogleSolarApi.COORDINATES_DECIMAL_PLACES),
+                    cls._get_cache_key(params),
+                    endpoint_identifier=params["endpoint_identifier"],
+                    # as in the cache key (e.g. 250 and 250.0 are different keys)
+                    radius_meters=params["radius_meters"],
+                )
+            except OSError as e:
+                logger.warning(f"GoogleSolarApi: cannot add cache entry to spatial index, params={params}, exception={e}")
+        return result
+
+    @classmethod
+    def _get_spatial_index(cls) -> SpatialCacheIndex:
+        index_file_path = LocalRuntimeFiles.get_file(os.path.join(cls.STORAGE_FOLDER, cls.SPATIAL_INDEX_FILE_NAME), usePermanentStorage=cls.USE_PERMANENT_STORAGE)
+        return SpatialCacheIndex.get(index_file_path, cls._get_spatial_index_build_entries)
+
+    @classmethod
+    def _get_spatial_index_build_entries(cls):
+        """
+        Index entries of the DSM/MASK cache files written before the index existed, parsed from the file names
+        """
+        cache_directory = LocalRuntimeFiles.get_file(cls.STORAGE_FOLDER, usePermanentStorage=cls.USE_PERMANENT_STORAGE)
+        for file_name in os.listdir(cache_directory):
+            match = GoogleSolarApi._TIFF_CACHE_FILE_NAME_PATTERN.fullmatch(file_name)
+            if match:
+                yield {
+                    "latitude": float(match.group(3)),
+                    "longitude": float(match.group(4)),
+                    "key": file_name,
+                    "endpoint_identifier": match.group(1),
+                    "radius_meters": float(match.group(2)) if "." in match.group(2) else int(match.group(2)),
+                }
+
+    def _get_result_from_covering_cache(self, params: dict, ignore_cache: bool):
+        """
+        DSM/MASK for params cropped from a cached raster of a larger radius covering it, None if there is none.
+        The cropped GeoTIFF is saved as the cache entry of params, so it's only cropped once.
+        """
+        if ignore_cache or not self.CROP_FROM_CACHE:
+            return None
+
+        latitude = params["latitude"]
+        longitude = params["longitude"]
+        radius_meters = float(params["radius_meters"])
+        # a source raster centered distance away needs a radius of at least distance + radius_meters
+        candidates = [
+            (entry["radius_meters"], distance, entry)
+            for distance, entry in self._get_spatial_index().find_within(
+                latitude, longitude, self.CROP_SEARCH_RADIUS_METERS,
+                lambda entry: entry.get("endpoint_identifier") == params["endpoint_identifier"] and entry.get("radius_meters", 0) > radius_meters,
+            )
+            if distance + radius_meters <= entry["radius_meters"]
+        ]
+        # the smallest covering raster is the cheapest to crop
+        candidates.sort(key=lambda candidate: candidate[:2])
+
+        for _, distance, entry in candidates:
+            source_params = {**params, "latitude": entry["latitude"], "longitude": entry["longitude"], "radius_meters": entry["radius_meters"]}
+            source_cache_file_path = self._get_cache_file_path(source_params)
+            # the index may be older than the cache (e.g. entries evicted by CacheJanitor)
+            if not os.path.exists(source_cache_file_path):
+                continue
+
+            try:
+                with self._get_cache_lock(params):
+                    if os.path.exists(self._get_cache_file_path(params)):
+                        # cached meanwhile
+                        return self._get_result_from_cache(False, params, record_metrics=False)
+                    if not self._crop_from_cache(params, source_params):
+                        continue
+            except Exception as e:
+                logger.warning(f"GoogleSolarApi: cannot crop cached raster, params={params}, source_params={source_params}, exception={e}")
+                continue
+
+            logger.info(f"GoogleSolarApi: cropped {params['endpoint_identifier']} from cached raster, distance_meters={distance:.0f}, params={params}, source_params={source_params}")
+            self._get_metrics(params).increment("crop_hits")
+            return self._get_result_from_cache(False, params, record_metrics=False)
+
+        return None
+
+    def _crop_from_cache(self, params: dict, source_params: dict) -> bool:
+        """
+        Save the crop of the cached source raster as the cache entry of params, False if the source doesn't cover it
+        """
+        source_cache_file_path = self._get_cache_file_path(source_params)
+        tiff_data = self._read_cache(source_cache_file_path, {**source_params, "result_format": GoogleSolarApi.RESULT_FORMAT_PATH})
+        raster, georeference = self._get_raster(source_params, tiff_data)
+
+        epsg = GeoTiffRaster.get_epsg(georeference)
+        if not GeoTiffRaster.is_utm(epsg):
+            logger.info(f"GoogleSolarApi._crop_from_cache: cached raster is not in a UTM projection, epsg={epsg}, source_params={source_params}")
+            return False
+
+        easting, northing = GeoTiffRaster.project_utm(params["latitude"], params["longitude"], epsg)
+        window = GeoTiffRaster.get_window(georeference, raster.shape, easting, northing, float(params["radius_meters"]))
+        if window is None:
+            logger.info(f"GoogleSolarApi._crop_from_cache: cached raster doesn't cover the requested extent, params={params}, source_params={source_params}")
+            return False
+
+        cropped_raster, cropped_georeference = GeoTiffRaster.crop(raster, georeference, window)
+        self._save_cache(params, GeoTiffRaster.to_tiff(cropped_raster, cropped_georeference))
+        return True
+
+    @classmethod
+    def _read_cache(cls, cache_file_path: str, params: dict):
+        result_format = params.get("result_format", GoogleSolarApi.RESULT_FORMAT_BYTES)
+        if result_format == GoogleSolarApi.RESULT_FORMAT_BYTES:
+            return super()._read_cache(cache_file_path, params)
+
+        raw_file_path = GoogleSolarApi._get_raw_file_path(cache_file_path)
+        if raw_file_path is None:
+            logger.warning(f"GoogleSolarApi._read_cache: cache file is encoded (CACHE_CODEC={cls.CACHE_CODEC}), returning bytes instead of {result_format}, cache_file_path={cache_file_path}")
+            return super()._read_cache(cache_file_path, params)
+
+        if result_format == GoogleSolarApi.RESULT_FORMAT_MMAP:
+            # the mapping stays valid if the cache file is replaced or evicted meanwhile (the old inode is kept until unmapped)
+            with open(raw_file_path, "rb") as file:
+                return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return raw_file_path
+
+    @staticmethod
+    def _get_raw_file_path(cache_file_path: str) -> str | None:
+        """
+        Path of the file holding the TIFF itself (a deduplicated cache file points to its blob), None if it's encoded
+        """
+        if CacheStorage.is_raw(cache_file_path):
+            return cache_file_path
+        blob_path = CacheStorage.get_referenced_blob_path(cache_file_path)
+        if blob_path is not None and CacheStorage.is_raw(blob_path):
+            return blob_path
+        return None
+
+    @staticmethod
+    def _is_memory_cacheable(params: dict) -> bool:
+        return params.get("result_format", GoogleSolarApi.RESULT_FORMAT_BYTES) == GoogleSolarApi.RESULT_FORMAT_BYTES
+
+    @classmethod
+    def _is_negative_cacheable(cls, params: dict, exception: AieException) -> bool:
+        # other errors (e.g. 403 of an expired TIFF url, 429) are not about the location
+        return (
+            super()._is_negative_cacheable(params, exception)
+            and params.get("endpoint_identifier") == GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS
+            and (exception.data or {}).get("status_code") == 404
+        )
+
+    @classmethod
+    def _get_negative_cache_file_path(cls, params: dict):
+        # a location the MEDIUM quality request doesn't find can still be found by the EXPANDED_COVERAGE request
+        # (use_google_experimental), so their answers are cached apart
+        if params.get("use_google_experimental"):
+            return cls._get_cache_file_path(params) + "_EXPANDED_COVERAGE" + cls.NEGATIVE_CACHE_SUFFIX
+        return super()._get_negative_cache_file_path(params)
 
     @staticmethod
     def _check_cache(cached_result, params):
@@ -92,7 +306,15 @@ class GoogleSolarApi(ExternalApiBase):
             case (GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK |
             GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM):
                 try:
-                    image_stream = io.BytesIO(cached_result)
+                    if isinstance(cached_result, StreamedCacheFile):
+                        image_stream = cached_result.path if cached_result.committed else cached_result.cache_file_path
+                    elif isinstance(cached_result, str):
+                        image_stream = cached_result
+                    elif isinstance(cached_result, memoryview):
+                        # validated through the file, not through a copy of the mapping
+                        image_stream = GoogleSolarApi._get_raw_file_path(GoogleSolarApi._get_cache_file_path(params))
+                    else:
+                        image_stream = io.BytesIO(cached_result)
                     with Image.open(image_stream) as img:
                         img.verify()
                     return True
@@ -110,9 +332,10 @@ class GoogleSolarApi(ExternalApiBase):
         match params["endpoint_identifier"]:
             case GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS:
                 return len(json.dumps(result_data))
-            case GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM:
-                return len(result_data)
-            case GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK:
+            case (GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM |
+            GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK):
+                if isinstance(result_data, str):
+                    return os.path.getsize(result_data)
                 return len(result_data)
             case _:
                 logger.error(f"GoogleSolarApi._get_result_size: invalid endpoint_identifier, endpoint_identifier={params['endpoint_identifier']}")
@@ -143,7 +366,7 @@ class GoogleSolarApi(ExternalApiBase):
         # parameters: https://developers.google.com/maps/documentation/solar/reference/rest/v1/dataLayers/get#query-parameters
         logger.info(f"Map resolution is set to {query_params['pixelSizeMeters']} meters, this is google data")
 
-        response = requests.get(url=self.DATALAYERS_BASE_URL, params=query_params)
+        response = self._http_get(self.DATALAYERS_BASE_URL, params=query_params)
         if response.status_code == 200:
             logger.info(f'GoogleSolarApi {retry_count}/{max_retries}: Successfully fetched datalayer JSON')
             data = response.json()
@@ -170,16 +393,192 @@ class GoogleSolarApi(ExternalApiBase):
     #     else:
     #         raise AieException(AieException.EXTERNAL_API_FAILED, f"GoogleSolarApi._fetch_tiff {retry_count}/{max_retries}: API call failed, response.status_code={response.status_code}, response.text={response.text}", {"api": self.API_IDENTIFIER, "status_code": response.status_code})
 
-    def _fetch_tiff(self, max_retries, retry_count, endpoint_identifier, latitude, longitude, radius_meters, url):
-        
-        response = requests.get(url=url, params={"key": self.API_KEY})
-        if response.status_code == 200:
+    def _fetch_tiff(self, max_retries, retry_count, endpoint_identifier, latitude, longitude, radius_meters, url, result_format=RESULT_FORMAT_BYTES):
+        """
+        Download the TIFF within TIFF_DEADLINE_SECONDS, hedged with a second request if the first one is slow.
+        Returns bytes, or a StreamedCacheFile if result_format is not bytes.
+
+        The first request runs in the calling thread, only the hedge runs on the shared hedge executor. The hedge
+        delay and the deadline count from the start of the first request. A request that lost the race (or passed
+        the deadline) is given up at its next chunk, the timeouts of both requests end at the deadline at the latest.
+
+        Metrics (endpoint_identifier): request_seconds of the winning requests, hedges_fired, hedges_won,
+        deadline_exceeded and hedge_saved_seconds - when the hedge won, the time the first request had already run
+        minus the time the hedge took, as an estimate of the time saved (the first request is given up, so its full
+        duration is unknown).
+        """
+        metrics = ApiMetrics.get(self.API_IDENTIFIER, endpoint_identifier)
+        stream = result_format != GoogleSolarApi.RESULT_FORMAT_BYTES
+        cache_file_path = self._get_cache_file_path({"endpoint_identifier": endpoint_identifier, "latitude": latitude, "longitude": longitude, "radius_meters": radius_meters})
+
+        start = time.monotonic()
+        deadline = start + self.TIFF_DEADLINE_SECONDS
+        # set by the first request that downloaded the whole TIFF, the other one is aborted
+        won = threading.Event()
+        won_lock = threading.Lock()
+        abort_handles = []
+        # abort handle of the request that won -> (time it won, seconds it took)
+        wins = {}
+
+        def request(abort_handle: AbortHandle):
+            """
+            (response, body): body is the TIFF (bytes, or StreamedCacheFile if streaming) if the response is 200 and
+            the request won, response and body are None if the request was given up or aborted
+            """
+            try:
+                with HttpTransport.abortable(abort_handle):
+                    return download(abort_handle)
+            except Exception:
+                if abort_handle.aborted:
+                    return None, None
+                raise
+
+        def download(abort_handle: AbortHandle):
+            request_start = time.monotonic()
+            if won.is_set() or request_start >= deadline:
+                return None, None
+
+            response = self._http_get(url, params={"key": self.API_KEY}, stream=True, timeout=self._get_tiff_timeout(deadline))
+            try:
+                if response.status_code != 200:
+                    # the error text is small, it's read before the connection is released
+                    response.content
+                    return response, None
+
+                body = StreamedCacheFile(cache_file_path) if stream else io.BytesIO()
+                try:
+                    for chunk in response.iter_content(GoogleSolarApi.DOWNLOAD_CHUNK_SIZE):
+                        if won.is_set() or time.monotonic() >= deadline:
+                            break
+                        body.write(chunk)
+                    else:
+                        with won_lock:
+                            if not won.is_set():
+                                won.set()
+                                for other_abort_handle in abort_handles:
+                                    if other_abort_handle is not abort_handle:
+                                        other_abort_handle.abort()
+                                won_at = time.monotonic()
+                                wins[abort_handle] = (won_at, won_at - request_start)
+                                metrics.observe("request_seconds", won_at - request_start)
+                                if stream:
+                                    body.close()
+                                    return response, body
+                                return response, body.getvalue()
+                except BaseException:
+                    if stream:
+                        body.discard()
+                    raise
+                if stream:
+                    body.discard()
+                return None, None
+            finally:
+                response.close()
+
+        hedge = None
+        hedge_closed = False
+        hedge_lock = threading.Lock()
+
+        def send_hedge():
+            nonlocal hedge
+            with hedge_lock:
+                if hedge_closed or won.is_set() or time.monotonic() >= deadline:
+                    return
+                logger.info(f"GoogleSolarApi {retry_count}/{max_retries}: no answer within {hedge_delay:.2f} seconds, sending hedged request, endpoint_identifier={endpoint_identifier}")
+                metrics.increment("hedges_fired")
+                hedge_abort_handle = AbortHandle()
+                abort_handles.append(hedge_abort_handle)
+                hedge = GoogleSolarApi._get_hedge_executor().submit(request, hedge_abort_handle)
+
+        hedge_delay = self._get_hedge_delay(metrics)
+        hedge_timer = None
+        if hedge_delay is not None and hedge_delay < self.TIFF_DEADLINE_SECONDS:
+            hedge_timer = threading.Timer(hedge_delay, send_hedge)
+            hedge_timer.daemon = True
+            hedge_timer.start()
+
+        results = []
+        exceptions = []
+        primary_abort_handle = AbortHandle()
+        abort_handles.append(primary_abort_handle)
+        try:
+            results.append(request(primary_abort_handle))
+        except Exception as e:
+            exceptions.append(e)
+        finally:
+            if hedge_timer is not None:
+                hedge_timer.cancel()
+
+        with hedge_lock:
+            # no hedge is sent after the first request ended
+            hedge_closed = True
+            hedge_future = hedge
+
+        if hedge_future is not None:
+            if results and results[0][1] is not None:
+                # the first request won, a hedge that hasn't started isn't sent, a running one gives up
+                hedge_future.cancel()
+            else:
+                try:
+                    hedge_result = hedge_future.result(timeout=max(0, deadline - time.monotonic()))
+                    results.append(hedge_result)
+                    if hedge_result[1] is not None:
+                        metrics.increment("hedges_won")
+                        won_at, hedge_seconds = wins[abort_handles[-1]]
+                        metrics.observe("hedge_saved_seconds", max(0.0, won_at - start - hedge_seconds))
+                except FuturesTimeoutError:
+                    # the hedge is given up, its worker is released at once
+                    won.set()
+                    for abort_handle in abort_handles:
+                        abort_handle.abort()
+                except Exception as e:
+                    exceptions.append(e)
+
+        response, body = next(((response, body) for response, body in results if body is not None), (None, None))
+        if body is not None:
             logger.info(f'GoogleSolarApi {retry_count}/{max_retries}: Successfully fetched tiff data')
-            return response.content
-        else:
+            return body
+
+        failed_responses = [response for response, _ in results if response is not None]
+        if failed_responses:
+            response = failed_responses[0]
             # the real reason for not having 200 is that data does not exist so we need to return house not located so that the user can edit sides manually
             raise AieException(AieException.HOUSE_NOT_LOCATED, f"GoogleSolarApi._fetch_tiff {retry_count}/{max_retries}: API call failed, response.status_code={response.status_code}, response.text={response.text}", {"api": self.API_IDENTIFIER, "status_code": response.status_code})
 
+        if time.monotonic() >= deadline or not exceptions:
+            metrics.increment("deadline_exceeded")
+            raise TimeoutError(f"GoogleSolarApi._fetch_tiff {retry_count}/{max_retries}: no answer within the deadline, TIFF_DEADLINE_SECONDS={self.TIFF_DEADLINE_SECONDS}, elapsed={time.monotonic() - start:.2f}")
+        raise exceptions[0]
+
+    def _get_tiff_timeout(self, deadline: float) -> tuple:
+        """
+        (connect, read) timeout of a TIFF request, the HTTP transport timeouts cut at the deadline
+        """
+        timeout = self._get_http_transport().timeout
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        remaining = max(0.001, deadline - time.monotonic())
+        return (
+            min(connect_timeout, remaining) if connect_timeout is not None else remaining,
+            min(read_timeout, remaining) if read_timeout is not None else remaining,
+        )
+
+    @staticmethod
+    def _get_hedge_executor() -> ThreadPoolExecutor:
+        with GoogleSolarApi.__hedge_executor_lock:
+            if GoogleSolarApi.__hedge_executor is None:
+                GoogleSolarApi.__hedge_executor = ThreadPoolExecutor(max_workers=GoogleSolarApi.HEDGE_MAX_WORKERS, thread_name_prefix="google-solar-api-request")
+            return GoogleSolarApi.__hedge_executor
+
+    def _get_hedge_delay(self, metrics: ApiMetrics) -> float | None:
+        """
+        Seconds to wait for the first request before hedging, None if hedging is disabled
+        """
+        if self.HEDGE_PERCENTILE is None:
+            return None
+        if metrics.get_count("request_seconds") < self.HEDGE_MIN_SAMPLES:
+            return max(self.HEDGE_MIN_DELAY_SECONDS, self.HEDGE_DEFAULT_DELAY_SECONDS)
+        return max(self.HEDGE_MIN_DELAY_SECONDS, metrics.percentile("request_seconds", self.HEDGE_PERCENTILE))
+
     def _get_tiff(
         self,
         api_call_params,
@@ -218,14 +617,7 @@ class GoogleSolarApi(ExternalApiBase):
 
         return self.call_api(
             api_call_function=self. _fetch_data_layers,
-            api_call_params={
-                "latitude": latitude,
-                "longitude": longitude,
-                "radius_meters": radius_meters,
-                "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS,
-                # "url": "https://solar.googleapis.com/v1/dataLayers:get",
-                "use_google_experimental": use_google_experimental
-            },
+            api_call_params=GoogleSolarApi._get_layers_info_api_call_params(latitude, longitude, radius_meters, use_google_experimental),
             get_result_size_function=self._get_result_size,
             max_retries=max_retries,
             min_retry_delay=min_retry_delay,
@@ -243,19 +635,19 @@ class GoogleSolarApi(ExternalApiBase):
         min_retry_delay : int | None = None,
         min_result_size : int = 1024,
         ignore_cache : bool | None = None,
+        result_format : str = RESULT_FORMAT_BYTES,
     ) -> pd.DataFrame | None:
         """
         Retrieve Google Solar API tiff for given url
+        result_format - RESULT_FORMAT_BYTES (TIFF bytes), RESULT_FORMAT_PATH (path of the cached TIFF file)
+                        or RESULT_FORMAT_MMAP (read-only memoryview over the memory-mapped cached TIFF file)
         """
 
+        api_call_params = GoogleSolarApi._get_tiff_api_call_params(latitude, longitude, radius_meters, result_format)[GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM]
+        api_call_params["url"] = url
+
         return self._get_tiff(
-            api_call_params={
-                "latitude": latitude,
-                "longitude": longitude,
-                "radius_meters": radius_meters,
-                "url": url,
-                "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM,
-            },
+            api_call_params=api_call_params,
             max_retries=max_retries,
             min_retry_delay=min_retry_delay,
             min_result_size=min_result_size,
@@ -272,6 +664,7 @@ class GoogleSolarApi(ExternalApiBase):
         max_retries : int | None = None,
         min_retry_delay : int | None = None,
         ignore_cache : bool | None = None,
+        result_format : str = RESULT_FORMAT_BYTES,
     ) -> pd.DataFrame | None:
         """
         Retrieve Google Solar API dsm and mask for given latitude and lognitude
@@ -279,24 +672,17 @@ class GoogleSolarApi(ExternalApiBase):
             - to data layer to retreive dsm url and mask url - JSON response
             - to the dsm url retreived from the data layer response - TIFF response
             - to the mask url retreived from the data layer response - TIFF response
+        A DSM or mask that is not cached is cropped from a cached raster of a larger radius covering it if there is one.
+
+        result_format - RESULT_FORMAT_BYTES: dsm_data and mask_data are TIFF bytes
+                        RESULT_FORMAT_PATH: dsm_data and mask_data are paths of the cached TIFF files, downloads are
+                        streamed to the cache file instead of being held in memory (falls back to bytes if CACHE_CODEC is set)
+                        RESULT_FORMAT_MMAP: like RESULT_FORMAT_PATH, but dsm_data and mask_data are read-only memoryviews
+                        over the memory-mapped cache files, threads and forked workers share the page cache without copying
         """
 
         endpoint_identifiers_set = set(endpoint_identifiers)
-        api_call_params = {}
-
-        api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM] = {
-                "latitude": latitude,
-                "longitude": longitude,
-                "radius_meters": radius_meters,
-                "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM,
-        }
-
-        api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK] = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "radius_meters": radius_meters,
-            "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK,
-        }
+        api_call_params = GoogleSolarApi._get_tiff_api_call_params(latitude, longitude, radius_meters, result_format)
 
         cached_dsm_data = None
         cached_mask_data = None
@@ -307,14 +693,22 @@ class GoogleSolarApi(ExternalApiBase):
         else: 
             if GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM in endpoint_identifiers_set:
                 cached_dsm_data = self._get_result_from_cache(ignore_cache=ignore_cache, api_call_params=api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM]) 
+                if cached_dsm_data is None:
+                    cached_dsm_data = self._get_result_from_covering_cache(api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM], ignore_cache)
                 if cached_dsm_data is None:
                     endpoint_identifiers_set.add(GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS)
             if GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK in endpoint_identifiers_set:
                 cached_mask_data = self._get_result_from_cache(ignore_cache=ignore_cache, api_call_params=api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK])
+                if cached_mask_data is None:
+                    cached_mask_data = self._get_result_from_covering_cache(api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK], ignore_cache)
                 if cached_mask_data is None:
                     endpoint_identifiers_set.add(GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS)
         
         if GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS in endpoint_identifiers_set:
+            # data layers are always requested again (see ignore_cache below), except for locations known to have no data
+            if not ignore_cache:
+                self._raise_if_negative_cached(GoogleSolarApi._get_layers_info_api_call_params(latitude, longitude, radius_meters, use_google_experimental))
+
             layers_info = self.get_layers_info(
                 latitude=latitude,
                 longitude=longitude,
@@ -382,6 +776,345 @@ class GoogleSolarApi(ExternalApiBase):
 
         return dict(layers_info=layers_info, mask_data=mask_data, dsm_data=dsm_data)
     
+    def get_rasters(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_meters: float,
+        use_google_experimental: bool,
+        endpoint_identifiers: list = [ENDPOINT_IDENTIFIER_DSM, ENDPOINT_IDENTIFIER_MASK],
+        max_retries : int | None = None,
+        min_retry_delay : int | None = None,
+        ignore_cache : bool | None = None,
+    ) -> dict:
+        """
+        Like get_data, but returns decoded DSM and mask rasters instead of TIFFs:
+            - dsm_raster, mask_raster - read-only np.memmap arrays, pages are read lazily
+            - dsm_georeference, mask_georeference - GeoTIFF and GDAL tags of the raster (model_pixel_scale, model_tiepoint, geo_key_directory, gdal_nodata, ...), see GeoTiffRaster.TAGS
+
+        The rasters are decoded once and stored as .npy files next to the TIFF cache files,
+        they are rebuilt when they are missing or older than the TIFF.
+        """
+
+        data = self.get_data(
+            latitude=latitude,
+            longitude=longitude,
+            radius_meters=radius_meters,
+            use_google_experimental=use_google_experimental,
+            endpoint_identifiers=endpoint_identifiers,
+            max_retries=max_retries,
+            min_retry_delay=min_retry_delay,
+            ignore_cache=ignore_cache,
+            result_format=GoogleSolarApi.RESULT_FORMAT_PATH,
+        )
+
+        api_call_params = GoogleSolarApi._get_tiff_api_call_params(latitude, longitude, radius_meters)
+        rasters = dict(layers_info=data["layers_info"], dsm_raster=None, mask_raster=None, dsm_georeference=None, mask_georeference=None)
+
+        for endpoint_identifier, name in ((GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM, "dsm"), (GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK, "mask")):
+            if data[f"{name}_data"] is not None:
+                rasters[f"{name}_raster"], rasters[f"{name}_georeference"] = self._get_raster(api_call_params[endpoint_identifier], data[f"{name}_data"])
+
+        return rasters
+
+    @classmethod
+    def _get_raster(cls, params: dict, tiff_data) -> tuple:
+        """
+        (np.memmap, georeference) of the cached TIFF, decoded into the raster file if it's missing or stale
+        tiff_data - path of the TIFF, or its bytes if the cache file is encoded
+        """
+        cache_file_path = cls._get_cache_file_path(params)
+        metrics = ApiMetrics.get(cls.API_IDENTIFIER, params["endpoint_identifier"])
+
+        raster = cls._load_raster(cache_file_path)
+        if raster is None:
+            with cls._get_cache_lock(params):
+                # another thread or process may have built it meanwhile
+                raster = cls._load_raster(cache_file_path)
+                if raster is None:
+                    cls._build_raster(cache_file_path, tiff_data)
+                    metrics.increment("raster_builds")
+                    raster = cls._load_raster(cache_file_path)
+        else:
+            metrics.increment("raster_hits")
+
+        return raster
+
+    @classmethod
+    def _load_raster(cls, cache_file_path: str) -> tuple | None:
+        """
+        (np.memmap, georeference) from the raster file, None if it doesn't exist or wasn't built from the current TIFF
+        """
+        try:
+            with open(cache_file_path + cls.RASTER_METADATA_SUFFIX, "r") as file:
+                metadata = json.load(file)
+            cache_file_stat = os.stat(cache_file_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if (metadata.get("source_mtime_ns"), metadata.get("source_size")) != (cache_file_stat.st_mtime_ns, cache_file_stat.st_size) or metadata.get("georeference_tags") != list(GeoTiffRaster.TAGS):
+            logger.info(f"GoogleSolarApi._load_raster: raster is stale, cache_file_path={cache_file_path}")
+            return None
+
+        try:
+            raster = np.load(cache_file_path + cls.RASTER_SUFFIX, mmap_mode="r")
+        except (FileNotFoundError, ValueError) as e:
+            logger.warning(f"GoogleSolarApi._load_raster: cannot load raster, cache_file_path={cache_file_path}, exception={e}")
+            return None
+
+        return raster, metadata["georeference"]
+
+    @classmethod
+    def _build_raster(cls, cache_file_path: str, tiff_data):
+        # the stat is taken first, a TIFF replaced while decoding makes the raster stale instead of wrong
+        cache_file_stat = os.stat(cache_file_path)
+
+        with Image.open(tiff_data if isinstance(tiff_data, str) else io.BytesIO(tiff_data)) as img:
+            raster = np.asarray(img)
+            georeference = GeoTiffRaster.read_georeference(img)
+
+        raster_file_path = cache_file_path + cls.RASTER_SUFFIX
+        temp_file_path = CacheStorage.get_temp_file_path(raster_file_path)
+        try:
+            with open(temp_file_path, "wb") as file:
+                np.save(file, raster)
+            os.replace(temp_file_path, raster_file_path)
+        except BaseException:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+        # the metadata is written last, it marks the raster as complete
+        metadata = {
+            "source_mtime_ns": cache_file_stat.st_mtime_ns,
+            "source_size": cache_file_stat.st_size,
+            "dtype": str(raster.dtype),
+            "shape": list(raster.shape),
+            "georeference": georeference,
+            # rasters decoded with other tags are rebuilt
+            "georeference_tags": list(GeoTiffRaster.TAGS),
+        }
+        CacheStorage.write_atomic(cache_file_path + cls.RASTER_METADATA_SUFFIX, json.dumps(metadata).encode())
+        logger.info(f"GoogleSolarApi._build_raster: decoded raster, cache_file_path={cache_file_path}, dtype={raster.dtype}, shape={raster.shape}")
+
+    @staticmethod
+    def _get_layers_info_api_call_params(latitude, longitude, radius_meters, use_google_experimental) -> dict:
+        return {
+            "latitude": latitude,
+            "longitude": longitude,
+            "radius_meters": radius_meters,
+            "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS,
+            # "url": "https://solar.googleapis.com/v1/dataLayers:get",
+            "use_google_experimental": use_google_experimental
+        }
+
+    @staticmethod
+    def _get_tiff_api_call_params(latitude, longitude, radius_meters, result_format=RESULT_FORMAT_BYTES) -> dict:
+        if result_format not in GoogleSolarApi.RESULT_FORMATS:
+            raise ValueError(f"GoogleSolarApi: invalid result_format, result_format={result_format}, valid result formats={GoogleSolarApi.RESULT_FORMATS}")
+
+        api_call_params = {}
+
+        api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM] = {
+                "latitude": latitude,
+                "longitude": longitude,
+                "radius_meters": radius_meters,
+                "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM,
+                "result_format": result_format,
+        }
+
+        api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK] = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "radius_meters": radius_meters,
+            "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK,
+            "result_format": result_format,
+        }
+
+        return api_call_params
+
+    async def _get_tiff_async(
+        self,
+        api_call_params,
+        max_retries : int | None = None,
+        min_retry_delay : int | None = None,
+        min_result_size : int = 1024,
+        ignore_cache : bool | None = None,
+    ) -> bytes | None:
+        """
+        Async version of _get_tiff
+        """
+
+        return await self.call_api_async(
+            api_call_function=self._fetch_tiff,
+            api_call_params=api_call_params,
+            get_result_size_function=self._get_result_size,
+            max_retries=max_retries,
+            min_retry_delay=min_retry_delay,
+            min_result_size=min_result_size,
+            ignore_cache=ignore_cache,
+        )
+
+    async def get_layers_info_async(
+        self,
+        latitude, longitude,
+        radius_meters,
+        use_google_experimental,
+        max_retries : int | None = None,
+        min_retry_delay : int | None = None,
+        min_result_size : int = 64,
+        ignore_cache : bool | None = True,
+    ) -> dict | None:
+        """
+        Async version of get_layers_info
+        """
+
+        return await self.call_api_async(
+            api_call_function=self._fetch_data_layers,
+            api_call_params=GoogleSolarApi._get_layers_info_api_call_params(latitude, longitude, radius_meters, use_google_experimental),
+            get_result_size_function=self._get_result_size,
+            max_retries=max_retries,
+            min_retry_delay=min_retry_delay,
+            min_result_size=min_result_size,
+            ignore_cache=ignore_cache,
+        )
+
+    async def get_data_async(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_meters: float,
+        use_google_experimental: bool,
+        endpoint_identifiers: list = [ENDPOINT_IDENTIFIER_DSM, ENDPOINT_IDENTIFIER_MASK],
+        max_retries : int | None = None,
+        min_retry_delay : int | None = None,
+        ignore_cache : bool | None = None,
+        result_format : str = RESULT_FORMAT_BYTES,
+    ) -> dict:
+        """
+        Async version of get_data, shares the cache with get_data.
+
+        Pipelined: the DSM and mask caches are probed concurrently (in worker threads), the data layers call
+        starts as soon as one of them misses and each TIFF download starts as soon as the data layers answer.
+        As in get_data, if the data layers are called both TIFFs are downloaded from the new urls.
+
+        The result also has "timings", seconds spent in each stage (None if the stage didn't run):
+        cache_probe_seconds, layers_seconds, dsm_seconds, mask_seconds, total_seconds.
+        They are observed as histograms of ApiMetrics GoogleSolarApi/get_data.
+        """
+
+        start = time.perf_counter()
+        timings = dict(cache_probe_seconds=None, layers_seconds=None, dsm_seconds=None, mask_seconds=None, total_seconds=None)
+
+        endpoint_identifiers_set = set(endpoint_identifiers)
+        api_call_params = GoogleSolarApi._get_tiff_api_call_params(latitude, longitude, radius_meters, result_format)
+        tiff_endpoint_identifiers = [
+            endpoint_identifier for endpoint_identifier in (GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM, GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK)
+            if endpoint_identifier in endpoint_identifiers_set
+        ]
+
+        layers_task = None
+        layers_started = asyncio.Event()
+
+        async def get_layers_info():
+            layers_start = time.perf_counter()
+            # data layers are always requested again (see get_data), except for locations known to have no data
+            if not ignore_cache:
+                await asyncio.to_thread(self._raise_if_negative_cached, GoogleSolarApi._get_layers_info_api_call_params(latitude, longitude, radius_meters, use_google_experimental))
+
+            layers_info = await self.get_layers_info_async(
+                latitude=latitude,
+                longitude=longitude,
+                radius_meters=radius_meters,
+                use_google_experimental=use_google_experimental,
+                max_retries = max_retries,
+                min_retry_delay = min_retry_delay,
+                ignore_cache = True,
+            )
+            timings["layers_seconds"] = time.perf_counter() - layers_start
+            logger.info(f"GoogleSolarApi: got data layers info, layers_info={layers_info}")
+            return layers_info
+
+        def start_layers_info():
+            nonlocal layers_task
+            if layers_task is None:
+                layers_task = asyncio.ensure_future(get_layers_info())
+                layers_started.set()
+
+        async def probe_cache(endpoint_identifier):
+            cached_result = await asyncio.to_thread(self._get_result_from_cache, ignore_cache, api_call_params[endpoint_identifier])
+            if cached_result is None:
+                cached_result = await asyncio.to_thread(self._get_result_from_covering_cache, api_call_params[endpoint_identifier], ignore_cache)
+            if cached_result is None:
+                start_layers_info()
+            return cached_result
+
+        async def probe_caches(probes):
+            results = await asyncio.gather(*probes.values())
+            timings["cache_probe_seconds"] = time.perf_counter() - start
+            return results
+
+        async def get_tiff(endpoint_identifier, name):
+            cached_result = await probes[endpoint_identifier] if endpoint_identifier in probes else None
+
+            # the cached TIFF is used unless the data layers are called (because of the other TIFF's miss)
+            if layers_task is None and probes:
+                layers_started_wait = asyncio.ensure_future(layers_started.wait())
+                await asyncio.wait([probes_task, layers_started_wait], return_when=asyncio.FIRST_COMPLETED)
+                layers_started_wait.cancel()
+            if layers_task is None:
+                return cached_result
+
+            layers_info = await layers_task
+            if layers_info:
+                api_call_params[endpoint_identifier]["url"] = layers_info.get(f"{name}Url")
+                cached_result = None
+            if cached_result is not None:
+                return cached_result
+
+            logger.info(f"GoogleSolarApi: downloading {endpoint_identifier} via _get_tiff_async")
+            download_start = time.perf_counter()
+            result = await self._get_tiff_async(
+                api_call_params=api_call_params[endpoint_identifier],
+                max_retries=max_retries,
+                min_retry_delay=min_retry_delay,
+                ignore_cache=ignore_cache,
+            )
+            timings[f"{name}_seconds"] = time.perf_counter() - download_start
+            return result
+
+        if ignore_cache:
+            logger.info(f"GoogleSolarApi: ignore cache is on, will not check cache before calling data layers endpoint, ignore_cache={ignore_cache}")
+            probes = {}
+        else:
+            probes = {endpoint_identifier: asyncio.ensure_future(probe_cache(endpoint_identifier)) for endpoint_identifier in tiff_endpoint_identifiers}
+        probes_task = asyncio.ensure_future(probe_caches(probes))
+        if ignore_cache or GoogleSolarApi.ENDPOINT_IDENTIFIER_DATALAYERS in endpoint_identifiers_set:
+            start_layers_info()
+
+        names = {GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM: "dsm", GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK: "mask"}
+        data = dict(zip(
+            tiff_endpoint_identifiers,
+            await asyncio.gather(*(get_tiff(endpoint_identifier, names[endpoint_identifier]) for endpoint_identifier in tiff_endpoint_identifiers)),
+        ))
+        layers_info = await layers_task if layers_task is not None else None
+        await probes_task
+
+        timings["total_seconds"] = time.perf_counter() - start
+        metrics = ApiMetrics.get(self.API_IDENTIFIER, "get_data")
+        for stage, seconds in timings.items():
+            if seconds is not None:
+                metrics.observe(stage, seconds)
+
+        logger.info(f"GoogleSolarApi: completed get_data_async, downloaded={[names[endpoint_identifier] for endpoint_identifier in tiff_endpoint_identifiers if timings[names[endpoint_identifier] + '_seconds'] is not None]}, timings={timings}")
+
+        return dict(
+            layers_info=layers_info,
+            mask_data=data.get(GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK),
+            dsm_data=data.get(GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM),
+            timings=timings,
+        )
+
     def prefetch_shading_data_async(
         self,
         latitude: float,
@@ -390,51 +1123,71 @@ class GoogleSolarApi(ExternalApiBase):
         max_retries: int | None = None,
         min_retry_delay: int | None = None,
         ignore_cache: bool | None = None,
-    ) -> None:
+        priority: int = 0,
+    ) -> bool:
         """
         Fire-and-forget prefetch for shading analysis.
 
-        - Uses radius_meters = 250
-        - Runs in a background thread
+        - Uses radius_meters = SHADING_PREFETCH_RADIUS_METERS (250)
+        - Runs in the background, on the shared prefetch scheduler (PREFETCH_MAX_WORKERS threads)
         - Populates cache for DATALAYERS, DSM and MASK
         - We do NOT wait for completion
+        - Deduplicated with queued and running prefetches of the same location, skipped if it's cached meanwhile
+        - priority - lower values run first
+
+        Returns False if the prefetch was not queued (deduplicated, queue full or shut down).
         """
+        radius_meters = GoogleSolarApi.SHADING_PREFETCH_RADIUS_METERS
+        api_call_params = GoogleSolarApi._get_tiff_api_call_params(latitude, longitude, radius_meters, GoogleSolarApi.RESULT_FORMAT_PATH)
 
         def _worker():
-            try:
-                logger.info(
-                    "GoogleSolarApi: starting async shading prefetch (radius=250m) "
-                    f"for lat={latitude}, lon={longitude}"
-                )
-                # This will go through get_layers_info + threaded DSM/MASK downloads
-                # and write everything into the cache.
-                self.get_data(
-                    latitude=latitude,
-                    longitude=longitude,
-                    radius_meters=250,
-                    use_google_experimental=use_google_experimental,
-                    endpoint_identifiers=[
-                        GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM,
-                        GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK,
-                    ],
-                    max_retries=max_retries,
-                    min_retry_delay=min_retry_delay,
-                    ignore_cache=ignore_cache,
-                )
-                logger.info(
-                    "GoogleSolarApi: async shading prefetch finished (radius=250m) "
-                    f"for lat={latitude}, lon={longitude}"
-                )
-            except Exception as e:
-                # We don't want this to crash anything – just log and move on.
-                logger.warning(
-                    "GoogleSolarApi: async shading prefetch failed: %s", e,
-                    exc_info=True,
-                )
+            logger.info(
+                f"GoogleSolarApi: starting async shading prefetch (radius={radius_meters}m) "
+                f"for lat={latitude}, lon={longitude}"
+            )
+            # This will go through get_layers_info + threaded DSM/MASK downloads
+            # and write everything into the cache, the TIFFs are streamed to the cache files.
+            self.get_data(
+                latitude=latitude,
+                longitude=longitude,
+                radius_meters=radius_meters,
+                use_google_experimental=use_google_experimental,
+                endpoint_identifiers=[
+                    GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM,
+                    GoogleSolarApi.ENDPOINT_IDENTIFIER_MASK,
+                ],
+                max_retries=max_retries,
+                min_retry_delay=min_retry_delay,
+                ignore_cache=ignore_cache,
+                result_format=GoogleSolarApi.RESULT_FORMAT_PATH,
+            )
+            logger.info(
+                f"GoogleSolarApi: async shading prefetch finished (radius={radius_meters}m) "
+                f"for lat={latitude}, lon={longitude}"
+            )
+
+        def _is_satisfied():
+            return not ignore_cache and all(os.path.exists(self._get_cache_file_path(params)) for params in api_call_params.values())
 
-        thread_name = f"shading-prefetch-{latitude:.4f}-{longitude:.4f}"
-        t = threading.Thread(target=_worker, name=thread_name, daemon=True)
-        t.start()
+        return GoogleSolarApi._get_prefetch_scheduler().submit(
+            GoogleSolarApi._get_cache_key(api_call_params[GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM]),
+            _worker,
+            priority=priority,
+            is_satisfied=_is_satisfied,
+        )
 
+    @classmethod
+    def _get_prefetch_scheduler(cls) -> PrefetchScheduler:
+        return PrefetchScheduler.get(
+            cls.API_IDENTIFIER,
+            max_workers=cls.PREFETCH_MAX_WORKERS,
+            max_queue_size=cls.PREFETCH_MAX_QUEUE_SIZE,
+            max_age_seconds=cls.PREFETCH_MAX_AGE_SECONDS,
+        )
 
-    
\ No newline at end of file
+    @classmethod
+    def get_prefetch_stats(cls) -> dict:
+        """
+        Counters and queue depth of the shading prefetches (see PrefetchScheduler)
+        """
+        return cls._get_prefetch_scheduler().get_stats()
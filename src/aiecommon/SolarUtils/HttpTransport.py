@@ -0,0 +1,164 @@
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+
+class AbortHandle:
+    """
+    Aborts, from any thread, the requests made in the thread that uses it (HttpTransport.abortable), also while they
+    wait for the response: the socket is shut down, so the blocked request fails with a connection error at once
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def attach(self, connection):
+        with self._lock:
+            self._connection = connection
+            aborted = self.aborted
+        if aborted:
+            AbortHandle._shutdown(connection)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            connection = self._connection
+        if connection is not None:
+            AbortHandle._shutdown(connection)
+
+    @staticmethod
+    def _shutdown(connection):
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _AbortableConnection:
+    """
+    Connection attached to the AbortHandle of the thread (if there is one) when it sends a request
+    """
+
+    def request(self, *args, **kwargs):
+        abort_handle = getattr(HttpTransport._thread_state, "abort_handle", None)
+        if abort_handle is not None:
+            abort_handle.attach(self)
+        return super().request(*args, **kwargs)
+
+
+class _AbortableHTTPConnection(_AbortableConnection, HTTPConnection):
+    pass
+
+
+class _AbortableHTTPSConnection(_AbortableConnection, HTTPSConnection):
+    pass
+
+
+class _AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class _AbortableHTTPAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _AbortableHTTPConnectionPool, "https": _AbortableHTTPSConnectionPool}
+
+
+class HttpTransport:
+    """
+    Pooled HTTP transport: one requests.Session per host (scheme + host + port), kept alive and shared by all threads.
+
+    Connections are reused across calls and threads (up to pool_maxsize kept open per host), so repeated calls
+    to the same host skip the TCP and TLS handshakes. Sessions are not shared with forked child processes.
+
+    Requests can be aborted from another thread, also while waiting for the response, see abortable and AbortHandle.
+    """
+
+    __transports = {}
+    __transports_lock = threading.Lock()
+    # AbortHandle of the requests of the thread, see abortable
+    _thread_state = threading.local()
+
+    def __init__(self, pool_maxsize: int = 16, timeout: float | tuple | None = (10, 60)):
+        """
+        pool_maxsize - connections kept open per host, more concurrent requests open extra short-lived connections
+        timeout - default (connect, read) timeout in seconds
+        """
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+
+        self._sessions = {}
+        self._sessions_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_shared(cls, pool_maxsize: int = 16, timeout: float | tuple | None = (10, 60)):
+        """
+        Transport with the given settings, shared by all users in the process
+        """
+        key = (pool_maxsize, timeout)
+        with HttpTransport.__transports_lock:
+            if key not in HttpTransport.__transports:
+                HttpTransport.__transports[key] = cls(pool_maxsize, timeout)
+            return HttpTransport.__transports[key]
+
+    def get_session(self, url: str) -> requests.Session:
+        url_parts = urlsplit(url)
+        host = f"{url_parts.scheme}://{url_parts.netloc}"
+
+        with self._lock:
+            if self._sessions_pid != os.getpid():
+                # connections of the parent process must not be used by a forked child
+                self._sessions = {}
+                self._sessions_pid = os.getpid()
+
+            session = self._sessions.get(host)
+            if session is None:
+                logger.info(f"HttpTransport: new session, host={host}, pool_maxsize={self.pool_maxsize}")
+                session = requests.Session()
+                adapter = _AbortableHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount(f"{url_parts.scheme}://", adapter)
+                self._sessions[host] = session
+            return session
+
+    @staticmethod
+    @contextmanager
+    def abortable(abort_handle: AbortHandle):
+        """
+        Requests made by the thread within the context can be aborted by abort_handle.abort()
+        """
+        previous_abort_handle = getattr(HttpTransport._thread_state, "abort_handle", None)
+        HttpTransport._thread_state.abort_handle = abort_handle
+        try:
+            yield abort_handle
+        finally:
+            HttpTransport._thread_state.abort_handle = previous_abort_handle
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.get_session(url).request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
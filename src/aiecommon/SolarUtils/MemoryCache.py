@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU cache, bounded by number of entries and by total size in bytes.
+
+    Every entry is stored together with a signature of its source (e.g. mtime and size of the
+    cache file it was read from), get() only returns the entry if the signature still matches.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int | None = None):
+        """
+        max_entries - maximal number of entries kept in memory
+        max_bytes - maximal total size of the entries kept in memory, no limit if None or 0
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, signature):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_signature, data, size = entry
+            if entry_signature != signature:
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, signature, data, size: int):
+        with self._lock:
+            self._remove(key)
+
+            if self.max_bytes and size > self.max_bytes:
+                return
+
+            self._entries[key] = (signature, data, size)
+            self.total_bytes += size
+
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.total_bytes > self.max_bytes):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,178 @@
+import atexit
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Callable
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+
+class PrefetchScheduler:
+    """
+    Background prefetches run by a bounded pool of worker threads, in priority order (lower priority value first,
+    then in submission order).
+
+    - deduplicated by key: a prefetch with the key of a queued or running one is not queued again
+    - dropped when the queue is full, when it waited longer than max_age_seconds (stale), or when
+      is_satisfied() says it's not needed anymore (e.g. the data got cached meanwhile)
+    - queued prefetches are cancelled on shutdown (and at exit), workers don't survive fork
+
+    Counters (ApiMetrics of PrefetchScheduler/<name>): submitted, deduplicated, dropped, expired, satisfied,
+    completed, failed, cancelled. Histograms: queue_seconds, run_seconds.
+    """
+
+    __schedulers = {}
+    __schedulers_lock = threading.Lock()
+
+    def __init__(self, name: str, max_workers: int = 4, max_queue_size: int = 1000, max_age_seconds: float | None = 300):
+        """
+        max_workers - prefetches running at the same time
+        max_queue_size - queued prefetches, more are dropped
+        max_age_seconds - queued prefetches older than this are dropped instead of run, None to keep them
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_age_seconds = max_age_seconds
+        self.metrics = ApiMetrics.get("PrefetchScheduler", name)
+
+        self._sequence = itertools.count()
+        self._reset()
+
+    def _reset(self):
+        self._condition = threading.Condition()
+        # (priority, sequence, key) heap and key -> task of queued prefetches, keys of running prefetches
+        self._queue = []
+        self._tasks = {}
+        self._running = set()
+        self._workers = []
+        self._shutdown = False
+
+    @staticmethod
+    def _reset_after_fork():
+        # worker threads don't survive fork and the condition may be held by one of them,
+        # a child process starts with empty queues and its own workers
+        for scheduler in PrefetchScheduler.__schedulers.values():
+            scheduler._reset()
+        PrefetchScheduler.__schedulers_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str, max_workers: int = 4, max_queue_size: int = 1000, max_age_seconds: float | None = 300):
+        """
+        Scheduler with the given name, shared by all users in the process (settings of the first call are used)
+        """
+        with PrefetchScheduler.__schedulers_lock:
+            if name not in PrefetchScheduler.__schedulers:
+                PrefetchScheduler.__schedulers[name] = cls(name, max_workers, max_queue_size, max_age_seconds)
+            return PrefetchScheduler.__schedulers[name]
+
+    def submit(self, key: str, function: Callable, priority: int = 0, is_satisfied: Callable | None = None) -> bool:
+        """
+        Queue function() to run in the background, returns False if it was deduplicated or dropped
+        is_satisfied - checked before running, the prefetch is skipped if it returns True
+        """
+        with self._condition:
+            if self._shutdown:
+                logger.info(f"PrefetchScheduler/{self.name}: shut down, not queueing prefetch, key={key}")
+                self.metrics.increment("cancelled")
+                return False
+
+            if key in self._tasks or key in self._running:
+                self.metrics.increment("deduplicated")
+                return False
+
+            if len(self._tasks) >= self.max_queue_size:
+                logger.warning(f"PrefetchScheduler/{self.name}: queue is full, dropping prefetch, key={key}, max_queue_size={self.max_queue_size}")
+                self.metrics.increment("dropped")
+                return False
+
+            self._tasks[key] = (function, is_satisfied, time.monotonic())
+            heapq.heappush(self._queue, (priority, next(self._sequence), key))
+            self.metrics.increment("submitted")
+
+            if len(self._workers) < self.max_workers and len(self._workers) < len(self._tasks) + len(self._running):
+                self._start_worker()
+            self._condition.notify()
+            return True
+
+    def get_stats(self) -> dict:
+        with self._condition:
+            return {
+                **self.metrics.get_snapshot(),
+                "queue_depth": len(self._tasks),
+                "running": len(self._running),
+                "workers": len(self._workers),
+            }
+
+    def shutdown(self, wait: bool = False, timeout: float | None = None):
+        """
+        Cancel queued prefetches and stop the workers, running prefetches are finished (waited for if wait)
+        """
+        with self._condition:
+            self._shutdown = True
+            if self._tasks:
+                logger.info(f"PrefetchScheduler/{self.name}: shutting down, cancelling queued prefetches, queue_depth={len(self._tasks)}")
+                self.metrics.increment("cancelled", len(self._tasks))
+            self._queue = []
+            self._tasks = {}
+            workers = list(self._workers)
+            self._condition.notify_all()
+
+        if wait:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            for worker in workers:
+                worker.join(max(0, deadline - time.monotonic()) if deadline is not None else None)
+
+    def _start_worker(self):
+        if not self._workers:
+            atexit.register(self.shutdown)
+        worker = threading.Thread(target=self._work, name=f"{self.name}-prefetch-{len(self._workers)}", daemon=True)
+        self._workers.append(worker)
+        worker.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._shutdown:
+                    self._condition.wait()
+                if self._shutdown:
+                    return
+                _, _, key = heapq.heappop(self._queue)
+                function, is_satisfied, submitted_at = self._tasks.pop(key)
+                self._running.add(key)
+
+            try:
+                self._run(key, function, is_satisfied, submitted_at)
+            finally:
+                with self._condition:
+                    self._running.discard(key)
+
+    def _run(self, key: str, function: Callable, is_satisfied: Callable | None, submitted_at: float):
+        queue_seconds = time.monotonic() - submitted_at
+        self.metrics.observe("queue_seconds", queue_seconds)
+
+        if self.max_age_seconds is not None and queue_seconds > self.max_age_seconds:
+            logger.info(f"PrefetchScheduler/{self.name}: dropping stale prefetch, key={key}, queue_seconds={queue_seconds:.1f}")
+            self.metrics.increment("expired")
+            return
+
+        try:
+            if is_satisfied is not None and is_satisfied():
+                logger.info(f"PrefetchScheduler/{self.name}: prefetch already satisfied, key={key}")
+                self.metrics.increment("satisfied")
+                return
+
+            run_start = time.monotonic()
+            function()
+            self.metrics.observe("run_seconds", time.monotonic() - run_start)
+            self.metrics.increment("completed")
+        except Exception as e:
+            # a failed prefetch only means the data is fetched later, on demand
+            logger.warning(f"PrefetchScheduler/{self.name}: prefetch failed, key={key}, exception={e}", exc_info=True)
+            self.metrics.increment("failed")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=PrefetchScheduler._reset_after_fork)
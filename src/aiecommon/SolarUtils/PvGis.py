@@ -1,5 +1,11 @@
+import io
+import os
+import re
+import asyncio
+import pickle
 import pandas as pd
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pvlib import iotools
 import numpy as np
 
@@ -7,12 +13,26 @@ import aiecommon.custom_logger as custom_logger
 logger = custom_logger.get_logger()
 from aiecommon import SolarUtils
 from aiecommon.SolarUtils.ExternalApiBase import ExternalApiBase
+from aiecommon.SolarUtils.SpatialCacheIndex import SpatialCacheIndex
+from aiecommon.SolarUtils.ColumnarFrame import ColumnarFrame
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+from aiecommon.SolarUtils.TmyGridStore import TmyGridStore
+from aiecommon.FileSystem import LocalRuntimeFiles
+from aiecommon.Exceptions import AieException
 
 class PvGis(ExternalApiBase):
     
     STORAGE_FOLDER = 'pvgis'
     API_IDENTIFIER = 'PvGis'
     USE_PERMANENT_STORAGE = 'True'
+    # one TMY frame is ~0.6 MB, callers get their own copy unless they ask for the shared read-only frame (copy=False)
+    MEMORY_CACHE_MAX_ENTRIES = 128
+    MEMORY_CACHE_MAX_BYTES = 128 * 1024 * 1024
+    MEMORY_CACHE_COPY_ON_RETURN = True
+    # PVGIS allows 30 calls per second per IP address
+    RATE_LIMIT_PER_SECOND = 25
+    # base URL of the PVGIS API (e.g. a mirror or a local test server), can be set in AIENERGY_PVGIS_API_URL
+    API_URL = 'https://re.jrc.ec.europa.eu/api/v5_3/'
 
     PVGIS_START_YEAR = '2013'
     PVGIS_END_YEAR = '2023'
@@ -20,6 +40,27 @@ class PvGis(ExternalApiBase):
     TYPICAL_YEAR_END_DATE = '2018-12-31 23:00'
     TYPICAL_YEAR = int(TYPICAL_YEAR_START_DATE.split('-')[0])
     COORDINATES_DECIMAL_PLACES = 3
+    # cached TMY of the nearest location within this radius is used instead of calling the API, 0 - disabled
+    SPATIAL_LOOKUP_RADIUS_METERS = 0
+    SPATIAL_INDEX_FILE_NAME = '_spatial_index.jsonl'
+    _CACHE_FILE_NAME_PATTERN = re.compile(r"(\d+)_(\d+)_(-?\d+\.\d+)_(-?\d+\.\d+)")
+    # format of new cache files: pickled DataFrame, or ColumnarFrame (float32 columns, memory-mapped when read,
+    # only raw cache files - without CACHE_CODEC - are mapped), both formats are read
+    # existing cache files are converted by python -m aiecommon.SolarUtils.migrate_pvgis_cache
+    CACHE_FORMAT_PICKLE = "pickle"
+    CACHE_FORMAT_COLUMNAR = "columnar"
+    CACHE_FORMAT = CACHE_FORMAT_PICKLE
+    # get_solar_components_batch fetches at most this many uncached sites at the same time (RATE_LIMIT_PER_SECOND still applies)
+    BATCH_MAX_CONCURRENCY = 8
+    BATCH_OUTPUT_ARRAY = "array"
+    BATCH_OUTPUT_FRAME = "frame"
+    BATCH_OUTPUTS = [BATCH_OUTPUT_ARRAY, BATCH_OUTPUT_FRAME]
+    # uncached locations are interpolated from the TMY grid store of the country (TmyGridStore, built by build_tmy_grid
+    # or python -m aiecommon.SolarUtils.build_tmy_grid) if there are stored locations within TMY_GRID_MAX_DISTANCE_METERS
+    USE_TMY_GRID = False
+    TMY_GRID_MAX_DISTANCE_METERS = 5000
+    TMY_GRID_NEIGHBOURS = 4
+    TMY_GRID_STORAGE_FOLDER = 'pvgis_tmy_grid'
 
     def __init__(self,
         country_code : str,
@@ -27,14 +68,26 @@ class PvGis(ExternalApiBase):
         min_retry_delay : int = 2,
         min_result_size : int = 1024,
         ignore_cache : bool = False,
+        spatial_lookup_radius_meters : float | None = None,
+        use_tmy_grid : bool | None = None,
+        tmy_grid_max_distance_meters : float | None = None,
+        api_url : str | None = None,
     ):
         """
         max_retries - how many times to retry if the API call fails
         min_retry_delay - minimal delay between retries
         min_result_size - if the downloaded data is smaller, it won't count as successful download
         ignore_cache - whether to make the API call regardless of the existence of cache
+        spatial_lookup_radius_meters - use cached data of the nearest location within this radius (SPATIAL_LOOKUP_RADIUS_METERS by default)
+        use_tmy_grid - interpolate uncached locations from the TMY grid store of the country (USE_TMY_GRID by default)
+        tmy_grid_max_distance_meters - only stored locations within this distance are interpolated (TMY_GRID_MAX_DISTANCE_METERS by default)
+        api_url - base URL of the PVGIS API (AIENERGY_PVGIS_API_URL or API_URL by default)
         """
         self.country_code = country_code
+        self.spatial_lookup_radius_meters = spatial_lookup_radius_meters if spatial_lookup_radius_meters is not None else PvGis.SPATIAL_LOOKUP_RADIUS_METERS
+        self.use_tmy_grid = use_tmy_grid if use_tmy_grid is not None else PvGis.USE_TMY_GRID
+        self.tmy_grid_max_distance_meters = tmy_grid_max_distance_meters if tmy_grid_max_distance_meters is not None else PvGis.TMY_GRID_MAX_DISTANCE_METERS
+        self.api_url = api_url if api_url is not None else os.getenv("AIENERGY_PVGIS_API_URL", PvGis.API_URL)
         super().__init__(max_retries, min_retry_delay, min_result_size, ignore_cache)
 
 
@@ -43,12 +96,141 @@ class PvGis(ExternalApiBase):
         return f"{PvGis.PVGIS_START_YEAR}_{PvGis.PVGIS_END_YEAR}_{np.round(params['latitude'], PvGis.COORDINATES_DECIMAL_PLACES):.3f}_{np.round(params['longitude'], PvGis.COORDINATES_DECIMAL_PLACES):.3f}"
 
     @staticmethod
-    def _read_cache(cache_file_path: str, params: dict) -> pd.DataFrame:
-        return pd.read_pickle(cache_file_path)
+    def _deserialize_cache(payload: bytes, params: dict) -> pd.DataFrame:
+        if ColumnarFrame.is_columnar(payload):
+            return ColumnarFrame.deserialize(payload)
+        return pd.read_pickle(io.BytesIO(payload))
 
-    @staticmethod
-    def _write_cache(cache_file_path: str, data: pd.DataFrame, params: dict):
-        return data.to_pickle(cache_file_path)
+    @classmethod
+    def _serialize_cache(cls, data: pd.DataFrame, params: dict) -> bytes:
+        if cls.CACHE_FORMAT == PvGis.CACHE_FORMAT_COLUMNAR:
+            if ColumnarFrame.can_serialize(data):
+                return ColumnarFrame.serialize(data)
+            logger.warning(f"PvGis._serialize_cache: data can't be stored in columnar format, pickling it, params={params}")
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def _read_cache(cls, cache_file_path: str, params: dict):
+        # a raw columnar cache file (or the blob a deduplicated one points to) is memory-mapped instead of read
+        raw_file_path = cache_file_path if CacheStorage.is_raw(cache_file_path) else CacheStorage.get_referenced_blob_path(cache_file_path)
+        if raw_file_path is not None and CacheStorage.is_raw(raw_file_path) and ColumnarFrame.is_columnar_file(raw_file_path):
+            return ColumnarFrame.read(raw_file_path)
+        return super()._read_cache(cache_file_path, params)
+
+    @classmethod
+    def _save_cache(cls, params: dict, data):
+        result = super()._save_cache(params, data)
+        try:
+            cls._get_spatial_index().add(
+                np.round(params['latitude'], PvGis.COORDINATES_DECIMAL_PLACES),
+                np.round(params['longitude'], PvGis.COORDINATES_DECIMAL_PLACES),
+                cls._get_cache_key(params),
+                country_code=params.get('country_code'),
+            )
+        except OSError as e:
+            logger.warning(f"PvGis: cannot add cache entry to spatial index, params={params}, exception={e}")
+        return result
+
+    @classmethod
+    def _get_spatial_index(cls) -> SpatialCacheIndex:
+        index_file_path = LocalRuntimeFiles.get_file(os.path.join(cls.STORAGE_FOLDER, cls.SPATIAL_INDEX_FILE_NAME), usePermanentStorage=cls.USE_PERMANENT_STORAGE)
+        return SpatialCacheIndex.get(index_file_path, cls._get_spatial_index_build_entries)
+
+    @classmethod
+    def _get_spatial_index_build_entries(cls):
+        """
+        Index entries of the cache files written before the index existed, parsed from the file names
+        """
+        cache_directory = LocalRuntimeFiles.get_file(cls.STORAGE_FOLDER, usePermanentStorage=cls.USE_PERMANENT_STORAGE)
+        for file_name in os.listdir(cache_directory):
+            match = PvGis._CACHE_FILE_NAME_PATTERN.fullmatch(file_name)
+            if match and match.group(1) == PvGis.PVGIS_START_YEAR and match.group(2) == PvGis.PVGIS_END_YEAR:
+                yield {"latitude": float(match.group(3)), "longitude": float(match.group(4)), "key": file_name}
+
+    def _get_result_from_nearby_cache(self, params: dict, ignore_cache: bool, copy: bool | None = None):
+        """
+        Cached result of the nearest location within spatial_lookup_radius_meters, None if there is none
+        (or the exact location is cached, which call_api serves).
+        Entries indexed with a different country code are skipped, the cached frames are in the timezone of the country.
+        """
+        if ignore_cache or not self.spatial_lookup_radius_meters or os.path.exists(self._get_cache_file_path(params)):
+            return None
+
+        latitude = np.round(params['latitude'], PvGis.COORDINATES_DECIMAL_PLACES)
+        longitude = np.round(params['longitude'], PvGis.COORDINATES_DECIMAL_PLACES)
+        neighbours = self._get_spatial_index().find_within(
+            latitude, longitude, self.spatial_lookup_radius_meters,
+            lambda entry: entry.get("country_code") in (None, params['country_code']),
+        )
+        for distance, entry in neighbours:
+            neighbour_params = {**params, "latitude": entry["latitude"], "longitude": entry["longitude"]}
+            # the index may be older than the cache (e.g. entries evicted by CacheJanitor)
+            if not os.path.exists(self._get_cache_file_path(neighbour_params)):
+                continue
+            cached_result = self._get_result_from_cache(False, neighbour_params, copy=copy)
+            if cached_result is not None:
+                logger.info(f"PvGis: using cached data of a nearby location, distance_meters={distance:.0f}, params={params}, neighbour_params={neighbour_params}")
+                return cached_result
+
+        return None
+
+    def _get_result_from_tmy_grid(self, params: dict, ignore_cache: bool):
+        """
+        Data interpolated from the TMY grid store of the country, None if there is no store or no stored location
+        within tmy_grid_max_distance_meters (or the exact location is cached, which call_api serves).
+        """
+        if ignore_cache or not self.use_tmy_grid or os.path.exists(self._get_cache_file_path(params)):
+            return None
+
+        try:
+            store = TmyGridStore.get(self._get_tmy_grid_directory(params['country_code']))
+            if store is None:
+                return None
+            result = store.interpolate(params['latitude'], params['longitude'], self.tmy_grid_max_distance_meters, PvGis.TMY_GRID_NEIGHBOURS)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"PvGis: cannot use TMY grid store, params={params}, exception={e}")
+            return None
+
+        if result is not None:
+            logger.info(f"PvGis: using data interpolated from the TMY grid store, params={params}")
+            self._get_metrics(params).increment("grid_hits")
+        return result
+
+    @classmethod
+    def _get_tmy_grid_directory(cls, country_code: str) -> str:
+        return LocalRuntimeFiles.get_file(os.path.join(cls.TMY_GRID_STORAGE_FOLDER, str(country_code)), usePermanentStorage=cls.USE_PERMANENT_STORAGE)
+
+    @classmethod
+    def build_tmy_grid(cls, country_code: str, bounds: tuple | None = None) -> dict:
+        """
+        Build the TMY grid store of the country from the cached TMY data of its locations (see TmyGridStore).
+
+        bounds - (min_latitude, min_longitude, max_latitude, max_longitude) of the locations to store, all by default
+
+        Only cached frames in the timezone of the country are stored (entries indexed without country code are
+        checked by their timezone). Returns the stats of TmyGridStore.build.
+        """
+        tz = str(SolarUtils.get_timezone_from_country_code(country_code))
+
+        def get_locations():
+            entries = sorted(cls._get_spatial_index().get_entries(), key=lambda entry: entry["key"])
+            for entry in entries:
+                if entry.get("country_code") not in (None, country_code):
+                    continue
+                if bounds is not None and not (bounds[0] <= entry["latitude"] <= bounds[2] and bounds[1] <= entry["longitude"] <= bounds[3]):
+                    continue
+                params = {"latitude": entry["latitude"], "longitude": entry["longitude"], "country_code": country_code}
+                cache_file_path = cls._get_cache_file_path(params)
+                try:
+                    frame = cls._read_cache(cache_file_path, params)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"PvGis: cannot read cache file for the TMY grid store, cache_file_path={cache_file_path}, exception={e}")
+                    continue
+                if not cls._check_cache(frame, params) or str(frame.index.tz) != tz:
+                    continue
+                yield entry["latitude"], entry["longitude"], entry["key"], frame
+
+        return TmyGridStore.build(cls._get_tmy_grid_directory(country_code), get_locations(), {"country_code": country_code, "bounds": bounds})
 
     @staticmethod
     def _check_cache(cached_result, params: dict):
@@ -63,34 +245,143 @@ class PvGis(ExternalApiBase):
         longitude_truncated = np.round(longitude, PvGis.COORDINATES_DECIMAL_PLACES)
         tz = SolarUtils.get_timezone_from_country_code(country_code)
 
-        start = pd.Timestamp(PvGis.TYPICAL_YEAR_START_DATE)
-        end = pd.Timestamp(PvGis.TYPICAL_YEAR_END_DATE)
         logger.info(f"PvGis {retry_count}/{max_retries}: Fetching PVGIS TMY for ({latitude},{longitude}) -> ({latitude_truncated}, {longitude_truncated})")
         start_api = time.perf_counter()
         tmy_data = iotools.get_pvgis_tmy(
             latitude_truncated,
             longitude_truncated,
-            url='https://re.jrc.ec.europa.eu/api/v5_3/',
+            url=self.api_url,
             usehorizon=True,
             startyear=PvGis.PVGIS_START_YEAR,
             endyear=PvGis.PVGIS_END_YEAR,
-            coerce_year=PvGis.TYPICAL_YEAR
+            coerce_year=PvGis.TYPICAL_YEAR,
+            # pvlib uses its own requests.get, so there is no pooled session, only the timeouts
+            timeout=PvGis.HTTP_TIMEOUT_SECONDS,
         )
         elapsed_api = time.perf_counter() - start_api
         logger.info(f"PvGis {retry_count}/{max_retries}: PVGIS TMY fetch took {elapsed_api:.2f} seconds")
 
         df = tmy_data[0]
         delays = PvGis.get_tmy_minute_offsets(latitude, longitude, tmy_data[1])
-        df.index = df.index.tz_convert(tz)
-        full = pd.date_range(start=start, end=end, freq='h', tz=tz)
-        df = df.reindex(full)
-        df.index = df.index + pd.to_timedelta(delays, unit='min')
-        df = df.bfill().ffill().interpolate(method='nearest')
         logger.info(f"PvGis {retry_count}/{max_retries}: TMY data received; proceeding with geometry cache and production computation.")
-        final_data = df[~df.index.duplicated()]
+        final_data = PvGis.align_tmy(df.index, {column: df[column].to_numpy() for column in df.columns}, tz, delays)
 
         return final_data
 
+    @staticmethod
+    def align_tmy(timestamps, columns: dict, tz, minute_offsets) -> pd.DataFrame:
+        """
+        Hourly typical-year series in tz from the raw PVGIS TMY: its timestamps (tz-aware) and column arrays.
+
+        Every hour of the typical year (TYPICAL_YEAR_START_DATE - TYPICAL_YEAR_END_DATE in tz) takes the TMY row
+        of the same instant, hours without one (or with NaN) take the next value of the column, at the end of
+        the year the last one. The hours are shifted by minute_offsets (one per hour) and only the first of
+        duplicate timestamps is kept.
+
+        Same result as reindexing the TMY frame on the typical-year hours, shifting the index and
+        bfill().ffill().interpolate(method='nearest'), but every column is gathered once instead of
+        copying the frame at every step (see scripts/benchmark_tmy_alignment.py).
+        """
+        timestamps = pd.DatetimeIndex(timestamps).tz_convert(tz)
+        hours = pd.date_range(start=pd.Timestamp(PvGis.TYPICAL_YEAR_START_DATE), end=pd.Timestamp(PvGis.TYPICAL_YEAR_END_DATE), freq='h', tz=tz)
+        index = PvGis._shift_index(hours, minute_offsets)
+
+        # TMY row of every hour, -1 if there is none
+        tmy_instants = PvGis._get_instants_ns(timestamps)
+        hour_instants = PvGis._get_instants_ns(hours)
+        order = np.argsort(tmy_instants, kind='stable')
+        sorted_instants = tmy_instants[order]
+        if (np.diff(sorted_instants) == 0).any():
+            raise ValueError("PvGis.align_tmy: duplicate TMY timestamps")
+        if len(sorted_instants):
+            positions = np.minimum(np.searchsorted(sorted_instants, hour_instants), len(sorted_instants) - 1)
+            rows = np.where(sorted_instants[positions] == hour_instants, order[positions], -1)
+        else:
+            rows = np.full(len(hours), -1)
+
+        missing_rows = rows < 0
+        # hours without a TMY row, filled the same way in all columns without NaN
+        row_fill = PvGis._get_fill_positions(missing_rows) if missing_rows.any() else None
+        unique = PvGis._get_first_occurrences(index)
+        if unique is not None:
+            index = index[unique]
+
+        # every column is gathered once: TMY row of the hour, or of the hour it's filled from
+        aligned_columns = {}
+        for column, values in columns.items():
+            values = np.asarray(values)
+            if not len(values):
+                aligned_columns[column] = np.full(len(index), np.nan)
+                continue
+
+            fill = row_fill
+            if values.dtype.kind == 'f':
+                missing = np.isnan(values[rows]) | missing_rows
+                if missing.any():
+                    fill = PvGis._get_fill_positions(missing)
+
+            positions = rows if fill is None else rows[np.maximum(fill, 0)]
+            if unique is not None:
+                positions = positions[unique]
+            aligned = values[positions]
+
+            if fill is not None:
+                # like the NaN of reindex, integer columns become float
+                if aligned.dtype.kind != 'f':
+                    aligned = aligned.astype(np.float64)
+                unfilled = (fill < 0) if unique is None else (fill[unique] < 0)
+                if unfilled.any():
+                    aligned[unfilled] = np.nan
+            aligned_columns[column] = aligned
+
+        return pd.DataFrame(aligned_columns, index=index, columns=list(columns), copy=False)
+
+    @staticmethod
+    def _shift_index(hours: pd.DatetimeIndex, minute_offsets) -> pd.DatetimeIndex:
+        """
+        hours + pd.to_timedelta(minute_offsets, unit='min'), computed on the int64 instants if the offsets are whole minutes
+        """
+        minute_offsets = np.asarray(minute_offsets)
+        if len(minute_offsets) != len(hours) or not len(hours) or not (minute_offsets == np.round(minute_offsets)).all():
+            return hours + pd.to_timedelta(minute_offsets, unit='min')
+
+        # the unit pandas gives the shifted index
+        unit = (hours[:1] + pd.to_timedelta(minute_offsets[:1], unit='min')).unit
+        instants = PvGis._get_instants_ns(hours) + minute_offsets.astype(np.int64) * 60_000_000_000
+        index = pd.DatetimeIndex(instants.view("M8[ns]")).tz_localize("UTC").tz_convert(hours.tz)
+        return index if unit == "ns" else index.as_unit(unit)
+
+    @staticmethod
+    def _get_first_occurrences(index: pd.DatetimeIndex) -> np.ndarray | None:
+        """
+        ~index.duplicated(), None if there are no duplicates
+        """
+        instants = index.asi8
+        if (np.diff(instants) > 0).all():
+            return None
+        _, first_positions = np.unique(instants, return_index=True)
+        if len(first_positions) == len(instants):
+            return None
+        unique = np.zeros(len(instants), dtype=bool)
+        unique[first_positions] = True
+        return unique
+
+    @staticmethod
+    def _get_instants_ns(timestamps: pd.DatetimeIndex) -> np.ndarray:
+        # int64 nanoseconds since epoch (UTC), whatever the unit of the index
+        return timestamps.asi8.view(f"M8[{timestamps.unit}]").astype("M8[ns]").view(np.int64)
+
+    @staticmethod
+    def _get_fill_positions(missing: np.ndarray) -> np.ndarray:
+        """
+        Position of the value to use for every position: itself, else the next one that isn't missing, else the last
+        one that isn't missing (bfill then ffill), -1 if all are missing
+        """
+        positions = np.arange(len(missing))
+        next_valid = np.minimum.accumulate(np.where(missing, len(missing), positions)[::-1])[::-1]
+        previous_valid = np.maximum.accumulate(np.where(missing, -1, positions))
+        return np.where(next_valid < len(missing), next_valid, previous_valid)
+
     def get_solar_components(
         self,
         latitude, longitude,
@@ -99,6 +390,7 @@ class PvGis(ExternalApiBase):
         min_retry_delay : int | None = None,
         min_result_size : int | None = None,
         ignore_cache : bool | None = None,
+        copy : bool | None = None,
     ) -> pd.DataFrame | None:
         """
         Retrieve PVGIS TMY data for the given coordinates and date range,
@@ -106,10 +398,32 @@ class PvGis(ExternalApiBase):
         in the target timezone.
 
         Logs the duration of the external API fetch before proceeding.
+
+        If the location is not cached, data interpolated from the TMY grid store is returned if use_tmy_grid
+        is set, else (if spatial lookup is enabled) cached data of the nearest location within
+        spatial_lookup_radius_meters.
+
+        copy - False returns cached data without copying it, the frame is shared with other callers and read-only
+               (MEMORY_CACHE_COPY_ON_RETURN by default)
         """
 
         country_code = country_code if country_code is not None else self.country_code
 
+        grid_result = self._get_result_from_tmy_grid(
+            {"latitude": latitude, "longitude": longitude, "country_code": country_code},
+            ignore_cache if ignore_cache is not None else self.ignore_cache,
+        )
+        if grid_result is not None:
+            return grid_result
+
+        nearby_result = self._get_result_from_nearby_cache(
+            {"latitude": latitude, "longitude": longitude, "country_code": country_code},
+            ignore_cache if ignore_cache is not None else self.ignore_cache,
+            copy,
+        )
+        if nearby_result is not None:
+            return nearby_result
+
         return self.call_api(
             api_call_function=self._fetch,
             api_call_params={
@@ -122,8 +436,194 @@ class PvGis(ExternalApiBase):
             min_retry_delay=min_retry_delay,
             min_result_size=min_result_size,
             ignore_cache=ignore_cache,
+            copy=copy,
+        )
+
+    async def get_solar_components_async(
+        self,
+        latitude, longitude,
+        country_code : str | None = None,
+        max_retries : int | None = None,
+        min_retry_delay : int | None = None,
+        min_result_size : int | None = None,
+        ignore_cache : bool | None = None,
+        copy : bool | None = None,
+    ) -> pd.DataFrame | None:
+        """
+        Async version of get_solar_components, shares the cache with get_solar_components.
+
+        The PVGIS request itself (pvlib) runs in a worker thread.
+        """
+
+        country_code = country_code if country_code is not None else self.country_code
+
+        grid_result = await asyncio.to_thread(
+            self._get_result_from_tmy_grid,
+            {"latitude": latitude, "longitude": longitude, "country_code": country_code},
+            ignore_cache if ignore_cache is not None else self.ignore_cache,
+        )
+        if grid_result is not None:
+            return grid_result
+
+        nearby_result = await asyncio.to_thread(
+            self._get_result_from_nearby_cache,
+            {"latitude": latitude, "longitude": longitude, "country_code": country_code},
+            ignore_cache if ignore_cache is not None else self.ignore_cache,
+            copy,
+        )
+        if nearby_result is not None:
+            return nearby_result
+
+        return await self.call_api_async(
+            api_call_function=self._fetch,
+            api_call_params={
+                "latitude": latitude,
+                "longitude": longitude,
+                "country_code": country_code,
+            },
+            get_result_size_function=lambda result_data, params: result_data.size,
+            max_retries=max_retries,
+            min_retry_delay=min_retry_delay,
+            min_result_size=min_result_size,
+            ignore_cache=ignore_cache,
+            copy=copy,
         )
 
+    def get_solar_components_batch(
+        self,
+        latitudes, longitudes,
+        country_codes = None,
+        output : str = BATCH_OUTPUT_ARRAY,
+        components : list | None = None,
+        max_concurrency : int | None = None,
+        max_retries : int | None = None,
+        min_retry_delay : int | None = None,
+        min_result_size : int | None = None,
+        ignore_cache : bool | None = None,
+    ) -> dict:
+        """
+        get_solar_components for many sites at once, e.g. for portfolio studies.
+
+        latitudes, longitudes - one value per site
+        country_codes - one per site, a single one for all sites, or None for self.country_code
+        output - "array": data is a float array (sites x hours x components), row h of a site is hour h of its
+                 typical year (in the timezone of the site), sites that failed are NaN
+                 "frame": data is a DataFrame with a (site, time) MultiIndex and only the sites that succeeded,
+                 time is in UTC if the sites are in different timezones
+        components - columns to return, all columns of the first site that succeeded by default
+        max_concurrency - uncached sites fetched at the same time (BATCH_MAX_CONCURRENCY by default)
+
+        Sites with the same cache key are loaded or fetched once. Cache hits (also of the TMY grid and nearby locations) are
+        resolved first, then the misses are fetched concurrently. A failing site doesn't fail the batch,
+        it's reported in errors: site -> {"code", "message"}.
+
+        Returns dict with data, components, errors and stats (sites, unique sites, unique sites that were hits
+        and that were fetched, failed sites).
+        """
+
+        if output not in PvGis.BATCH_OUTPUTS:
+            raise AieException(AieException.INVALID_INPUT_DATA, f"PvGis: invalid batch output, output={output}, valid outputs={PvGis.BATCH_OUTPUTS}")
+
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        if country_codes is None or isinstance(country_codes, str):
+            country_codes = [country_codes if country_codes is not None else self.country_code] * len(latitudes)
+        country_codes = list(country_codes)
+        if not (len(latitudes) == len(longitudes) == len(country_codes)):
+            raise AieException(AieException.INVALID_INPUT_DATA, f"PvGis: batch arguments differ in length, latitudes={len(latitudes)}, longitudes={len(longitudes)}, country_codes={len(country_codes)}")
+
+        ignore_cache = ignore_cache if ignore_cache is not None else self.ignore_cache
+        max_concurrency = max_concurrency if max_concurrency is not None else PvGis.BATCH_MAX_CONCURRENCY
+
+        # cache file path -> (params, sites)
+        unique_sites = {}
+        for site, (latitude, longitude, country_code) in enumerate(zip(latitudes, longitudes, country_codes)):
+            params = {"latitude": float(latitude), "longitude": float(longitude), "country_code": country_code}
+            cache_file_path = self._get_cache_file_path(params)
+            if cache_file_path not in unique_sites:
+                unique_sites[cache_file_path] = (params, [])
+            unique_sites[cache_file_path][1].append(site)
+
+        results = {}
+        errors = {}
+        stats = {"sites": len(latitudes), "unique": len(unique_sites), "hits": 0, "fetched": 0, "failed": 0}
+
+        misses = []
+        for cache_file_path, (params, sites) in unique_sites.items():
+            # misses are counted by get_solar_components when they are fetched
+            # cached frames are not copied, their values are copied into data
+            cached_result = self._get_result_from_cache(ignore_cache, params, record_metrics=False, copy=False)
+            if cached_result is not None:
+                self._get_metrics(params).increment("hits")
+            else:
+                cached_result = self._get_result_from_tmy_grid(params, ignore_cache)
+            if cached_result is None:
+                cached_result = self._get_result_from_nearby_cache(params, ignore_cache, copy=False)
+            if cached_result is not None:
+                results[cache_file_path] = cached_result
+                stats["hits"] += 1
+            else:
+                misses.append(cache_file_path)
+
+        logger.info(f"PvGis: batch of {stats['sites']} sites, unique={stats['unique']}, hits={stats['hits']}, fetching misses={len(misses)}, max_concurrency={max_concurrency}")
+
+        def fetch(params):
+            return self.get_solar_components(
+                params["latitude"], params["longitude"], params["country_code"],
+                max_retries=max_retries, min_retry_delay=min_retry_delay, min_result_size=min_result_size, ignore_cache=ignore_cache, copy=False,
+            )
+
+        if misses:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(misses))), thread_name_prefix="pvgis-batch") as executor:
+                futures = {cache_file_path: executor.submit(fetch, unique_sites[cache_file_path][0]) for cache_file_path in misses}
+                for cache_file_path, future in futures.items():
+                    try:
+                        results[cache_file_path] = future.result()
+                        stats["fetched"] += 1
+                    except Exception as e:
+                        logger.warning(f"PvGis: batch site failed, params={unique_sites[cache_file_path][0]}, exception={e}")
+                        for site in unique_sites[cache_file_path][1]:
+                            errors[site] = {"code": e.code if isinstance(e, AieException) else AieException.GENERIC_PYTHON_ERROR, "message": str(e)}
+
+        frames = {}
+        for cache_file_path, (params, sites) in unique_sites.items():
+            result = results.get(cache_file_path)
+            if result is None:
+                continue
+            if components is None:
+                components = list(result.columns)
+            missing_components = [component for component in components if component not in result.columns]
+            if missing_components:
+                for site in sites:
+                    errors[site] = {"code": AieException.INVALID_INPUT_DATA, "message": f"PvGis: missing components {missing_components}"}
+                continue
+            for site in sites:
+                frames[site] = result
+
+        components = components if components is not None else []
+
+        if output == PvGis.BATCH_OUTPUT_ARRAY:
+            rows = max((len(frame) for frame in frames.values()), default=0)
+            data = np.full((stats["sites"], rows, len(components)), np.nan)
+            for site, frame in frames.items():
+                if len(frame) != rows:
+                    errors[site] = {"code": AieException.INVALID_INPUT_DATA, "message": f"PvGis: unexpected number of hours, hours={len(frame)}, expected={rows}"}
+                    continue
+                data[site] = frame[components].to_numpy(dtype=np.float64)
+        else:
+            sites = sorted(frames)
+            site_frames = [frames[site][components] for site in sites]
+            if len({str(frame.index.tz) for frame in site_frames}) > 1:
+                site_frames = [frame.tz_convert("UTC") for frame in site_frames]
+            data = pd.concat(site_frames, keys=sites, names=["site", "time"]) if site_frames else pd.DataFrame(columns=components)
+
+        stats["failed"] = len(errors)
+        return {
+            "data": data,
+            "components": components,
+            "errors": dict(sorted(errors.items())),
+            "stats": stats,
+        }
 
     @staticmethod
     def get_tmy_minute_offsets(latitude, longitude, month_year_dict):
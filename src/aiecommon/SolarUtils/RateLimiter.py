@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.FileSystem import LocalRuntimeFiles, FileLock
+
+class RateLimiter:
+    """
+    Token bucket shared by all processes on the machine, one per name (e.g. ExternalApiBase.API_IDENTIFIER)
+
+    The bucket (tokens, updated_at) is kept in a small state file in the runtime files, guarded by a FileLock.
+    It refills at rate_per_second up to burst tokens. Every call takes a token, if there is none the token
+    is reserved ahead of time and the caller waits until it is available (instead of getting a 429 and retrying).
+    If the wait would be longer than max_wait_seconds (e.g. many processes share a low rate), no token is taken
+    and the caller is told so, to back off (see ExternalApiBase) instead of blocking.
+    """
+
+    STATE_FOLDER = "rate_limiter"
+    MAX_WAIT_SECONDS = 30
+
+    __rate_limiters = {}
+    __rate_limiters_lock = threading.Lock()
+
+    def __init__(self, name: str, rate_per_second: float, burst: float | None = None, state_file_path: str | None = None, max_wait_seconds: float | None = None):
+        """
+        rate_per_second - sustained rate of calls
+        burst - maximal number of calls without waiting, max(1, rate_per_second) by default
+        state_file_path - file holding the bucket, in the runtime files by default
+        max_wait_seconds - longest wait for a token, MAX_WAIT_SECONDS by default
+        """
+        self.name = name
+        self.rate_per_second = rate_per_second
+        self.burst = burst if burst is not None else max(1.0, rate_per_second)
+        self.max_wait_seconds = max_wait_seconds if max_wait_seconds is not None else RateLimiter.MAX_WAIT_SECONDS
+        self.state_file_path = state_file_path if state_file_path is not None else LocalRuntimeFiles.get_file(os.path.join(RateLimiter.STATE_FOLDER, f"{name}.json"))
+
+        self.acquired_count = 0
+        self.waited_count = 0
+        self.waited_seconds = 0.0
+        self.rejected_count = 0
+        self._stats_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.state_file_path), exist_ok=True)
+
+    @classmethod
+    def get(cls, name: str, rate_per_second: float, burst: float | None = None, max_wait_seconds: float | None = None):
+        """
+        Rate limiter for the given name, created with the given settings on first use
+        """
+        with RateLimiter.__rate_limiters_lock:
+            if name not in RateLimiter.__rate_limiters:
+                RateLimiter.__rate_limiters[name] = cls(name, rate_per_second, burst, max_wait_seconds=max_wait_seconds)
+            return RateLimiter.__rate_limiters[name]
+
+    @staticmethod
+    def parse(spec: str):
+        """
+        Parse "RATE[:BURST]", e.g. "10" or "0.5:3", returns (rate_per_second, burst), burst is None if not given
+        """
+        rate_spec, _, burst_spec = spec.partition(":")
+        try:
+            return float(rate_spec), float(burst_spec) if burst_spec.strip() else None
+        except ValueError:
+            raise ValueError(f"RateLimiter: invalid rate limit specification {spec}, expected RATE[:BURST]")
+
+    def reserve(self) -> float | None:
+        """
+        Take a token, returns how many seconds to wait before making the call (0 if a token was available),
+        None if the wait would be longer than max_wait_seconds, then no token is taken
+        """
+        with FileLock.for_file(self.state_file_path):
+            tokens, updated_at = self._read_state()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate_per_second) - 1
+            wait_seconds = -tokens / self.rate_per_second if tokens < 0 else 0.0
+            if wait_seconds > self.max_wait_seconds:
+                with self._stats_lock:
+                    self.rejected_count += 1
+                logger.warning(f"RateLimiter/{self.name}: rate limit reached, wait of {wait_seconds:.3f} seconds exceeds max_wait_seconds={self.max_wait_seconds}, not taking a token")
+                return None
+            self._write_state(tokens, now)
+
+        with self._stats_lock:
+            self.acquired_count += 1
+            if wait_seconds > 0:
+                self.waited_count += 1
+                self.waited_seconds += wait_seconds
+
+        if wait_seconds > 0:
+            logger.info(f"RateLimiter/{self.name}: rate limit reached, waiting {wait_seconds:.3f} seconds, rate_per_second={self.rate_per_second}, burst={self.burst}")
+        return wait_seconds
+
+    def acquire(self) -> bool:
+        """
+        Take a token, waiting until it is available, False if the wait would be longer than max_wait_seconds
+        """
+        wait_seconds = self.reserve()
+        if wait_seconds is None:
+            return False
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+        return True
+
+    def _read_state(self):
+        try:
+            with open(self.state_file_path) as file:
+                state = json.load(file)
+            return float(state["tokens"]), float(state["updated_at"])
+        except FileNotFoundError:
+            return self.burst, time.time()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"RateLimiter/{self.name}: invalid state file, resetting, state_file_path={self.state_file_path}, exception={e}")
+            return self.burst, time.time()
+
+    def _write_state(self, tokens: float, updated_at: float):
+        # written in place, readers hold the same lock
+        with open(self.state_file_path, "w") as file:
+            json.dump({"tokens": tokens, "updated_at": updated_at}, file)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "rate_per_second": self.rate_per_second,
+                "burst": self.burst,
+                "acquired_count": self.acquired_count,
+                "waited_count": self.waited_count,
+                "waited_seconds": self.waited_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "rejected_count": self.rejected_count,
+            }
@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import deque
+
+class RetryBudget:
+    """
+    Process-wide retry budget, one per name (e.g. ExternalApiBase.API_IDENTIFIER)
+
+    Within a sliding window of window_seconds, retries are allowed while
+    retries < retry_ratio * first attempts + min_retries.
+    min_retries keeps retries possible when there is little traffic.
+    """
+
+    __retry_budgets = {}
+    __retry_budgets_lock = threading.Lock()
+
+    def __init__(self, name: str, retry_ratio: float = 0.2, min_retries: int = 3, window_seconds: float = 10):
+        self.name = name
+        self.retry_ratio = retry_ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self.rejected_count = 0
+
+        self._attempts = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str, retry_ratio: float = 0.2, min_retries: int = 3, window_seconds: float = 10):
+        """
+        Retry budget for the given name, created with the given settings on first use
+        """
+        with RetryBudget.__retry_budgets_lock:
+            if name not in RetryBudget.__retry_budgets:
+                RetryBudget.__retry_budgets[name] = cls(name, retry_ratio, min_retries, window_seconds)
+            return RetryBudget.__retry_budgets[name]
+
+    def record_attempt(self):
+        """
+        Record a first attempt (not a retry)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._attempts.append(now)
+
+    def try_acquire_retry(self) -> bool:
+        """
+        Returns True and records the retry if the budget allows it
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            if len(self._retries) >= self.retry_ratio * len(self._attempts) + self.min_retries:
+                self.rejected_count += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def _prune(self, now: float):
+        window_start = now - self.window_seconds
+        for timestamps in (self._attempts, self._retries):
+            while timestamps and timestamps[0] < window_start:
+                timestamps.popleft()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {
+                "attempts": len(self._attempts),
+                "retries": len(self._retries),
+                "rejected_count": self.rejected_count,
+            }
@@ -0,0 +1,170 @@
+import json
+import math
+import os
+import threading
+from typing import Callable
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.FileSystem import FileLock
+
+class SpatialCacheIndex:
+    """
+    Index of cache entries by location, for nearest-neighbour lookups of cached data.
+
+    The index is kept on disk as an append-only JSON lines file (one entry per line, with at least
+    latitude, longitude and key), shared by all processes. It is loaded lazily on first use, later
+    lookups only read the lines appended since (e.g. by other processes). If the index file doesn't
+    exist, it is built once from build_entries (e.g. by parsing the names of existing cache files).
+
+    In memory, entries are bucketed in a grid of CELL_SIZE_DEGREES cells, an entry with the same key
+    replaces the previous one.
+    """
+
+    CELL_SIZE_DEGREES = 0.01
+    EARTH_RADIUS_METERS = 6371008.8
+    METERS_PER_DEGREE_LATITUDE = 111320
+
+    __indexes = {}
+    __indexes_lock = threading.Lock()
+
+    def __init__(self, index_file_path: str, build_entries: Callable | None = None):
+        """
+        index_file_path - JSON lines file holding the index
+        build_entries - returns the entries (dicts) to build the index from if the index file doesn't exist
+        """
+        self.index_file_path = index_file_path
+        self._build_entries = build_entries
+        self._cells = {}
+        self._offset = None
+        self._inode = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, index_file_path: str, build_entries: Callable | None = None):
+        """
+        Index for index_file_path, shared by all users in the process
+        """
+        with SpatialCacheIndex.__indexes_lock:
+            if index_file_path not in SpatialCacheIndex.__indexes:
+                SpatialCacheIndex.__indexes[index_file_path] = cls(index_file_path, build_entries)
+            return SpatialCacheIndex.__indexes[index_file_path]
+
+    @staticmethod
+    def distance_meters(latitude1, longitude1, latitude2, longitude2) -> float:
+        """
+        Great-circle (haversine) distance
+        """
+        latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+        a = math.sin((latitude2 - latitude1) / 2)**2 + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2)**2
+        return 2 * SpatialCacheIndex.EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+    def add(self, latitude: float, longitude: float, key: str, **attributes):
+        """
+        Add an entry, attributes are stored with it and returned by lookups
+        """
+        entry = {"latitude": float(latitude), "longitude": float(longitude), "key": key, **attributes}
+        line = (json.dumps(entry) + "\n").encode()
+
+        with self._lock:
+            self._ensure_built()
+            # a single write with O_APPEND, so lines from concurrent processes don't interleave
+            file_descriptor = os.open(self.index_file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(file_descriptor, line)
+            finally:
+                os.close(file_descriptor)
+            if self._offset is not None:
+                self._add_to_cells(entry)
+
+    def find_within(self, latitude: float, longitude: float, max_distance_meters: float, entry_filter: Callable | None = None) -> list:
+        """
+        Entries within max_distance_meters, as (distance_meters, entry) sorted by distance
+        """
+        with self._lock:
+            self._refresh()
+
+            latitude_cells = math.ceil(max_distance_meters / SpatialCacheIndex.METERS_PER_DEGREE_LATITUDE / SpatialCacheIndex.CELL_SIZE_DEGREES)
+            meters_per_degree_longitude = SpatialCacheIndex.METERS_PER_DEGREE_LATITUDE * max(math.cos(math.radians(latitude)), 0.01)
+            longitude_cells = math.ceil(max_distance_meters / meters_per_degree_longitude / SpatialCacheIndex.CELL_SIZE_DEGREES)
+            latitude_cell, longitude_cell = SpatialCacheIndex._get_cell(latitude, longitude)
+
+            found = []
+            for cell_latitude in range(latitude_cell - latitude_cells, latitude_cell + latitude_cells + 1):
+                for cell_longitude in range(longitude_cell - longitude_cells, longitude_cell + longitude_cells + 1):
+                    for entry in self._cells.get((cell_latitude, cell_longitude), {}).values():
+                        if entry_filter is not None and not entry_filter(entry):
+                            continue
+                        distance = SpatialCacheIndex.distance_meters(latitude, longitude, entry["latitude"], entry["longitude"])
+                        if distance <= max_distance_meters:
+                            found.append((distance, entry))
+
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def find_nearest(self, latitude: float, longitude: float, max_distance_meters: float, entry_filter: Callable | None = None):
+        """
+        Nearest entry within max_distance_meters as (distance_meters, entry), None if there is none
+        """
+        found = self.find_within(latitude, longitude, max_distance_meters, entry_filter)
+        return found[0] if found else None
+
+    def get_entries(self) -> list:
+        with self._lock:
+            self._refresh()
+            return [entry for cell in self._cells.values() for entry in cell.values()]
+
+    @staticmethod
+    def _get_cell(latitude, longitude):
+        return (math.floor(latitude / SpatialCacheIndex.CELL_SIZE_DEGREES), math.floor(longitude / SpatialCacheIndex.CELL_SIZE_DEGREES))
+
+    def _add_to_cells(self, entry: dict):
+        self._cells.setdefault(SpatialCacheIndex._get_cell(entry["latitude"], entry["longitude"]), {})[entry["key"]] = entry
+
+    def _ensure_built(self):
+        if os.path.exists(self.index_file_path):
+            return
+
+        with FileLock.for_file(self.index_file_path):
+            if os.path.exists(self.index_file_path):
+                return
+
+            entries = list(self._build_entries()) if self._build_entries is not None else []
+            logger.info(f"SpatialCacheIndex: building index, index_file_path={self.index_file_path}, entries={len(entries)}")
+
+            os.makedirs(os.path.dirname(self.index_file_path), exist_ok=True)
+            temp_index_file_path = f"{self.index_file_path}.{os.getpid()}.tmp"
+            with open(temp_index_file_path, "w") as file:
+                for entry in entries:
+                    file.write(json.dumps(entry) + "\n")
+            os.replace(temp_index_file_path, self.index_file_path)
+
+    def _refresh(self):
+        self._ensure_built()
+
+        try:
+            index_file_stat = os.stat(self.index_file_path)
+        except FileNotFoundError:
+            return
+        index_file_size = index_file_stat.st_size
+
+        if self._offset is None or index_file_stat.st_ino != self._inode or index_file_size < self._offset:
+            # first use, or the index file was replaced
+            self._cells = {}
+            self._offset = 0
+            self._inode = index_file_stat.st_ino
+
+        if index_file_size == self._offset:
+            return
+
+        with open(self.index_file_path, "rb") as file:
+            file.seek(self._offset)
+            data = file.read(index_file_size - self._offset)
+
+        # a line still being written by another process is read next time
+        complete_length = data.rfind(b"\n") + 1
+        for line in data[:complete_length].splitlines():
+            try:
+                self._add_to_cells(json.loads(line))
+            except (ValueError, KeyError) as e:
+                logger.warning(f"SpatialCacheIndex: skipping invalid index line, index_file_path={self.index_file_path}, exception={e}")
+        self._offset += complete_length
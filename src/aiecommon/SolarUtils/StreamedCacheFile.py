@@ -0,0 +1,65 @@
+import os
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+
+class StreamedCacheFile:
+    """
+    Api call result streamed chunk by chunk to a temporary file next to its cache file, instead of being held in memory.
+
+    ExternalApiBase renames it into place when the result is saved to the cache (commit), or removes it
+    if the result is rejected (discard), e.g. because it's smaller than min_result_size.
+    """
+
+    def __init__(self, cache_file_path: str):
+        self.cache_file_path = cache_file_path
+        self.path = CacheStorage.get_temp_file_path(cache_file_path)
+        self.size = 0
+        self.committed = False
+
+        os.makedirs(os.path.dirname(cache_file_path), exist_ok=True)
+        self._file = open(self.path, "wb")
+
+    def __repr__(self):
+        return f"StreamedCacheFile(path={self.path}, size={self.size}, committed={self.committed})"
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception is not None:
+            self.discard()
+        else:
+            self.close()
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def read_bytes(self) -> bytes:
+        self.close()
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def commit(self):
+        """
+        Atomically replace the cache file with the streamed file
+        """
+        self.close()
+        os.replace(self.path, self.cache_file_path)
+        self.path = self.cache_file_path
+        self.committed = True
+
+    def discard(self):
+        self.close()
+        if self.committed:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,234 @@
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Iterable
+import numpy as np
+import pandas as pd
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.FileSystem import FileLock
+from aiecommon.SolarUtils.SpatialCacheIndex import SpatialCacheIndex
+
+class TmyGridStore:
+    """
+    Read-only store of TMY series of many locations of a region, for answering new locations offline by
+    inverse distance weighting (IDW) of the nearest stored locations.
+
+    A store is a directory with
+    - a values file: float32 .npy array of shape (locations, hours, components), memory-mapped when loaded,
+      only the slices of the neighbours of a query are read from disk
+    - META_FILE_NAME: locations (latitude, longitude, key), components, the time axis (start, step, unit, timezone)
+      and the name of the values file
+
+    A rebuild writes a new values file and then replaces the meta file, so a store can be rebuilt while it's used.
+    """
+
+    META_FILE_NAME = "meta.json"
+    DTYPE = np.dtype("<f4")
+    # neighbours closer than this are used as they are
+    EXACT_DISTANCE_METERS = 1.0
+    IDW_POWER = 2
+    # directions in degrees, interpolated as unit vectors
+    CIRCULAR_COMPONENTS = ["wind_direction", "WD10m"]
+
+    __stores = {}
+    __stores_lock = threading.Lock()
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.meta_file_path = os.path.join(directory, TmyGridStore.META_FILE_NAME)
+
+        with open(self.meta_file_path) as file:
+            self.meta = json.load(file)
+        self.meta_signature = TmyGridStore._get_signature(self.meta_file_path)
+
+        self.values = np.load(os.path.join(directory, self.meta["values_file"]), mmap_mode="r")
+        self.latitudes = np.array([location["latitude"] for location in self.meta["locations"]], dtype=np.float64)
+        self.longitudes = np.array([location["longitude"] for location in self.meta["locations"]], dtype=np.float64)
+        self.components = self.meta["components"]
+        self.index = TmyGridStore._build_index(self.meta["index"])
+
+    def __repr__(self):
+        return f"TmyGridStore(directory={self.directory}, locations={len(self.latitudes)}, components={len(self.components)})"
+
+    @classmethod
+    def get(cls, directory: str):
+        """
+        Store in directory, shared by all users in the process and reloaded when it's rebuilt, None if there is no store
+        """
+        meta_file_path = os.path.join(directory, TmyGridStore.META_FILE_NAME)
+        meta_signature = TmyGridStore._get_signature(meta_file_path)
+
+        with TmyGridStore.__stores_lock:
+            store = TmyGridStore.__stores.get(directory)
+            if meta_signature is None:
+                TmyGridStore.__stores.pop(directory, None)
+                return None
+            if store is None or store.meta_signature != meta_signature:
+                store = cls(directory)
+                TmyGridStore.__stores[directory] = store
+            return store
+
+    def interpolate(self, latitude: float, longitude: float, max_distance_meters: float, neighbours: int = 4) -> pd.DataFrame | None:
+        """
+        IDW of the (at most) neighbours nearest locations within max_distance_meters, None if there is none
+        """
+        distances = TmyGridStore.distance_meters(latitude, longitude, self.latitudes, self.longitudes)
+        within = np.flatnonzero(distances <= max_distance_meters)
+        if not len(within):
+            return None
+
+        nearest = within[np.argsort(distances[within], kind="stable")[:neighbours]]
+        if distances[nearest[0]] < TmyGridStore.EXACT_DISTANCE_METERS:
+            nearest = nearest[:1]
+            weights = np.ones(1)
+        else:
+            weights = 1 / distances[nearest]**TmyGridStore.IDW_POWER
+            weights /= weights.sum()
+
+        # sorted, so the memory map is read in file order
+        order = np.argsort(nearest)
+        neighbour_values = self.values[nearest[order]].astype(np.float64)
+        weights = weights[order]
+
+        values = np.tensordot(weights, neighbour_values, axes=1)
+        for column, component in enumerate(self.components):
+            if component in TmyGridStore.CIRCULAR_COMPONENTS:
+                angles = np.radians(neighbour_values[:, :, column])
+                directions = np.degrees(np.arctan2(weights @ np.sin(angles), weights @ np.cos(angles))) % 360
+                # -1e-15 % 360 is 360.0
+                directions[directions >= 360] = 0
+                values[:, column] = directions
+
+        return pd.DataFrame(values, index=self.index, columns=self.components)
+
+    @staticmethod
+    def distance_meters(latitude, longitude, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """
+        Great-circle (haversine) distances from one location to many, see SpatialCacheIndex.distance_meters
+        """
+        latitude, longitude = np.radians(latitude), np.radians(longitude)
+        latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+        a = np.sin((latitudes - latitude) / 2)**2 + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2)**2
+        return 2 * SpatialCacheIndex.EARTH_RADIUS_METERS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+    @staticmethod
+    def build(directory: str, locations: Iterable, attributes: dict | None = None) -> dict:
+        """
+        Build (or rebuild) the store in directory
+
+        locations - (latitude, longitude, key, frame) tuples, frames are read one at a time; a frame with other
+                    columns or another time axis than the first one is skipped
+        attributes - stored in the meta file (e.g. country_code)
+
+        Returns stats: locations, skipped, bytes.
+        """
+        os.makedirs(directory, exist_ok=True)
+        meta_file_path = os.path.join(directory, TmyGridStore.META_FILE_NAME)
+        values_file_name = f"values.{time.time_ns()}.npy"
+        values_file_path = os.path.join(directory, values_file_name)
+        raw_file_path = f"{values_file_path}.{os.getpid()}.tmp"
+        stats = {"locations": 0, "skipped": 0, "bytes": 0}
+
+        with FileLock.for_file(meta_file_path):
+            stored_locations = []
+            components = None
+            index = None
+            try:
+                # values are appended to a raw file, the .npy header needs the final number of locations
+                with open(raw_file_path, "wb") as raw_file:
+                    for latitude, longitude, key, frame in locations:
+                        if index is None:
+                            components = [str(column) for column in frame.columns]
+                            index = frame.index
+                            if TmyGridStore._describe_index(index) is None:
+                                raise ValueError(f"TmyGridStore: time axis is not regular, key={key}")
+                        if list(frame.columns) != components or not frame.index.equals(index):
+                            logger.warning(f"TmyGridStore: skipping location with other components or time axis, key={key}")
+                            stats["skipped"] += 1
+                            continue
+                        raw_file.write(np.ascontiguousarray(frame.to_numpy(dtype=TmyGridStore.DTYPE)).tobytes())
+                        stored_locations.append({"latitude": float(latitude), "longitude": float(longitude), "key": key})
+
+                if not stored_locations:
+                    logger.warning(f"TmyGridStore: no locations, store not built, directory={directory}")
+                    return stats
+
+                with open(values_file_path, "wb") as values_file, open(raw_file_path, "rb") as raw_file:
+                    np.lib.format.write_array_header_1_0(values_file, {
+                        "descr": TmyGridStore.DTYPE.str,
+                        "fortran_order": False,
+                        "shape": (len(stored_locations), len(index), len(components)),
+                    })
+                    shutil.copyfileobj(raw_file, values_file)
+            finally:
+                if os.path.exists(raw_file_path):
+                    os.remove(raw_file_path)
+
+            previous_values_file_name = None
+            if os.path.exists(meta_file_path):
+                with open(meta_file_path) as file:
+                    previous_values_file_name = json.load(file).get("values_file")
+
+            meta = {
+                **(attributes or {}),
+                "values_file": values_file_name,
+                "components": components,
+                "index": TmyGridStore._describe_index(index),
+                "locations": stored_locations,
+                "built_at": time.time(),
+            }
+            temp_meta_file_path = f"{meta_file_path}.{os.getpid()}.tmp"
+            with open(temp_meta_file_path, "w") as file:
+                json.dump(meta, file)
+            os.replace(temp_meta_file_path, meta_file_path)
+
+            # processes still using the previous store keep their mapping of the removed file
+            if previous_values_file_name and previous_values_file_name != values_file_name:
+                try:
+                    os.remove(os.path.join(directory, previous_values_file_name))
+                except FileNotFoundError:
+                    pass
+
+        stats["locations"] = len(stored_locations)
+        stats["bytes"] = os.path.getsize(values_file_path)
+        logger.info(f"TmyGridStore: built store, directory={directory}, stats={stats}")
+        return stats
+
+    @staticmethod
+    def _describe_index(index: pd.DatetimeIndex) -> dict | None:
+        """
+        start, step (in unit, UTC), unit, timezone and rows of a regular DatetimeIndex, None if it's not regular
+        """
+        if not isinstance(index, pd.DatetimeIndex) or len(index) < 2:
+            return None
+        index_values = index.asi8
+        steps = np.diff(index_values)
+        if steps[0] <= 0 or not (steps == steps[0]).all():
+            return None
+        return {
+            "start": int(index_values[0]),
+            "step": int(steps[0]),
+            "unit": index.unit,
+            "tz": str(index.tz) if index.tz is not None else None,
+            "rows": len(index),
+            "name": index.name,
+        }
+
+    @staticmethod
+    def _build_index(index_meta: dict) -> pd.DatetimeIndex:
+        index_values = index_meta["start"] + index_meta["step"] * np.arange(index_meta["rows"], dtype=np.int64)
+        index = pd.DatetimeIndex(index_values.view(f"M8[{index_meta['unit']}]"), name=index_meta["name"])
+        if index_meta["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(index_meta["tz"])
+        return index
+
+    @staticmethod
+    def _get_signature(file_path: str):
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
@@ -0,0 +1,43 @@
+import sys
+import argparse
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.SolarUtils.PvGis import PvGis
+
+# Builds the TMY grid store of a country from the cached PvGis TMY data, see PvGis.build_tmy_grid and PvGis.USE_TMY_GRID.
+#
+# usage: python -m aiecommon.SolarUtils.build_tmy_grid COUNTRY_CODE [COUNTRY_CODE ...] [--bounds MIN_LAT,MIN_LON,MAX_LAT,MAX_LON]
+#
+# A rebuild replaces the store atomically, processes using the store pick up the new one on their next lookup.
+
+
+def parse_bounds(value: str) -> tuple:
+    try:
+        bounds = tuple(float(part) for part in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid bounds {value}, expected MIN_LAT,MIN_LON,MAX_LAT,MAX_LON")
+    if len(bounds) != 4 or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+        raise argparse.ArgumentTypeError(f"invalid bounds {value}, expected MIN_LAT,MIN_LON,MAX_LAT,MAX_LON")
+    return bounds
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m aiecommon.SolarUtils.build_tmy_grid",
+        description="Build the TMY grid store of countries from the cached PvGis TMY data, for interpolating new locations offline.",
+    )
+    parser.add_argument("country_codes", nargs="+", help="country codes to build the stores of")
+    parser.add_argument("--bounds", type=parse_bounds, default=None, help="only store cached locations within MIN_LAT,MIN_LON,MAX_LAT,MAX_LON (default: all)")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for country_code in args.country_codes:
+        stats = PvGis.build_tmy_grid(country_code, args.bounds)
+        print(f"{country_code}: locations={stats['locations']} skipped={stats['skipped']} MB={stats['bytes'] / 1024**2:.1f}", flush=True)
+        failed = failed or not stats["locations"]
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
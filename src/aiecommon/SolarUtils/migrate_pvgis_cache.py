@@ -0,0 +1,117 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import pickle
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.SolarUtils.PvGis import PvGis
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+from aiecommon.SolarUtils.CacheManifest import CacheManifest
+from aiecommon.SolarUtils.ColumnarFrame import ColumnarFrame
+from aiecommon.FileSystem import LocalRuntimeFiles, FileLock
+
+# Converts existing PvGis cache files between the pickle and the columnar (memory-mappable) format, see PvGis.CACHE_FORMAT.
+#
+# usage: python -m aiecommon.SolarUtils.migrate_pvgis_cache [--to columnar|pickle] [--directory DIR] [--dry-run]
+#
+# Every converted frame is read back and compared with the original before the cache file is replaced (atomically,
+# under the cache file lock, keeping CACHE_CODEC / CACHE_DEDUPLICATE). Columnar values are float32, so values are
+# compared with float32 tolerance. Converted files are uploaded to the cache backend if there is one.
+
+
+class PvGisCacheMigration:
+
+    # float32 keeps ~7 significant digits
+    RELATIVE_TOLERANCE = 1e-6
+    ABSOLUTE_TOLERANCE = 1e-6
+
+    def __init__(self, target_format: str, directory: str | None = None, dry_run: bool = False):
+        self.target_format = target_format
+        self.directory = directory or LocalRuntimeFiles.get_file(PvGis.STORAGE_FOLDER, usePermanentStorage=PvGis.USE_PERMANENT_STORAGE)
+        self.dry_run = dry_run
+        self.stats = {"scanned": 0, "converted": 0, "skipped": 0, "failed": 0, "bytes_before": 0, "bytes_after": 0}
+
+    def run(self):
+        for file_name in sorted(os.listdir(self.directory)):
+            if PvGis._CACHE_FILE_NAME_PATTERN.fullmatch(file_name):
+                self.stats["scanned"] += 1
+                self.migrate(os.path.join(self.directory, file_name))
+
+        cache_backend = PvGis._get_cache_backend()
+        if cache_backend is not None and self.stats["converted"] and not self.dry_run:
+            cache_backend.flush()
+
+    def migrate(self, cache_file_path: str):
+        try:
+            with FileLock.for_file(cache_file_path):
+                payload = CacheStorage.read(cache_file_path)
+                if ColumnarFrame.is_columnar(payload) == (self.target_format == PvGis.CACHE_FORMAT_COLUMNAR):
+                    self.stats["skipped"] += 1
+                    return
+
+                data = PvGis._deserialize_cache(payload, {})
+                if self.target_format == PvGis.CACHE_FORMAT_COLUMNAR:
+                    if not ColumnarFrame.can_serialize(data):
+                        raise ValueError(f"frame can't be stored in columnar format, dtypes={dict(data.dtypes)}")
+                    converted_payload = ColumnarFrame.serialize(data)
+                else:
+                    # pickled frames are float64, as returned by PvGis._fetch
+                    converted_payload = pickle.dumps(data.astype(np.float64), protocol=pickle.HIGHEST_PROTOCOL)
+
+                converted_data = PvGis._deserialize_cache(converted_payload, {})
+                if not self.is_equivalent(data, converted_data):
+                    raise ValueError("converted frame differs from the original")
+
+                self.stats["bytes_before"] += len(payload)
+                self.stats["bytes_after"] += len(converted_payload)
+                if not self.dry_run:
+                    CacheManifest.invalidate(cache_file_path)
+                    CacheStorage.write(cache_file_path, converted_payload, PvGis.CACHE_CODEC, PvGis.CACHE_CODEC_LEVEL, PvGis.CACHE_DEDUPLICATE)
+                    if PvGis.USE_CACHE_MANIFEST:
+                        CacheManifest.write(cache_file_path, validated=True)
+                    PvGis._write_behind_cache_backend(cache_file_path)
+                self.stats["converted"] += 1
+        except Exception as e:
+            logger.warning(f"migrate_pvgis_cache: cannot convert cache file, cache_file_path={cache_file_path}, exception={e}")
+            self.stats["failed"] += 1
+
+    @staticmethod
+    def is_equivalent(data: pd.DataFrame, converted_data: pd.DataFrame) -> bool:
+        return (
+            list(data.columns) == list(converted_data.columns)
+            and data.index.equals(converted_data.index)
+            and np.allclose(
+                data.to_numpy(dtype=np.float64), converted_data.to_numpy(dtype=np.float64),
+                rtol=PvGisCacheMigration.RELATIVE_TOLERANCE, atol=PvGisCacheMigration.ABSOLUTE_TOLERANCE, equal_nan=True,
+            )
+        )
+
+    def format_stats(self) -> str:
+        return (
+            f"scanned={self.stats['scanned']} converted={self.stats['converted']} skipped={self.stats['skipped']} failed={self.stats['failed']} "
+            f"MB before={self.stats['bytes_before'] / 1024**2:.1f} MB after={self.stats['bytes_after'] / 1024**2:.1f}"
+            + (" (dry run)" if self.dry_run else "")
+        )
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m aiecommon.SolarUtils.migrate_pvgis_cache",
+        description="Convert PvGis cache files between the pickle and the columnar (memory-mappable) format.",
+    )
+    parser.add_argument("--to", dest="target_format", choices=[PvGis.CACHE_FORMAT_COLUMNAR, PvGis.CACHE_FORMAT_PICKLE], default=PvGis.CACHE_FORMAT_COLUMNAR, help="target format (default: columnar)")
+    parser.add_argument("--directory", default=None, help="PvGis cache directory (default: the runtime files storage folder of PvGis)")
+    parser.add_argument("--dry-run", action="store_true", help="convert and verify, but don't replace the cache files")
+    args = parser.parse_args(argv)
+
+    migration = PvGisCacheMigration(args.target_format, args.directory, args.dry_run)
+    migration.run()
+
+    print(migration.format_stats(), flush=True)
+    return 1 if migration.stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
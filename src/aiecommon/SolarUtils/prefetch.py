@@ -0,0 +1,262 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import aiecommon.custom_logger as custom_logger
+logger = custom_logger.get_logger()
+from aiecommon.SolarUtils.PvGis import PvGis
+from aiecommon.SolarUtils.GoogleSolarApi import GoogleSolarApi
+
+# Warms up PvGis and GoogleSolarApi caches for a list of coordinates, e.g. before a campaign in a new region.
+#
+# usage: python -m aiecommon.SolarUtils.prefetch coords.csv [--apis pvgis,google] [--concurrency 4] [--rate 2]
+#
+# The coordinates file is a CSV with latitude and longitude columns, and optionally country_code and radius_meters
+# (defaults from --country-code and --radius-meters). Rows are streamed, so the file can be larger than memory.
+# Completed cache keys are appended to the state file, a rerun skips them (failed ones are retried).
+
+API_PVGIS = "pvgis"
+API_GOOGLE = "google"
+APIS = [API_PVGIS, API_GOOGLE]
+
+
+class RequestRate:
+    """
+    Spaces out calls to at most rate_per_second, shared by all worker threads
+    """
+
+    def __init__(self, rate_per_second: float | None):
+        self.interval_seconds = 1 / rate_per_second if rate_per_second else 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval_seconds:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_seconds = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval_seconds
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+class Prefetcher:
+
+    def __init__(self,
+        apis: list,
+        country_code: str | None = None,
+        radius_meters: float = 50,
+        use_google_experimental: bool = False,
+        concurrency: int = 4,
+        rate_per_second: float | None = None,
+        state_file_path: str | None = None,
+        max_retries: int = 3,
+        min_retry_delay: int = 2,
+        pvgis_api_url: str | None = None,
+    ):
+        self.apis = apis
+        self.country_code = country_code
+        self.radius_meters = radius_meters
+        self.use_google_experimental = use_google_experimental
+        self.concurrency = concurrency
+        self.request_rate = RequestRate(rate_per_second)
+        self.state_file_path = state_file_path
+
+        self.pv_gis = PvGis(country_code, max_retries=max_retries, min_retry_delay=min_retry_delay, api_url=pvgis_api_url) if API_PVGIS in apis else None
+        self.google_solar_api = GoogleSolarApi(max_retries=max_retries, min_retry_delay=min_retry_delay) if API_GOOGLE in apis else None
+
+        self.completed_keys = self._read_state()
+        self.seen_keys = set()
+        self.stats = {
+            "rows": 0,
+            "invalid_rows": 0,
+            "duplicates": 0,
+            "already_completed": 0,
+            "hits": 0,
+            "misses": 0,
+            "fetched": 0,
+            "failed": 0,
+        }
+        self.start_time = None
+        self._lock = threading.Lock()
+
+    def _read_state(self) -> set:
+        if not self.state_file_path or not os.path.exists(self.state_file_path):
+            return set()
+        with open(self.state_file_path) as file:
+            return set(line.strip() for line in file if line.strip())
+
+    def _write_state(self, task_key: str):
+        if not self.state_file_path:
+            return
+        with self._lock:
+            with open(self.state_file_path, "a") as file:
+                file.write(task_key + "\n")
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_tasks(self, rows):
+        """
+        (task_key, api, params) for every api and row, deduplicated by cache key
+        """
+        for row in rows:
+            self.stats["rows"] += 1
+            try:
+                params = {
+                    "latitude": float(row["latitude"]),
+                    "longitude": float(row["longitude"]),
+                    "country_code": row.get("country_code") or self.country_code,
+                    "radius_meters": float(row.get("radius_meters") or self.radius_meters),
+                }
+                # same cache key as for callers passing an int radius
+                if params["radius_meters"].is_integer():
+                    params["radius_meters"] = int(params["radius_meters"])
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"prefetch: skipping invalid row, row={row}, exception={e}")
+                self.stats["invalid_rows"] += 1
+                continue
+
+            for api in self.apis:
+                if api == API_PVGIS:
+                    if not params["country_code"]:
+                        logger.warning(f"prefetch: skipping PvGis for row without country code, row={row}")
+                        self.stats["invalid_rows"] += 1
+                        continue
+                    task_key = f"{api}/{PvGis._get_cache_key(params)}"
+                else:
+                    task_key = f"{api}/{GoogleSolarApi._get_cache_key({**params, 'endpoint_identifier': GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM})}"
+
+                if task_key in self.seen_keys:
+                    self.stats["duplicates"] += 1
+                    continue
+                self.seen_keys.add(task_key)
+                if task_key in self.completed_keys:
+                    self.stats["already_completed"] += 1
+                    continue
+
+                yield task_key, api, params
+
+    def _is_cached(self, api: str, params: dict) -> bool:
+        if api == API_PVGIS:
+            return os.path.exists(PvGis._get_cache_file_path(params))
+        tiff_api_call_params = GoogleSolarApi._get_tiff_api_call_params(params["latitude"], params["longitude"], params["radius_meters"])
+        return all(os.path.exists(GoogleSolarApi._get_cache_file_path(tiff_api_call_params[endpoint_identifier])) for endpoint_identifier in tiff_api_call_params)
+
+    def _fetch(self, api: str, params: dict):
+        if api == API_PVGIS:
+            self.pv_gis.get_solar_components(params["latitude"], params["longitude"], country_code=params["country_code"])
+        else:
+            self.google_solar_api.get_data(params["latitude"], params["longitude"], params["radius_meters"], self.use_google_experimental)
+
+    def _run_task(self, task_key: str, api: str, params: dict):
+        try:
+            if self._is_cached(api, params):
+                self._count("hits")
+            else:
+                self._count("misses")
+                self.request_rate.wait()
+                self._fetch(api, params)
+                self._count("fetched")
+            self._write_state(task_key)
+        except Exception as e:
+            logger.warning(f"prefetch: fetch failed, task_key={task_key}, params={params}, exception={e}")
+            self._count("failed")
+
+    def run(self, rows, stats_interval_seconds: float = 10):
+        """
+        Prefetch all rows, at most concurrency tasks run and as many wait in the queue, so rows are read as they are processed
+        """
+        self.start_time = time.monotonic()
+        last_stats_time = self.start_time
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def run_task(*task):
+            try:
+                self._run_task(*task)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for task in self.get_tasks(rows):
+                slots.acquire()
+                executor.submit(run_task, *task)
+                if stats_interval_seconds and time.monotonic() - last_stats_time >= stats_interval_seconds:
+                    last_stats_time = time.monotonic()
+                    print(self.format_stats(), flush=True)
+
+        return self.get_stats()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        elapsed_seconds = time.monotonic() - self.start_time if self.start_time is not None else 0
+        processed = stats["hits"] + stats["fetched"] + stats["failed"]
+        stats["elapsed_seconds"] = round(elapsed_seconds, 1)
+        stats["tasks_per_second"] = round(processed / elapsed_seconds, 2) if elapsed_seconds else 0
+        stats["fetched_per_second"] = round(stats["fetched"] / elapsed_seconds, 2) if elapsed_seconds else 0
+        stats["hit_ratio"] = round(stats["hits"] / (stats["hits"] + stats["misses"]), 3) if stats["hits"] + stats["misses"] else 0
+        return stats
+
+    def format_stats(self) -> str:
+        return "prefetch: " + ", ".join(f"{name}={value}" for name, value in self.get_stats().items())
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m aiecommon.SolarUtils.prefetch",
+        description="Warm up PvGis and GoogleSolarApi caches for the coordinates in a CSV file (columns latitude, longitude, optionally country_code and radius_meters).",
+    )
+    parser.add_argument("coordinates_file", help="CSV file with the coordinates, - for stdin")
+    parser.add_argument("--apis", default=",".join(APIS), help=f"comma separated APIs to prefetch (default: {','.join(APIS)})")
+    parser.add_argument("--country-code", default=None, help="country code for rows without one (required by PvGis)")
+    parser.add_argument("--radius-meters", type=float, default=50, help="GoogleSolarApi radius for rows without one (default: 50)")
+    parser.add_argument("--use-google-experimental", action="store_true", help="use GoogleSolarApi expanded coverage")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of concurrent fetches (default: 4)")
+    parser.add_argument("--rate", type=float, default=None, help="maximal number of fetches per second, across all APIs (default: no limit)")
+    parser.add_argument("--state-file", default=None, help="file recording completed cache keys, for resuming (default: COORDINATES_FILE.prefetch_state)")
+    parser.add_argument("--stats-interval", type=float, default=10, help="print statistics every STATS_INTERVAL seconds (default: 10)")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--min-retry-delay", type=int, default=2)
+    parser.add_argument("--pvgis-api-url", default=None, help="base URL of the PVGIS API (default: AIENERGY_PVGIS_API_URL or the public API)")
+    args = parser.parse_args(argv)
+
+    apis = [api.strip() for api in args.apis.split(",") if api.strip()]
+    unknown_apis = [api for api in apis if api not in APIS]
+    if unknown_apis or not apis:
+        parser.error(f"unknown APIs {unknown_apis}, known APIs are {APIS}")
+
+    state_file_path = args.state_file
+    if state_file_path is None and args.coordinates_file != "-":
+        state_file_path = args.coordinates_file + ".prefetch_state"
+
+    prefetcher = Prefetcher(
+        apis,
+        country_code=args.country_code,
+        radius_meters=args.radius_meters,
+        use_google_experimental=args.use_google_experimental,
+        concurrency=args.concurrency,
+        rate_per_second=args.rate,
+        state_file_path=state_file_path,
+        max_retries=args.max_retries,
+        min_retry_delay=args.min_retry_delay,
+        pvgis_api_url=args.pvgis_api_url,
+    )
+
+    if args.coordinates_file == "-":
+        prefetcher.run(csv.DictReader(sys.stdin), args.stats_interval)
+    else:
+        with open(args.coordinates_file, newline="") as file:
+            prefetcher.run(csv.DictReader(file), args.stats_interval)
+
+    print(prefetcher.format_stats(), flush=True)
+    return 1 if prefetcher.stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
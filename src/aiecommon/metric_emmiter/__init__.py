@@ -14,12 +14,14 @@ class AwsMetricEmitterBase:
         dimensions: list,
         period,
         flush_interval: float = 1.0,     # seconds
-        max_batch: int = 1              # CW allows up to 20 metrics per PutMetricData
+        max_batch: int = 1,             # CW allows up to 20 metrics per PutMetricData
+        unit: str = "Count"             # CloudWatch unit, e.g. "Milliseconds"
     ):
         self.namespace = namespace
         self.metric_name = metric_name
         self.dimensions = dimensions
         self.period = period
+        self.unit = unit
         self.flush_interval = flush_interval
         self.max_batch = max_batch
         logger.info("AwsMetricEmitterBase: Start AWS cloudwatch client")
@@ -83,7 +85,7 @@ class AwsMetricEmitterBase:
                         microsecond=0
                     ),
                     "Value": value,
-                    "Unit": "Count",
+                    "Unit": self.unit,
                     "StorageResolution": 1,
                 }]
             )
@@ -100,7 +102,7 @@ class AwsMetricEmitterBase:
                 "Dimensions": self.dimensions,
                 "Timestamp": datetime.datetime.now(datetime.timezone.utc),
                 "Value": value,
-                "Unit": "Count",
+                "Unit": self.unit,
                 "StorageResolution": 1,
             })
         except Exception:
@@ -142,7 +144,8 @@ class AwsEcsMetricEmitter(AwsMetricEmitterBase):
         metric_name: str,
         period: int,
         flush_interval: float = 1.0,     # seconds
-        max_batch: int = 1              # CW allows up to 20 metrics per PutMetricData
+        max_batch: int = 1,             # CW allows up to 20 metrics per PutMetricData
+        unit: str = "Count"             # CloudWatch unit, e.g. "Milliseconds"
     ):
         self.metric_name = None
 
@@ -181,7 +184,8 @@ class AwsEcsMetricEmitter(AwsMetricEmitterBase):
                 # }],
                 period=period,
                 flush_interval=flush_interval,
-                max_batch=max_batch
+                max_batch=max_batch,
+                unit=unit
             )
 
     @staticmethod
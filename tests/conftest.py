@@ -0,0 +1,10 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# aiecommon creates its runtime directories (runtimedata/, logs/) relative to the working directory when it's imported,
+# tests run in a temporary directory that is removed at exit
+_TEST_DIRECTORY = tempfile.mkdtemp(prefix="aiecommon-tests-")
+os.chdir(_TEST_DIRECTORY)
+atexit.register(shutil.rmtree, _TEST_DIRECTORY, True)
@@ -0,0 +1,28 @@
+import time
+
+
+class FakeResponse:
+    """
+    requests.Response stand-in for stubbed transports, chunk_delay_seconds slows down iter_content
+    """
+
+    def __init__(self, status_code: int, content: bytes = b"", json_data=None, chunk_delay_seconds: float = 0):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode(errors="replace")
+        self.chunk_delay_seconds = chunk_delay_seconds
+        self.chunks_read = 0
+        self.closed = False
+        self._json_data = json_data
+
+    def json(self):
+        return self._json_data
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            time.sleep(self.chunk_delay_seconds)
+            self.chunks_read += 1
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
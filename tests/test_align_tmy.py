@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+from aiecommon.SolarUtils.PvGis import PvGis
+
+# PvGis.align_tmy against the pandas pipeline it replaced in PvGis._fetch, see scripts/benchmark_tmy_alignment.py
+
+TIMEZONES = ["CET", "Europe/Madrid", "Europe/London", "America/New_York", "Asia/Kolkata", "UTC"]
+# a leap year and a common year other than the default typical year
+TYPICAL_YEARS = [2018, 2020, 2021]
+# per-month source years of an uncoerced PVGIS TMY, February of a leap year
+MONTH_YEARS = {1: 2012, 2: 2016, 3: 2007, 4: 2018, 5: 2010, 6: 2014, 7: 2020, 8: 2011, 9: 2018, 10: 2015, 11: 2013, 12: 2008}
+
+
+def make_raw_tmy(seed, missing_rows=0, nan_values=0, month_years=None):
+    """
+    Raw TMY as returned by pvlib.iotools.get_pvgis_tmy: hourly UTC rows, float and int columns, every month
+    in the typical year (coerce_year) or in its year of month_years
+    """
+    rng = np.random.default_rng(seed)
+    if month_years is None:
+        index = pd.date_range(PvGis.TYPICAL_YEAR_START_DATE, PvGis.TYPICAL_YEAR_END_DATE, freq="h", tz="UTC", name="time(UTC)")
+    else:
+        index = pd.DatetimeIndex(np.concatenate([
+            pd.date_range(pd.Timestamp(year, month, 1), periods=pd.Timestamp(year, month, 1).days_in_month * 24, freq="h", tz="UTC")
+            for month, year in sorted(month_years.items())
+        ]), name="time(UTC)")
+    hours = np.arange(len(index))
+    daylight = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None)
+    frame = pd.DataFrame({
+        "temp_air": 8 + 10 * np.sin(hours / 8760 * 2 * np.pi) + rng.normal(0, 2, len(index)),
+        "relative_humidity": rng.uniform(40, 100, len(index)),
+        "ghi": 600 * daylight * rng.uniform(0.2, 1, len(index)),
+        "dni": 700 * daylight * rng.uniform(0, 1, len(index)),
+        "dhi": 200 * daylight * rng.uniform(0.3, 1, len(index)),
+        "IR(h)": rng.uniform(250, 350, len(index)),
+        "wind_speed": rng.uniform(0, 12, len(index)),
+        "wind_direction": rng.integers(0, 360, len(index)),
+        "pressure": rng.integers(98000, 103000, len(index)),
+    }, index=index)
+    if missing_rows:
+        frame = frame.drop(frame.index[rng.choice(len(frame), missing_rows, replace=False)])
+    for _ in range(nan_values):
+        frame.iloc[rng.integers(len(frame)), rng.integers(6)] = np.nan
+    return frame
+
+
+def get_minute_offsets(tz):
+    """
+    PvGis.get_tmy_minute_offsets, one per hour of the typical year
+    """
+    hours = pd.date_range(pd.Timestamp(PvGis.TYPICAL_YEAR_START_DATE), pd.Timestamp(PvGis.TYPICAL_YEAR_END_DATE), freq="h", tz=tz)
+    return np.full(len(hours), PvGis.get_tmy_minute_offsets(0, 0, {})[0])
+
+
+def align_tmy_pandas(df, tz, delays):
+    # PvGis._fetch before PvGis.align_tmy
+    start = pd.Timestamp(PvGis.TYPICAL_YEAR_START_DATE)
+    end = pd.Timestamp(PvGis.TYPICAL_YEAR_END_DATE)
+    # _fetch set the index of the frame from pvlib, a shallow copy keeps the input unchanged
+    df = df.copy(deep=False)
+    df.index = df.index.tz_convert(tz)
+    full = pd.date_range(start=start, end=end, freq='h', tz=tz)
+    df = df.reindex(full)
+    df.index = df.index + pd.to_timedelta(delays, unit='min')
+    df = df.bfill().ffill().interpolate(method='nearest')
+    return df[~df.index.duplicated()]
+
+
+def align_tmy(df, tz, delays):
+    return PvGis.align_tmy(df.index, {column: df[column].to_numpy() for column in df.columns}, tz, delays)
+
+
+def assert_same_alignment(raw_tmy, tz, delays):
+    expected = align_tmy_pandas(raw_tmy, tz, delays)
+    aligned = align_tmy(raw_tmy, tz, delays)
+    pd.testing.assert_frame_equal(aligned, expected, check_exact=True, check_freq=True)
+    return aligned
+
+
+@pytest.fixture(params=TYPICAL_YEARS)
+def typical_year(request, monkeypatch):
+    year = request.param
+    monkeypatch.setattr(PvGis, "TYPICAL_YEAR_START_DATE", f"{year}-01-01 00:00")
+    monkeypatch.setattr(PvGis, "TYPICAL_YEAR_END_DATE", f"{year}-12-31 23:00")
+    monkeypatch.setattr(PvGis, "TYPICAL_YEAR", year)
+    return year
+
+
+@pytest.mark.parametrize("tz", TIMEZONES)
+def test_align_tmy(typical_year, tz):
+    aligned = assert_same_alignment(make_raw_tmy(1), tz, get_minute_offsets(tz))
+
+    assert len(aligned) == (8784 if typical_year % 4 == 0 else 8760)
+
+
+@pytest.mark.parametrize("tz", TIMEZONES)
+def test_align_tmy_with_gaps(typical_year, tz):
+    assert_same_alignment(make_raw_tmy(2, missing_rows=50, nan_values=200), tz, get_minute_offsets(tz))
+
+
+@pytest.mark.parametrize("tz", TIMEZONES)
+def test_align_tmy_with_duplicate_timestamps(typical_year, tz):
+    delays = get_minute_offsets(tz)
+    # offsets that map two hours to the same timestamp
+    delays = np.where(np.arange(len(delays)) % 500 == 0, 70, delays)
+    aligned = assert_same_alignment(make_raw_tmy(3), tz, delays)
+    assert aligned.index.is_unique
+
+
+@pytest.mark.parametrize("tz", ["Europe/Madrid", "America/New_York"])
+def test_align_tmy_across_dst_changes(typical_year, tz):
+    aligned = assert_same_alignment(make_raw_tmy(4), tz, get_minute_offsets(tz))
+
+    # the hours are instants, the local clock skips an hour in spring and repeats one in autumn
+    utc_offsets = {offset.total_seconds() for offset in aligned.index.map(lambda timestamp: timestamp.utcoffset())}
+    assert len(utc_offsets) == 2
+
+
+@pytest.mark.parametrize("tz", ["CET", "America/New_York", "UTC"])
+def test_align_tmy_from_other_source_years(tz):
+    # only April and September are in the typical year, the other hours are filled from them
+    assert_same_alignment(make_raw_tmy(5, month_years=MONTH_YEARS), tz, get_minute_offsets(tz))
+
+
+def test_align_tmy_unsorted():
+    assert_same_alignment(make_raw_tmy(6).sample(frac=1, random_state=0), "CET", get_minute_offsets("CET"))
+
+
+def test_align_tmy_all_nan_column():
+    assert_same_alignment(make_raw_tmy(7).assign(dhi=np.nan), "CET", get_minute_offsets("CET"))
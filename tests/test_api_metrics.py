@@ -0,0 +1,63 @@
+import pytest
+import aiecommon.metric_emmiter
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+
+
+class RecordingMetricEmitter:
+    emitted = []
+
+    def __init__(self, namespace, metric_name, period, unit="Count"):
+        self.metric_name = metric_name
+        self.unit = unit
+
+    def emit_metric(self, value):
+        RecordingMetricEmitter.emitted.append((self.metric_name, value, self.unit))
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    monkeypatch.setattr(aiecommon.metric_emmiter, "MetricEmitter", RecordingMetricEmitter)
+    RecordingMetricEmitter.emitted = []
+    ApiMetrics.reset()
+    yield RecordingMetricEmitter.emitted
+    ApiMetrics.reset()
+
+
+def emit(emitted, namespace):
+    emitted.clear()
+    ApiMetrics.emit(namespace)
+    return {name: (value, unit) for name, value, unit in emitted}
+
+
+def test_emit_sends_counter_increments_as_count(emitted):
+    metrics = ApiMetrics.get("test-api")
+    metrics.increment("fetches", 3)
+    assert emit(emitted, "counters")["test-api.default.fetches"] == (3, "Count")
+
+    metrics.increment("fetches", 2)
+    assert emit(emitted, "counters")["test-api.default.fetches"] == (2, "Count")
+
+
+def test_emit_sends_percentiles_of_the_period_in_milliseconds(emitted):
+    metrics = ApiMetrics.get("test-api")
+    for _ in range(100):
+        metrics.observe("fetch_seconds", 2.0)
+    first = emit(emitted, "latencies")
+    value, unit = first["test-api.default.fetch_seconds.p50_ms"]
+    assert unit == "Milliseconds"
+    assert 1000 < value <= 2000
+
+    # the slow period doesn't weigh on the next one
+    for _ in range(100):
+        metrics.observe("fetch_seconds", 0.003)
+    second = emit(emitted, "latencies")
+    for percentile in (50, 95, 99):
+        value, unit = second[f"test-api.default.fetch_seconds.p{percentile}_ms"]
+        assert unit == "Milliseconds"
+        assert value <= 5
+
+    # nothing observed, no percentiles
+    assert not any(name.endswith("_ms") for name in emit(emitted, "latencies"))
+
+    # the cumulative histogram is kept for snapshots
+    assert metrics.get_count("fetch_seconds") == 200
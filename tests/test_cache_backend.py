@@ -0,0 +1,147 @@
+import io
+import os
+import boto3
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+from aiecommon.SolarUtils.CacheBackend import LocalCacheBackend, S3CacheBackend
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+from aiecommon.SolarUtils.ExternalApiBase import ExternalApiBase
+
+BUCKET = "aiecommon-cache"
+
+
+@pytest.fixture
+def s3_backend():
+    client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing", aws_secret_access_key="testing")
+    with Stubber(client) as stubber:
+        yield S3CacheBackend(BUCKET, prefix="cache/", client=client), stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_s3_get_downloads_the_object(s3_backend, tmp_path):
+    backend, stubber = s3_backend
+    payload = b"cached payload"
+    stubber.add_response(
+        "get_object",
+        {"Body": StreamingBody(io.BytesIO(payload), len(payload)), "ContentLength": len(payload)},
+        {"Bucket": BUCKET, "Key": "cache/api/key"},
+    )
+    file_path = str(tmp_path / "api" / "key")
+
+    assert backend.get("api/key", file_path)
+    with open(file_path, "rb") as file:
+        assert file.read() == payload
+    assert backend.get_stats()["get_hits"] == 1
+
+
+def test_s3_get_of_a_missing_object(s3_backend, tmp_path):
+    backend, stubber = s3_backend
+    stubber.add_client_error("get_object", service_error_code="NoSuchKey", http_status_code=404, expected_params={"Bucket": BUCKET, "Key": "cache/api/missing"})
+    stubber.add_client_error("get_object", service_error_code="AccessDenied", http_status_code=403, expected_params={"Bucket": BUCKET, "Key": "cache/api/denied"})
+
+    assert not backend.get("api/missing", str(tmp_path / "missing"))
+    assert not backend.get("api/denied", str(tmp_path / "denied"))
+
+    assert not os.listdir(tmp_path)
+    stats = backend.get_stats()
+    assert (stats["get_misses"], stats["get_errors"]) == (1, 1)
+
+
+def test_s3_put_uploads_under_the_prefix(s3_backend, tmp_path):
+    backend, stubber = s3_backend
+    # the parameters upload_file adds (e.g. checksums) depend on the boto3 version
+    stubber.add_response("put_object", {}, None)
+    put_params = []
+    backend._client.meta.events.register("provide-client-params.s3.PutObject", lambda params, **kwargs: put_params.append(params))
+    file_path = tmp_path / "key"
+    file_path.write_bytes(b"payload")
+
+    assert backend.put("api/key", str(file_path))
+    assert [(params["Bucket"], params["Key"]) for params in put_params] == [(BUCKET, "cache/api/key")]
+    assert backend.get_stats()["put_count"] == 1
+
+
+class RecordingCacheBackend(LocalCacheBackend):
+
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.uploaded_keys = []
+
+    def _upload(self, key: str, file_path: str):
+        super()._upload(key, file_path)
+        self.uploaded_keys.append(key)
+
+
+class BackedApi(ExternalApiBase):
+
+    STORAGE_FOLDER = "backed_api"
+    API_IDENTIFIER = "BackedApi"
+
+    @staticmethod
+    def _get_cache_key(params: dict):
+        return str(params["key"])
+
+    @staticmethod
+    def _serialize_cache(data, params: dict) -> bytes:
+        return data
+
+    @staticmethod
+    def _deserialize_cache(payload: bytes, params: dict):
+        return payload
+
+    @staticmethod
+    def _check_cache(cached_result, params: dict):
+        return True
+
+
+@pytest.fixture
+def backed_api(monkeypatch, tmp_path):
+    backend = RecordingCacheBackend(str(tmp_path / "backend"))
+    monkeypatch.setattr(BackedApi, "CACHE_BACKEND", backend)
+    calls = []
+
+    def fetch(max_retries, retry_count, key):
+        calls.append(key)
+        return f"payload of {key}".encode() * 10
+
+    def call(key):
+        return BackedApi(min_result_size=0).call_api(fetch, {"key": key}, lambda result_data, params: len(result_data))
+
+    return call, calls, backend
+
+
+def test_cache_files_are_written_behind_and_read_through(backed_api):
+    call, calls, backend = backed_api
+
+    payload = call("round_trip")
+    assert backend.flush(10)
+    assert backend.uploaded_keys == ["backed_api/round_trip"]
+
+    # another task, without the local cache file
+    os.remove(BackedApi._get_cache_file_path({"key": "round_trip"}))
+    assert call("round_trip") == payload
+    assert calls == ["round_trip"]
+    assert ApiMetrics.get(BackedApi.API_IDENTIFIER).get_count("backend_hits") == 1
+
+
+def test_blobs_are_written_before_their_references(backed_api, monkeypatch):
+    call, calls, backend = backed_api
+    monkeypatch.setattr(BackedApi, "CACHE_DEDUPLICATE", True)
+
+    payload = call("deduplicated")
+    assert backend.flush(10)
+
+    cache_file_path = BackedApi._get_cache_file_path({"key": "deduplicated"})
+    blob_path = CacheStorage.get_referenced_blob_path(cache_file_path)
+    assert blob_path is not None
+    # a cache file in the backend always has its blob
+    assert backend.uploaded_keys == [BackedApi._get_cache_backend_key(blob_path), "backed_api/deduplicated"]
+
+    # the blob is read through with the cache file
+    os.remove(cache_file_path)
+    os.remove(blob_path)
+    assert call("deduplicated") == payload
+    assert os.path.exists(blob_path)
+    assert calls == ["deduplicated"]
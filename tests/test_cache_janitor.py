@@ -0,0 +1,164 @@
+import os
+import time
+from aiecommon.FileSystem import CacheJanitor, CacheQuota, FileLock
+from aiecommon.SolarUtils.CacheStorage import CacheStorage
+
+DAY = 86400
+
+
+def write_file(file_path, size: int, age_seconds: float = 0):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as file:
+        file.write(b"x" * size)
+    set_age(file_path, age_seconds)
+
+
+def set_age(file_path, age_seconds: float):
+    timestamp = time.time() - age_seconds
+    os.utime(file_path, (timestamp, timestamp))
+
+
+def run(directory, max_bytes=None, ttl_seconds=None):
+    return CacheJanitor([CacheQuota(str(directory), max_bytes, ttl_seconds)]).run_once()["total"]
+
+
+def test_entry_is_evicted_with_its_sidecars(tmp_path):
+    old = str(tmp_path / "old")
+    write_file(old, 100, 3 * DAY)
+    for suffix in [".manifest", ".npy", ".npy.json", ".lock"]:
+        write_file(old + suffix, 50, 3 * DAY)
+    # reading the raster is a use of the entry
+    used = str(tmp_path / "used")
+    write_file(used, 100, 3 * DAY)
+    write_file(used + ".npy", 50, DAY)
+    new = str(tmp_path / "new")
+    write_file(new, 100, 0)
+
+    stats = run(tmp_path, max_bytes=300)
+
+    assert stats["scanned_bytes"] == 100 + 4 * 50 + 100 + 50 + 100
+    assert stats["evicted_entries"] == 1
+    assert stats["evicted_bytes"] == 300
+    assert sorted(os.listdir(tmp_path)) == ["new", "used", "used.npy"]
+
+
+def test_sidecars_without_their_file_are_evicted_on_their_own(tmp_path):
+    write_file(str(tmp_path / "orphan.npy"), 100, 3 * DAY)
+    write_file(str(tmp_path / "orphan.lock"), 0, 3 * DAY)
+
+    stats = run(tmp_path, ttl_seconds=DAY)
+
+    assert stats["evicted_bytes"] == 100
+    assert os.listdir(tmp_path) == []
+
+
+def test_locked_entries_and_lock_files_are_kept(tmp_path):
+    entry = str(tmp_path / "entry")
+    write_file(entry, 100, 3 * DAY)
+    pending = str(tmp_path / "pending")
+
+    with FileLock.for_file(entry), FileLock.for_file(pending):
+        stats = run(tmp_path, ttl_seconds=DAY)
+        assert stats["evicted_entries"] == 0
+        assert sorted(os.listdir(tmp_path)) == ["entry", "entry.lock", "pending.lock"]
+
+    assert run(tmp_path, ttl_seconds=DAY)["evicted_entries"] == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_temporary_files_are_kept_during_the_grace_period(tmp_path):
+    write_file(str(tmp_path / ".entry.1.2.tmp"), 100, CacheJanitor.TEMP_FILE_GRACE_SECONDS / 2)
+    write_file(str(tmp_path / ".entry.3.4.tmp"), 100, CacheJanitor.TEMP_FILE_GRACE_SECONDS * 2)
+
+    stats = run(tmp_path, max_bytes=0)
+
+    assert stats["scanned_bytes"] == 200
+    assert stats["evicted_bytes"] == 100
+    assert stats["remaining_bytes"] == 100
+    assert os.listdir(tmp_path) == [".entry.1.2.tmp"]
+
+
+def get_blob_paths(directory):
+    blob_folder = os.path.join(directory, CacheStorage.BLOB_FOLDER)
+    return [os.path.join(root, file_name) for root, _, file_names in os.walk(blob_folder) for file_name in file_names]
+
+
+def test_blobs_are_evicted_with_their_last_reference(tmp_path):
+    payload = b"p" * 1000
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    CacheStorage.write(first, payload, deduplicate=True)
+    CacheStorage.write(second, payload, deduplicate=True)
+    blob_path, = get_blob_paths(tmp_path)
+    set_age(first, 3 * DAY)
+    set_age(second, 2 * DAY)
+    set_age(blob_path, 3 * DAY)
+    reference_size = os.path.getsize(first)
+
+    # the blob is counted once and it's not evicted while it is referred to
+    stats = run(tmp_path, max_bytes=1000 + reference_size)
+    assert stats["scanned_bytes"] == 1000 + 2 * reference_size
+    assert stats["evicted_entries"] == 1
+    assert not os.path.exists(first)
+    assert CacheStorage.read(second) == payload
+
+    stats = run(tmp_path, max_bytes=1000)
+    assert stats["evicted_entries"] == 2
+    assert stats["evicted_bytes"] == 1000 + reference_size
+    assert not os.path.exists(second)
+    assert get_blob_paths(tmp_path) == []
+
+
+def test_blobs_without_references_are_kept_during_the_grace_period(tmp_path):
+    CacheStorage.write(str(tmp_path / "entry"), b"p" * 1000, deduplicate=True)
+    os.remove(tmp_path / "entry")
+    blob_path, = get_blob_paths(tmp_path)
+
+    assert run(tmp_path, max_bytes=0)["evicted_entries"] == 0
+    assert get_blob_paths(tmp_path) == [blob_path]
+
+    set_age(blob_path, CacheJanitor.TEMP_FILE_GRACE_SECONDS * 2)
+    assert run(tmp_path, max_bytes=0)["evicted_bytes"] == 1000
+    assert get_blob_paths(tmp_path) == []
+
+
+def test_blob_referred_to_again_is_kept(tmp_path, monkeypatch):
+    payload = b"p" * 1000
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    CacheStorage.write(first, payload, deduplicate=True)
+    blob_path, = get_blob_paths(tmp_path)
+    set_age(first, 3 * DAY)
+    set_age(blob_path, 3 * DAY)
+
+    janitor = CacheJanitor([CacheQuota(str(tmp_path), max_bytes=0)])
+    collect_entries = janitor._collect_entries
+
+    def collect_entries_then_write(*args):
+        # a cache file starts referring to the blob after the janitor scanned the folder
+        result = collect_entries(*args)
+        CacheStorage.write(second, payload, deduplicate=True)
+        return result
+
+    monkeypatch.setattr(janitor, "_collect_entries", collect_entries_then_write)
+    janitor.run_once()
+
+    assert not os.path.exists(first)
+    assert CacheStorage.read(second) == payload
+
+
+def test_quota_sweep_keeps_referenced_blobs(tmp_path):
+    live, orphan = str(tmp_path / "live"), str(tmp_path / "orphan")
+    CacheStorage.write(live, b"l" * 1000, deduplicate=True)
+    live_blob_path, = get_blob_paths(tmp_path)
+    CacheStorage.write(orphan, b"o" * 1000, deduplicate=True)
+    os.remove(orphan)
+    orphan_blob_path, = set(get_blob_paths(tmp_path)) - {live_blob_path}
+    # the referenced blob is the least recently used file
+    set_age(live_blob_path, 3 * DAY)
+    set_age(orphan_blob_path, CacheJanitor.TEMP_FILE_GRACE_SECONDS * 2)
+    reference_size = os.path.getsize(live)
+
+    stats = run(tmp_path, max_bytes=1000 + reference_size)
+
+    assert stats["evicted_bytes"] == 1000
+    assert get_blob_paths(tmp_path) == [live_blob_path]
+    assert CacheStorage.read(live) == b"l" * 1000
@@ -0,0 +1,187 @@
+import asyncio
+import time
+import pytest
+from aiecommon.Exceptions import AieException
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+from aiecommon.SolarUtils.CircuitBreaker import CircuitBreaker
+from aiecommon.SolarUtils.ExternalApiBase import ExternalApiBase
+from aiecommon.SolarUtils.RetryBudget import RetryBudget
+
+RECOVERY_TIMEOUT = 0.2
+
+
+def wait_for_recovery():
+    time.sleep(RECOVERY_TIMEOUT + 0.05)
+
+
+def test_circuit_opens_after_consecutive_failures():
+    circuit_breaker = CircuitBreaker("opens", failure_threshold=3, recovery_timeout=RECOVERY_TIMEOUT)
+
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    # a success resets the consecutive failures
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.allow_request()
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_CLOSED
+
+    circuit_breaker.record_failure()
+    assert circuit_breaker.is_open()
+    assert not circuit_breaker.allow_request()
+    assert circuit_breaker.get_stats() == {"state": CircuitBreaker.STATE_OPEN, "consecutive_failures": 3, "opened_count": 1, "rejected_count": 1}
+
+
+def test_half_open_probe_closes_or_reopens_the_circuit():
+    circuit_breaker = CircuitBreaker("probe", failure_threshold=1, recovery_timeout=RECOVERY_TIMEOUT)
+    circuit_breaker.record_failure()
+
+    wait_for_recovery()
+    assert not circuit_breaker.is_open()
+    assert circuit_breaker.allow_request()
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_HALF_OPEN
+    # only one probe at a time
+    assert not circuit_breaker.allow_request()
+
+    circuit_breaker.record_failure()
+    assert circuit_breaker.is_open()
+    assert circuit_breaker.get_stats()["opened_count"] == 2
+
+    wait_for_recovery()
+    assert circuit_breaker.allow_request()
+    circuit_breaker.record_success()
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_CLOSED
+    assert circuit_breaker.allow_request() and circuit_breaker.allow_request()
+
+
+def test_released_probe_can_be_taken_again():
+    circuit_breaker = CircuitBreaker("release", failure_threshold=1, recovery_timeout=RECOVERY_TIMEOUT)
+    circuit_breaker.record_failure()
+    wait_for_recovery()
+
+    assert circuit_breaker.allow_request()
+    circuit_breaker.release_probe()
+    assert circuit_breaker.allow_request()
+    assert not circuit_breaker.allow_request()
+
+
+def test_probe_that_does_not_report_back_is_given_up():
+    circuit_breaker = CircuitBreaker("lost_probe", failure_threshold=1, recovery_timeout=RECOVERY_TIMEOUT)
+    circuit_breaker.record_failure()
+    wait_for_recovery()
+
+    assert circuit_breaker.allow_request()
+    assert not circuit_breaker.allow_request()
+
+    wait_for_recovery()
+    assert circuit_breaker.allow_request()
+    circuit_breaker.record_success()
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_CLOSED
+
+
+def test_retry_budget_is_exhausted_by_retries():
+    retry_budget = RetryBudget("exhausted", retry_ratio=0.5, min_retries=1, window_seconds=RECOVERY_TIMEOUT)
+
+    for _ in range(4):
+        retry_budget.record_attempt()
+    # 0.5 * 4 attempts + 1
+    assert all(retry_budget.try_acquire_retry() for _ in range(3))
+    assert not retry_budget.try_acquire_retry()
+    assert retry_budget.get_stats() == {"attempts": 4, "retries": 3, "rejected_count": 1}
+
+    # attempts and retries leave the window
+    time.sleep(RECOVERY_TIMEOUT + 0.05)
+    assert retry_budget.try_acquire_retry()
+
+
+class FlakyApi(ExternalApiBase):
+
+    STORAGE_FOLDER = "flaky_api"
+    API_IDENTIFIER = "FlakyApi"
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 2
+    CIRCUIT_BREAKER_RECOVERY_TIMEOUT = RECOVERY_TIMEOUT
+
+    @staticmethod
+    def _get_cache_key(params: dict):
+        return str(params["key"])
+
+    @staticmethod
+    def _serialize_cache(data, params: dict) -> bytes:
+        return data
+
+    @staticmethod
+    def _deserialize_cache(payload: bytes, params: dict):
+        return payload
+
+    @staticmethod
+    def _check_cache(cached_result, params: dict):
+        return True
+
+
+@pytest.fixture
+def flaky_api(monkeypatch):
+    monkeypatch.setattr(FlakyApi, "_get_retry_sleep_interval", lambda self, retry_count, max_retries: 0)
+    return FlakyApi(max_retries=3, min_result_size=0)
+
+
+def call(api, fetch, key, ignore_cache=None):
+    return api.call_api(fetch, {"key": key}, lambda result_data, params: len(result_data), ignore_cache=ignore_cache)
+
+
+def test_stale_cache_is_served_while_the_circuit_is_open(flaky_api):
+    calls = []
+
+    def fetch(max_retries, retry_count, key):
+        calls.append(key)
+        if len(calls) > 1:
+            raise ConnectionError("unavailable")
+        return b"cached"
+
+    assert call(flaky_api, fetch, "stale") == b"cached"
+
+    # the retries open the circuit, the cached result is returned instead of failing
+    assert call(flaky_api, fetch, "stale", ignore_cache=True) == b"cached"
+    assert calls == ["stale"] * 3
+
+    # while open, the api isn't called
+    assert call(flaky_api, fetch, "stale", ignore_cache=True) == b"cached"
+    with pytest.raises(AieException) as exception_info:
+        call(flaky_api, fetch, "uncached")
+    assert exception_info.value.code == AieException.EXTERNAL_API_FAILED
+    assert calls == ["stale"] * 3
+
+    metrics = ApiMetrics.get(FlakyApi.API_IDENTIFIER)
+    assert metrics.get_count("stale_hits") == 2
+    assert metrics.get_count("fetch_errors") == 2
+
+
+class CancelledProbeApi(FlakyApi):
+
+    STORAGE_FOLDER = "cancelled_probe_api"
+    API_IDENTIFIER = "CancelledProbeApi"
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 1
+    SINGLE_FLIGHT = False
+
+
+def test_cancelled_probe_is_given_back():
+    api = CancelledProbeApi(max_retries=0, min_result_size=0)
+    circuit_breaker = CircuitBreaker.get(CancelledProbeApi.API_IDENTIFIER, 1, RECOVERY_TIMEOUT)
+    circuit_breaker.record_failure()
+    wait_for_recovery()
+
+    async def hanging_fetch(max_retries, retry_count, key):
+        await asyncio.sleep(10)
+
+    async def fetch(max_retries, retry_count, key):
+        return b"result"
+
+    async def main():
+        probe = asyncio.ensure_future(api.call_api_async(hanging_fetch, {"key": 1}, lambda result_data, params: len(result_data)))
+        await asyncio.sleep(0.1)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return await api.call_api_async(fetch, {"key": 2}, lambda result_data, params: len(result_data))
+
+    assert asyncio.run(main()) == b"result"
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_CLOSED
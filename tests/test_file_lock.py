@@ -0,0 +1,78 @@
+import gc
+import multiprocessing
+import os
+import threading
+import time
+import pytest
+from aiecommon.FileSystem import FileLock
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="lock files are only used where fcntl (and fork) is available")
+
+
+def get_thread_locks():
+    return FileLock._FileLock__thread_locks
+
+
+def test_lock_file_and_thread_lock_are_removed_after_release(tmp_path):
+    file_path = str(tmp_path / "data")
+
+    for _ in range(3):
+        with FileLock.for_file(file_path):
+            assert os.path.exists(file_path + FileLock.LOCK_FILE_SUFFIX)
+        assert not os.path.exists(file_path + FileLock.LOCK_FILE_SUFFIX)
+
+    gc.collect()
+    assert os.path.abspath(file_path + FileLock.LOCK_FILE_SUFFIX) not in get_thread_locks()
+
+
+def test_thread_locks_of_many_paths_are_pruned(tmp_path):
+    for i in range(1000):
+        with FileLock.for_file(str(tmp_path / f"data_{i}")):
+            pass
+
+    gc.collect()
+    assert not [path for path in get_thread_locks().keys() if path.startswith(str(tmp_path))]
+    assert not os.listdir(tmp_path)
+
+
+def test_lock_is_exclusive_between_threads(tmp_path):
+    file_path = str(tmp_path / "data")
+    lock = FileLock.for_file(file_path)
+    assert lock.acquire()
+    try:
+        # another FileLock of the same path, in another thread
+        results = []
+        thread = threading.Thread(target=lambda: results.append(FileLock.for_file(file_path).acquire(timeout=0.1)))
+        thread.start()
+        thread.join()
+        assert results == [False]
+    finally:
+        lock.release()
+
+
+def increment_counter(counter_file_path: str, increments: int):
+    for _ in range(increments):
+        with FileLock.for_file(counter_file_path):
+            with open(counter_file_path) as file:
+                count = int(file.read())
+            time.sleep(0.0005)
+            with open(counter_file_path, "w") as file:
+                file.write(str(count + 1))
+
+
+def test_lock_is_exclusive_between_processes_while_lock_files_are_removed(tmp_path):
+    counter_file_path = str(tmp_path / "counter")
+    with open(counter_file_path, "w") as file:
+        file.write("0")
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=increment_counter, args=(counter_file_path, 50)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    with open(counter_file_path) as file:
+        assert int(file.read()) == 200
+    assert not os.path.exists(counter_file_path + FileLock.LOCK_FILE_SUFFIX)
@@ -0,0 +1,82 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from aiecommon.SolarUtils.GeoTiffRaster import GeoTiffRaster
+from aiecommon.SolarUtils.GoogleSolarApi import GoogleSolarApi
+
+LATITUDE, LONGITUDE = 40.4168, -3.7038
+EPSG = 32630
+PIXEL_SIZE = 0.5
+
+
+def make_source_georeference(half_size_meters: float) -> dict:
+    easting, northing = GeoTiffRaster.project_utm(LATITUDE, LONGITUDE, EPSG)
+    return {
+        "model_pixel_scale": [PIXEL_SIZE, PIXEL_SIZE, 0.0],
+        "model_tiepoint": [0.0, 0.0, 0.0, easting - half_size_meters, northing + half_size_meters, 0.0],
+        "geo_key_directory": [1, 1, 0, 4, 1024, 0, 1, 1, 1025, 0, 1, 1, 3072, 0, 1, EPSG, 3076, 0, 1, 9001],
+        "geo_double_params": 6378137.0,
+        "geo_ascii_params": "WGS 84 / UTM zone 30N|WGS 84|",
+        "gdal_metadata": '<GDALMetadata><Item name="AREA_OR_POINT">Area</Item></GDALMetadata>',
+        "gdal_nodata": "-9999",
+    }
+
+
+def read_tiff(tiff_data: bytes) -> tuple:
+    with Image.open(io.BytesIO(tiff_data)) as img:
+        return np.asarray(img), GeoTiffRaster.read_georeference(img)
+
+
+def test_tags_survive_a_tiff_round_trip():
+    georeference = make_source_georeference(50)
+    raster = np.arange(200 * 200, dtype=np.float32).reshape(200, 200)
+
+    read_raster, read_georeference = read_tiff(GeoTiffRaster.to_tiff(raster, georeference))
+
+    np.testing.assert_array_equal(read_raster, raster)
+    assert read_georeference == georeference
+
+
+@pytest.fixture
+def source_raster():
+    params = {"latitude": LATITUDE, "longitude": LONGITUDE, "radius_meters": 50, "endpoint_identifier": GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM}
+    raster = np.random.default_rng(0).uniform(600, 700, (200, 200)).astype(np.float32)
+    raster[:10, :10] = -9999
+    georeference = make_source_georeference(50)
+    # creates the cache directory
+    GoogleSolarApi()
+    GoogleSolarApi._save_cache(params, GeoTiffRaster.to_tiff(raster, georeference))
+    return params, raster, georeference
+
+
+def test_cropped_cache_entry_keeps_tags_and_nodata(source_raster):
+    source_params, source, source_georeference = source_raster
+    params = {**source_params, "radius_meters": 20}
+
+    assert GoogleSolarApi()._crop_from_cache(params, source_params)
+
+    with open(GoogleSolarApi._get_cache_file_path(params), "rb") as file:
+        cropped, cropped_georeference = read_tiff(GoogleSolarApi._deserialize_cache(file.read(), params))
+
+    # the 40 m square around the center of the 100 m source
+    row_start, column_start = 60, 60
+    np.testing.assert_array_equal(cropped, source[row_start:row_start + 80, column_start:column_start + 80])
+    for name in ["model_pixel_scale", "geo_key_directory", "geo_double_params", "geo_ascii_params", "gdal_metadata", "gdal_nodata"]:
+        assert cropped_georeference[name] == source_georeference[name]
+    assert cropped_georeference["model_tiepoint"][3:5] == pytest.approx([
+        source_georeference["model_tiepoint"][3] + column_start * PIXEL_SIZE,
+        source_georeference["model_tiepoint"][4] - row_start * PIXEL_SIZE,
+    ])
+
+
+def test_crop_moves_the_model_transformation():
+    georeference = make_source_georeference(50)
+    origin_x, origin_y = georeference["model_tiepoint"][3:5]
+    georeference["model_transformation"] = [PIXEL_SIZE, 0.0, 0.0, origin_x, 0.0, -PIXEL_SIZE, 0.0, origin_y, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+
+    _, cropped_georeference = GeoTiffRaster.crop(np.zeros((200, 200), np.float32), georeference, (30, 70, 20, 60))
+
+    transformation = cropped_georeference["model_transformation"]
+    assert transformation[3] == pytest.approx(origin_x + 20 * PIXEL_SIZE)
+    assert transformation[7] == pytest.approx(origin_y - 30 * PIXEL_SIZE)
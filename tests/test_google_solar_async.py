@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+import numpy as np
+import pytest
+from aiecommon.SolarUtils.GeoTiffRaster import GeoTiffRaster
+from aiecommon.SolarUtils.GoogleSolarApi import GoogleSolarApi
+from .stubs import FakeResponse
+
+DSM_URL = "https://solar.googleapis.com/v1/geoTiff:get?id=dsm"
+MASK_URL = "https://solar.googleapis.com/v1/geoTiff:get?id=mask"
+LAYERS_INFO = {"imageryQuality": "HIGH", "dsmUrl": DSM_URL, "maskUrl": MASK_URL}
+REQUEST_SECONDS = 0.05
+
+
+def make_tiff(value: float) -> bytes:
+    return GeoTiffRaster.to_tiff(np.full((64, 64), value, dtype=np.float32), {"model_pixel_scale": [0.25, 0.25, 0.0], "model_tiepoint": [0.0] * 6})
+
+
+@pytest.fixture
+def solar_api(monkeypatch):
+    """
+    GoogleSolarApi over a stubbed transport, every request takes REQUEST_SECONDS, the urls of the requests are recorded
+    """
+    responses = {
+        GoogleSolarApi.DATALAYERS_BASE_URL: FakeResponse(200, json_data=LAYERS_INFO),
+        DSM_URL: FakeResponse(200, make_tiff(600)),
+        MASK_URL: FakeResponse(200, make_tiff(1)),
+    }
+    requests = []
+    lock = threading.Lock()
+
+    def http_get(cls, url, params=None, **kwargs):
+        with lock:
+            requests.append(url)
+        time.sleep(REQUEST_SECONDS)
+        return responses[url]
+
+    monkeypatch.setattr(GoogleSolarApi, "_http_get", classmethod(http_get))
+    return GoogleSolarApi(max_retries=0), requests
+
+
+def test_get_data_async_matches_get_data(solar_api):
+    api, requests = solar_api
+
+    expected = api.get_data(47.1, 5.5, 25, False)
+    assert sorted(requests) == sorted([GoogleSolarApi.DATALAYERS_BASE_URL, DSM_URL, MASK_URL])
+    requests.clear()
+
+    data = asyncio.run(api.get_data_async(47.2, 5.5, 25, False))
+
+    assert data["layers_info"] == expected["layers_info"] == LAYERS_INFO
+    assert data["dsm_data"] == expected["dsm_data"]
+    assert data["mask_data"] == expected["mask_data"]
+    # the TIFFs are requested once the data layers answered
+    assert requests[0] == GoogleSolarApi.DATALAYERS_BASE_URL
+    assert sorted(requests[1:]) == [DSM_URL, MASK_URL]
+
+    timings = data["timings"]
+    assert set(timings) == {"cache_probe_seconds", "layers_seconds", "dsm_seconds", "mask_seconds", "total_seconds"}
+    assert all(seconds is not None for seconds in timings.values())
+    assert timings["layers_seconds"] >= REQUEST_SECONDS
+    assert timings["dsm_seconds"] >= REQUEST_SECONDS and timings["mask_seconds"] >= REQUEST_SECONDS
+    # the TIFFs are downloaded concurrently
+    assert timings["layers_seconds"] + max(timings["dsm_seconds"], timings["mask_seconds"]) <= timings["total_seconds"] < 4 * REQUEST_SECONDS + 1
+
+
+def test_get_data_async_of_cached_location(solar_api):
+    api, requests = solar_api
+    expected = api.get_data(47.3, 5.5, 25, False)
+    requests.clear()
+
+    cached = api.get_data(47.3, 5.5, 25, False)
+    data = asyncio.run(api.get_data_async(47.3, 5.5, 25, False))
+
+    assert requests == []
+    assert data["layers_info"] is None and cached["layers_info"] is None
+    assert data["dsm_data"] == cached["dsm_data"] == expected["dsm_data"]
+    assert data["mask_data"] == cached["mask_data"] == expected["mask_data"]
+    timings = data["timings"]
+    assert timings["cache_probe_seconds"] is not None and timings["total_seconds"] is not None
+    assert timings["layers_seconds"] is None and timings["dsm_seconds"] is None and timings["mask_seconds"] is None
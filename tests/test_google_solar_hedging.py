@@ -0,0 +1,94 @@
+import time
+import pytest
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+from aiecommon.SolarUtils.GoogleSolarApi import GoogleSolarApi
+from .stubs import FakeResponse
+
+TIFF_URL = "https://solar.googleapis.com/v1/geoTiff:get?id=dsm"
+CHUNK_SIZE = 256
+# 20 chunks, a slow response takes 2 seconds
+TIFF = bytes(range(256)) * 20
+SLOW_CHUNK_DELAY_SECONDS = 0.1
+HEDGE_DELAY_SECONDS = 0.2
+
+
+@pytest.fixture
+def solar_api(monkeypatch):
+    """
+    GoogleSolarApi over a stubbed transport answering with the responses in the returned list, one per request
+    """
+    responses = []
+    sent = []
+
+    def http_get(cls, url, params=None, **kwargs):
+        response = responses[len(sent)]
+        sent.append(response)
+        return response
+
+    monkeypatch.setattr(GoogleSolarApi, "_http_get", classmethod(http_get))
+    monkeypatch.setattr(GoogleSolarApi, "DOWNLOAD_CHUNK_SIZE", CHUNK_SIZE)
+    monkeypatch.setattr(GoogleSolarApi, "HEDGE_MIN_DELAY_SECONDS", 0)
+    monkeypatch.setattr(GoogleSolarApi, "HEDGE_DEFAULT_DELAY_SECONDS", HEDGE_DELAY_SECONDS)
+    monkeypatch.setattr(GoogleSolarApi, "TIFF_DEADLINE_SECONDS", 5)
+    ApiMetrics.reset()
+    yield GoogleSolarApi(), responses, sent
+    ApiMetrics.reset()
+
+
+def fetch_tiff(api):
+    return api._fetch_tiff(0, 0, GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM, 40.4, -3.7, 25, TIFF_URL)
+
+
+def get_metrics():
+    return ApiMetrics.get(GoogleSolarApi.API_IDENTIFIER, GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM)
+
+
+def test_fast_request_is_not_hedged(solar_api):
+    api, responses, sent = solar_api
+    responses.append(FakeResponse(200, TIFF))
+
+    assert fetch_tiff(api) == TIFF
+    # the hedge timer would have fired by now
+    time.sleep(HEDGE_DELAY_SECONDS + 0.1)
+
+    assert len(sent) == 1
+    assert get_metrics().get_count("hedges_fired") == 0
+    assert get_metrics().get_count("request_seconds") == 1
+
+
+def test_hedge_wins_over_a_slow_request(solar_api):
+    api, responses, sent = solar_api
+    slow_response = FakeResponse(200, TIFF, chunk_delay_seconds=SLOW_CHUNK_DELAY_SECONDS)
+    responses.extend([slow_response, FakeResponse(200, TIFF)])
+
+    start = time.monotonic()
+    assert fetch_tiff(api) == TIFF
+    elapsed = time.monotonic() - start
+
+    # the slow request is given up at its next chunk
+    assert elapsed < 1
+    assert slow_response.chunks_read < len(TIFF) // CHUNK_SIZE
+    assert slow_response.closed
+
+    metrics = get_metrics()
+    assert metrics.get_count("hedges_fired") == 1
+    assert metrics.get_count("hedges_won") == 1
+    assert metrics.get_count("hedge_saved_seconds") == 1
+    assert HEDGE_DELAY_SECONDS * 0.5 <= metrics.percentile("hedge_saved_seconds", 50) <= elapsed
+
+
+def test_slow_request_fails_at_the_deadline(solar_api, monkeypatch):
+    api, responses, sent = solar_api
+    monkeypatch.setattr(GoogleSolarApi, "HEDGE_PERCENTILE", None)
+    monkeypatch.setattr(GoogleSolarApi, "TIFF_DEADLINE_SECONDS", 0.3)
+    slow_response = FakeResponse(200, TIFF, chunk_delay_seconds=SLOW_CHUNK_DELAY_SECONDS)
+    responses.append(slow_response)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        fetch_tiff(api)
+
+    assert time.monotonic() - start < 1
+    assert slow_response.closed
+    assert len(sent) == 1
+    assert get_metrics().get_count("deadline_exceeded") == 1
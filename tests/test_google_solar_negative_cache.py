@@ -0,0 +1,89 @@
+import os
+import time
+import numpy as np
+import pytest
+from aiecommon.Exceptions import AieException
+from aiecommon.SolarUtils.GeoTiffRaster import GeoTiffRaster
+from aiecommon.SolarUtils.GoogleSolarApi import GoogleSolarApi
+from .stubs import FakeResponse
+
+DSM_URL = "https://solar.googleapis.com/v1/geoTiff:get?id=dsm"
+
+
+@pytest.fixture
+def solar_api(monkeypatch):
+    """
+    GoogleSolarApi over a stubbed transport: the MEDIUM quality request finds nothing (404), the EXPANDED_COVERAGE one
+    finds the location while found is True. Requests are recorded as (url, requiredQuality).
+    """
+    tiff = GeoTiffRaster.to_tiff(np.zeros((64, 64), dtype=np.float32), {"model_pixel_scale": [0.25, 0.25, 0.0], "model_tiepoint": [0.0] * 6})
+    state = {"requests": [], "found": True}
+
+    def http_get(cls, url, params=None, **kwargs):
+        state["requests"].append((url, (params or {}).get("requiredQuality")))
+        if url == DSM_URL:
+            return FakeResponse(200, tiff)
+        if params["requiredQuality"] == "BASE" and state["found"]:
+            return FakeResponse(200, json_data={"imageryQuality": "BASE", "dsmUrl": DSM_URL, "maskUrl": DSM_URL.replace("dsm", "mask")})
+        return FakeResponse(404, b'{"error": {"code": 404, "status": "NOT_FOUND"}}')
+
+    monkeypatch.setattr(GoogleSolarApi, "_http_get", classmethod(http_get))
+    return GoogleSolarApi(max_retries=0), state
+
+
+def get_dsm(api, latitude, use_google_experimental):
+    return api.get_data(latitude, -3.7, 25, use_google_experimental, endpoint_identifiers=[GoogleSolarApi.ENDPOINT_IDENTIFIER_DSM])
+
+
+def test_expanded_coverage_is_requested_after_a_medium_404(solar_api):
+    api, state = solar_api
+
+    with pytest.raises(AieException) as exception_info:
+        get_dsm(api, 40.1, False)
+    assert exception_info.value.code == AieException.HOUSE_NOT_LOCATED
+    assert not exception_info.value.data.get("negative_cache")
+
+    # the MEDIUM quality answer is cached
+    with pytest.raises(AieException) as exception_info:
+        get_dsm(api, 40.1, False)
+    assert exception_info.value.data["negative_cache"]
+    assert state["requests"] == [(GoogleSolarApi.DATALAYERS_BASE_URL, "MEDIUM")]
+
+    # but doesn't stop the EXPANDED_COVERAGE fallback
+    data = get_dsm(api, 40.1, True)
+    assert data["layers_info"]["imageryQuality"] == "BASE"
+    assert data["dsm_data"]
+    assert state["requests"][1:] == [(GoogleSolarApi.DATALAYERS_BASE_URL, "BASE"), (DSM_URL, None)]
+
+
+def test_negative_cache_expires(solar_api, monkeypatch):
+    api, state = solar_api
+    monkeypatch.setattr(GoogleSolarApi, "NEGATIVE_CACHE_TTL_SECONDS", 0.2)
+
+    for _ in range(2):
+        with pytest.raises(AieException):
+            get_dsm(api, 40.2, False)
+    assert len(state["requests"]) == 1
+
+    time.sleep(0.3)
+    with pytest.raises(AieException) as exception_info:
+        get_dsm(api, 40.2, False)
+    assert not exception_info.value.data.get("negative_cache")
+    assert len(state["requests"]) == 2
+
+
+def test_negative_cache_is_removed_when_data_is_saved(solar_api):
+    api, state = solar_api
+    state["found"] = False
+    params = GoogleSolarApi._get_layers_info_api_call_params(40.3, -3.7, 25, True)
+
+    with pytest.raises(AieException):
+        get_dsm(api, 40.3, True)
+    assert os.path.exists(GoogleSolarApi._get_negative_cache_file_path(params))
+
+    # the location is covered now, a call that ignores the cache saves its data layers
+    state["found"] = True
+    assert api.get_layers_info(40.3, -3.7, 25, True, ignore_cache=True)["imageryQuality"] == "BASE"
+    assert not os.path.exists(GoogleSolarApi._get_negative_cache_file_path(params))
+
+    assert get_dsm(api, 40.3, True)["dsm_data"]
@@ -0,0 +1,137 @@
+import csv
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import pytest
+from aiecommon.SolarUtils import prefetch
+from aiecommon.SolarUtils.PvGis import PvGis
+
+
+def make_tmy_response(latitude: float, longitude: float) -> bytes:
+    times = pd.date_range("2018-01-01 00:00", periods=8760, freq="h", tz="UTC")
+    rng = np.random.default_rng(0)
+    hourly = [
+        {
+            "time(UTC)": time.strftime("%Y%m%d:%H%M"),
+            "T2m": round(float(temperature), 2),
+            "RH": 60.0,
+            "G(h)": round(float(ghi), 2),
+            "Gb(n)": round(float(ghi) * 0.7, 2),
+            "Gd(h)": round(float(ghi) * 0.3, 2),
+            "IR(h)": 300.0,
+            "WS10m": 3.0,
+            "WD10m": 180.0,
+            "SP": 101000.0,
+        }
+        for time, temperature, ghi in zip(times, rng.uniform(-5, 35, len(times)), rng.uniform(0, 1000, len(times)))
+    ]
+    return json.dumps({
+        "inputs": {"location": {"latitude": latitude, "longitude": longitude, "elevation": 600.0}, "meteo_data": {}},
+        "outputs": {"months_selected": [{"month": month, "year": 2018} for month in range(1, 13)], "tmy_hourly": hourly},
+        "meta": {"inputs": {}, "outputs": {}},
+    }).encode()
+
+
+class PvGisHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        location = (float(query["lat"][0]), float(query["lon"][0]))
+        self.server.requests.append(location)
+
+        if url.path != "/api/tmy":
+            status, body = 404, b"{}"
+        elif location in self.server.failing_locations:
+            status, body = 400, json.dumps({"status": 400, "message": "Location over the sea. Please, select another location"}).encode()
+        else:
+            status, body = 200, make_tmy_response(*location)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def pvgis_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PvGisHandler)
+    server.requests = []
+    server.failing_locations = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_port}/api/"
+    server.shutdown()
+    server.server_close()
+
+
+def make_rows(locations):
+    return [{"latitude": str(latitude), "longitude": str(longitude), "country_code": "ES"} for latitude, longitude in locations]
+
+
+def make_prefetcher(api_url, state_file_path):
+    return prefetch.Prefetcher([prefetch.API_PVGIS], concurrency=2, state_file_path=str(state_file_path), max_retries=0, min_retry_delay=0, pvgis_api_url=api_url)
+
+
+def test_prefetch_fills_the_cache(pvgis_server, tmp_path):
+    server, api_url = pvgis_server
+    locations = [(41.001, 2.001), (41.002, 2.002), (41.003, 2.003)]
+    # duplicates are fetched once
+    rows = make_rows(locations + locations[:1])
+
+    stats = make_prefetcher(api_url, tmp_path / "state").run(rows, stats_interval_seconds=0)
+
+    assert stats["fetched"] == 3 and stats["duplicates"] == 1 and stats["failed"] == 0
+    assert sorted(server.requests) == locations
+    for latitude, longitude in locations:
+        result = PvGis("ES", api_url=api_url).get_solar_components(latitude, longitude)
+        assert len(result) == 8760
+    # served from the cache
+    assert len(server.requests) == 3
+
+
+def test_prefetch_resumes_after_interruption(pvgis_server, tmp_path):
+    server, api_url = pvgis_server
+    locations = [(42.001, 2.001), (42.002, 2.002), (42.003, 2.003), (42.004, 2.004)]
+    rows = make_rows(locations)
+
+    def interrupted_rows():
+        yield from rows[:2]
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        make_prefetcher(api_url, tmp_path / "state").run(interrupted_rows(), stats_interval_seconds=0)
+    assert sorted(server.requests) == locations[:2]
+
+    stats = make_prefetcher(api_url, tmp_path / "state").run(rows, stats_interval_seconds=0)
+
+    assert stats["already_completed"] == 2 and stats["fetched"] == 2 and stats["failed"] == 0
+    assert sorted(server.requests) == locations
+
+
+def test_prefetch_reports_failures(pvgis_server, tmp_path, capsys):
+    server, api_url = pvgis_server
+    locations = [(43.001, 2.001), (43.002, 2.002)]
+    server.failing_locations.add(locations[1])
+    coordinates_file_path = tmp_path / "coordinates.csv"
+    with open(coordinates_file_path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["latitude", "longitude", "country_code"])
+        writer.writeheader()
+        writer.writerows(make_rows(locations))
+
+    arguments = [str(coordinates_file_path), "--apis", "pvgis", "--pvgis-api-url", api_url, "--max-retries", "0", "--min-retry-delay", "0", "--stats-interval", "0"]
+    assert prefetch.main(arguments) == 1
+    assert "fetched=1, failed=1" in capsys.readouterr().out.splitlines()[-1]
+
+    # only the failed location is fetched again
+    server.failing_locations.clear()
+    assert prefetch.main(arguments) == 0
+    assert "already_completed=1, hits=0, misses=1, fetched=1, failed=0" in capsys.readouterr().out
+    assert sorted(server.requests) == [locations[0], locations[1], locations[1]]
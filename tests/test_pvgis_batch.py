@@ -0,0 +1,86 @@
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from aiecommon.Exceptions import AieException
+from aiecommon.SolarUtils.PvGis import PvGis
+
+FAILING_LATITUDE = 46.9
+
+
+def make_tmy(latitude: float) -> pd.DataFrame:
+    index = pd.date_range("2018-01-01 00:00", periods=8760, freq="h", tz="Europe/Madrid")
+    rng = np.random.default_rng(int(round(latitude * 1000)))
+    return pd.DataFrame({
+        "ghi": rng.uniform(0, 1000, len(index)),
+        "dni": rng.uniform(0, 900, len(index)),
+        "temp_air": rng.uniform(-5, 35, len(index)),
+    }, index=index)
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """
+    Stubbed PVGIS call, records the fetched latitudes, fails for FAILING_LATITUDE
+    """
+    fetched_latitudes = []
+    lock = threading.Lock()
+
+    def fetch(self, max_retries, retry_count, latitude, longitude, country_code):
+        with lock:
+            fetched_latitudes.append(latitude)
+        if latitude == FAILING_LATITUDE:
+            raise ConnectionError("PVGIS is unavailable")
+        return make_tmy(round(latitude, PvGis.COORDINATES_DECIMAL_PLACES))
+
+    monkeypatch.setattr(PvGis, "_fetch", fetch)
+    return fetched_latitudes
+
+
+def get_batch(latitudes, **kwargs) -> dict:
+    return PvGis("ES", max_retries=0).get_solar_components_batch(latitudes, [5.5] * len(latitudes), **kwargs)
+
+
+def test_failing_site_does_not_fail_the_batch(fetched):
+    latitudes = [46.1, 46.2, FAILING_LATITUDE, 46.3]
+
+    batch = get_batch(latitudes)
+
+    assert batch["stats"] == {"sites": 4, "unique": 4, "hits": 0, "fetched": 3, "failed": 1}
+    assert list(batch["errors"]) == [2]
+    assert batch["errors"][2]["code"] == AieException.EXTERNAL_API_FAILED
+    assert np.isnan(batch["data"][2]).all()
+    # every site gets its own data, whatever order the fetches end in
+    for site, latitude in enumerate(latitudes):
+        if site != 2:
+            np.testing.assert_array_equal(batch["data"][site], make_tmy(latitude)[batch["components"]].to_numpy())
+
+
+def test_identical_sites_are_fetched_once(fetched):
+    # 46.4001 has the same cache key as 46.4
+    latitudes = [46.4, 46.5, 46.4, 46.4001, 46.5]
+
+    batch = get_batch(latitudes)
+
+    assert sorted(fetched) == [46.4, 46.5]
+    assert batch["stats"] == {"sites": 5, "unique": 2, "hits": 0, "fetched": 2, "failed": 0}
+    for site in (2, 3):
+        np.testing.assert_array_equal(batch["data"][site], batch["data"][0])
+    np.testing.assert_array_equal(batch["data"][4], batch["data"][1])
+
+    # all cached now
+    assert get_batch(latitudes)["stats"]["hits"] == 2
+    assert sorted(fetched) == [46.4, 46.5]
+
+
+def test_frame_output_keeps_site_order(fetched):
+    latitudes = [46.8, FAILING_LATITUDE, 46.7, 46.6]
+
+    batch = get_batch(latitudes, output=PvGis.BATCH_OUTPUT_FRAME, components=["ghi"])
+
+    data = batch["data"]
+    assert list(data.index.get_level_values("site").unique()) == [0, 2, 3]
+    assert list(data.columns) == ["ghi"]
+    for site in (0, 2, 3):
+        np.testing.assert_array_equal(data.loc[site, "ghi"].to_numpy(), make_tmy(latitudes[site])["ghi"].to_numpy())
+    assert list(batch["errors"]) == [1]
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+from aiecommon.SolarUtils.PvGis import PvGis
+
+
+def make_tmy(seed: int) -> pd.DataFrame:
+    index = pd.date_range("2018-01-01 00:00", periods=8760, freq="h", tz="Europe/Madrid")
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "ghi": rng.uniform(0, 1000, len(index)),
+        "dni": rng.uniform(0, 900, len(index)),
+        "temp_air": rng.uniform(-5, 35, len(index)),
+    }, index=index)
+
+
+@pytest.fixture(params=[PvGis.CACHE_FORMAT_PICKLE, PvGis.CACHE_FORMAT_COLUMNAR])
+def cached_location(request, monkeypatch):
+    monkeypatch.setattr(PvGis, "CACHE_FORMAT", request.param)
+    # one location per cache format
+    latitude = 40.1 if request.param == PvGis.CACHE_FORMAT_PICKLE else 40.2
+    params = {"latitude": latitude, "longitude": -3.7, "country_code": "ES"}
+    expected = make_tmy(int(latitude * 10))
+    # creates the cache directory
+    PvGis("ES")
+    PvGis._save_cache(params, expected)
+    # values as they are read back from the cache file (columnar files store float32)
+    expected = PvGis._read_cache(PvGis._get_cache_file_path(params), params).copy(deep=True)
+    return params, expected
+
+
+def get_cached(params, **kwargs) -> pd.DataFrame:
+    result = PvGis("ES").get_solar_components(params["latitude"], params["longitude"], params["country_code"], **kwargs)
+    assert result is not None
+    return result
+
+
+def test_cache_hits_are_writable_copies(cached_location):
+    params, expected = cached_location
+
+    # first call reads the cache file, the next ones are memory hits
+    for _ in range(3):
+        result = get_cached(params)
+        result.iloc[0, 0] = -1.0
+        result["ghi"] *= 2
+        result.loc[result.index[1], "dni"] = -2.0
+
+    pd.testing.assert_frame_equal(get_cached(params), expected)
+
+
+def test_shared_cache_hits_are_read_only(cached_location):
+    params, expected = cached_location
+
+    get_cached(params)
+    shared = get_cached(params, copy=False)
+    pd.testing.assert_frame_equal(shared, expected)
+    with pytest.raises(ValueError):
+        shared["ghi"].to_numpy(copy=False)[0] = -1.0
+
+    # changes of a copy don't reach the shared frame
+    result = get_cached(params)
+    result.iloc[0, 0] = -1.0
+    pd.testing.assert_frame_equal(get_cached(params, copy=False), expected)
+
+
+def test_copy_on_return_default(cached_location, monkeypatch):
+    params, expected = cached_location
+    monkeypatch.setattr(PvGis, "MEMORY_CACHE_COPY_ON_RETURN", False)
+
+    get_cached(params)
+    shared = get_cached(params)
+    pd.testing.assert_frame_equal(shared, expected)
+    assert np.shares_memory(shared["ghi"].to_numpy(copy=False), get_cached(params)["ghi"].to_numpy(copy=False))
+    with pytest.raises(ValueError):
+        shared["ghi"].to_numpy(copy=False)[0] = -1.0
+
+    # an explicit copy still gets a writable frame
+    result = get_cached(params, copy=True)
+    result.iloc[0, 0] = -1.0
+    pd.testing.assert_frame_equal(get_cached(params), expected)
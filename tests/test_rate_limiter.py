@@ -0,0 +1,133 @@
+import asyncio
+import time
+import pytest
+from aiecommon.Exceptions import AieException
+from aiecommon.SolarUtils.ApiMetrics import ApiMetrics
+from aiecommon.SolarUtils.CircuitBreaker import CircuitBreaker
+from aiecommon.SolarUtils.ExternalApiBase import ExternalApiBase
+from aiecommon.SolarUtils.RateLimiter import RateLimiter
+
+
+def test_reserve_waits_up_to_max_wait_seconds(tmp_path):
+    rate_limiter = RateLimiter("test", rate_per_second=10, burst=1, state_file_path=str(tmp_path / "state.json"), max_wait_seconds=0.5)
+
+    assert rate_limiter.reserve() == 0
+    assert 0 < rate_limiter.reserve() <= 0.1
+    assert rate_limiter.get_stats()["waited_count"] == 1
+
+
+def test_reserve_beyond_max_wait_seconds_takes_no_token(tmp_path):
+    rate_limiter = RateLimiter("test", rate_per_second=1, burst=1, state_file_path=str(tmp_path / "state.json"), max_wait_seconds=0.5)
+
+    assert rate_limiter.acquire()
+    # the next token is about a second away
+    assert rate_limiter.reserve() is None
+    assert not rate_limiter.acquire()
+
+    stats = rate_limiter.get_stats()
+    assert stats["acquired_count"] == 1
+    assert stats["rejected_count"] == 2
+
+    # turned down calls didn't reserve tokens, the wait is still for the next token only
+    rate_limiter.max_wait_seconds = 2
+    assert 0.5 < rate_limiter.reserve() <= 1
+
+
+class RateLimitedApi(ExternalApiBase):
+
+    STORAGE_FOLDER = "rate_limited_api"
+    API_IDENTIFIER = "RateLimitedApi"
+    RATE_LIMIT_PER_SECOND = 0.01
+    RATE_LIMIT_BURST = 1
+    RATE_LIMIT_MAX_WAIT_SECONDS = 1
+
+    @staticmethod
+    def _get_cache_key(params: dict):
+        return str(params["key"])
+
+    @staticmethod
+    def _serialize_cache(data, params: dict) -> bytes:
+        return data
+
+    @staticmethod
+    def _deserialize_cache(payload: bytes, params: dict):
+        return payload
+
+    @staticmethod
+    def _check_cache(cached_result, params: dict):
+        return True
+
+
+def test_calls_turned_down_by_the_rate_limiter_are_retried_and_fail(monkeypatch):
+    monkeypatch.setattr(RateLimitedApi, "_get_retry_sleep_interval", lambda self, retry_count, max_retries: 0)
+    api = RateLimitedApi(max_retries=2, min_result_size=0)
+    calls = []
+
+    def fetch(max_retries, retry_count, key):
+        calls.append(key)
+        return b"result"
+
+    def call(key):
+        return api.call_api(fetch, {"key": key}, lambda result_data, params: len(result_data))
+
+    assert call(1) == b"result"
+    with pytest.raises(AieException) as exception_info:
+        call(2)
+
+    assert exception_info.value.code == AieException.EXTERNAL_API_FAILED
+    assert calls == [1]
+    metrics = ApiMetrics.get(RateLimitedApi.API_IDENTIFIER)
+    assert metrics.get_count("rate_limited") == 3
+    assert metrics.get_count("retries") == 2
+    # it's not a failure of the api
+    assert CircuitBreaker.get(RateLimitedApi.API_IDENTIFIER, RateLimitedApi.CIRCUIT_BREAKER_FAILURE_THRESHOLD, RateLimitedApi.CIRCUIT_BREAKER_RECOVERY_TIMEOUT).get_stats()["consecutive_failures"] == 0
+
+
+class HalfOpenRateLimitedApi(RateLimitedApi):
+
+    STORAGE_FOLDER = "half_open_rate_limited_api"
+    API_IDENTIFIER = "HalfOpenRateLimitedApi"
+    RATE_LIMIT_MAX_WAIT_SECONDS = 0.1
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 1
+    CIRCUIT_BREAKER_RECOVERY_TIMEOUT = 0.2
+
+
+class HalfOpenRateLimitedAsyncApi(HalfOpenRateLimitedApi):
+
+    STORAGE_FOLDER = "half_open_rate_limited_async_api"
+    API_IDENTIFIER = "HalfOpenRateLimitedAsyncApi"
+
+
+@pytest.mark.parametrize("api_class, use_async", [(HalfOpenRateLimitedApi, False), (HalfOpenRateLimitedAsyncApi, True)])
+def test_rate_limited_half_open_probe_is_given_back(monkeypatch, api_class, use_async):
+    api = api_class(max_retries=0, min_result_size=0)
+    circuit_breaker = CircuitBreaker.get(api_class.API_IDENTIFIER, api_class.CIRCUIT_BREAKER_FAILURE_THRESHOLD, api_class.CIRCUIT_BREAKER_RECOVERY_TIMEOUT)
+    calls = []
+
+    def fetch(max_retries, retry_count, key):
+        calls.append(key)
+        if key == 1:
+            raise ConnectionError("unavailable")
+        return b"result"
+
+    def call(key):
+        if use_async:
+            return asyncio.run(api.call_api_async(fetch, {"key": key}, lambda result_data, params: len(result_data)))
+        return api.call_api(fetch, {"key": key}, lambda result_data, params: len(result_data))
+
+    # takes the only token and opens the circuit
+    with pytest.raises(AieException):
+        call(1)
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_OPEN
+
+    # the half-open probe is turned down by the rate limiter
+    time.sleep(api_class.CIRCUIT_BREAKER_RECOVERY_TIMEOUT + 0.05)
+    with pytest.raises(AieException):
+        call(2)
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_HALF_OPEN
+
+    # the next call can still probe the api and closes the circuit
+    monkeypatch.setattr(api_class, "_get_rate_limiter", classmethod(lambda cls: None))
+    assert call(3) == b"result"
+    assert calls == [1, 3]
+    assert circuit_breaker.get_stats()["state"] == CircuitBreaker.STATE_CLOSED